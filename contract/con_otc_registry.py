@@ -0,0 +1,137 @@
+I = importlib
+
+# Registry of per-pair OTC shards. Each pair trades on its own con_otc_v3 deployment, so busy pairs do not
+# share listing, fee or guard state. Shards are deployed by the registry owner from con_otc_v3.py (contracts
+# can not submit contracts), attached with set_router, then recorded here.
+
+# State Variables
+owner = Variable()
+shards = Hash(default_value=None) # [token_x, token_y] with token_x < token_y -> shard contract trading that pair
+shard_names = Hash(default_value=None) # registration index -> shard contract
+shard_count = Variable()
+
+MAX_SHARDS = 64 # Fee management loops over every shard in one transaction
+
+shard_interface = [
+    importlib.Func('list_offer', args=('offer_token', 'offer_amount', 'take_token', 'take_amount', 'auto_cross', 'position_hint')),
+    importlib.Func('take_offer', args=('listing_id',)),
+    importlib.Func('take_best', args=('offer_token', 'take_token', 'max_take_amount', 'limit_price')),
+    importlib.Func('adjust_fee', args=('trading_fee_bps',)),
+    importlib.Func('withdraw', args=('token_list',)),
+    importlib.Func('view_earned_fees', args=('token',)),
+]
+
+# Event
+ShardRegisteredEvent = LogEvent(
+    event="ShardRegistered",
+    params={
+        "token_x": {'type':str, 'idx':True},
+        "token_y": {'type':str, 'idx':True},
+        "shard": {'type':str, 'idx':False},
+    })
+
+@construct
+def init():
+    owner.set(ctx.caller)
+    shard_count.set(0)
+
+def pair_key(token_a: str, token_b: str):
+    # Both directions of a pair share one shard, so auto_cross sees the opposite book
+    assert token_a != token_b, "Tokens must differ"
+    if token_a < token_b:
+        return [token_a, token_b]
+    return [token_b, token_a]
+
+
+def shard_for(token_a: str, token_b: str):
+    pair = pair_key(token_a, token_b)
+    shard = shards[pair[0], pair[1]]
+    assert shard is not None, "No shard registered for this pair"
+    return I.import_module(shard)
+
+
+def assert_signed_by_caller():
+    # Shards trust routed calls to act for ctx.signer, so only forward what the signer asked for directly
+    assert ctx.caller == ctx.signer, "Routed calls must come from the signer"
+
+
+@export
+def register_shard(token_a: str, token_b: str, shard: str):
+    assert ctx.caller == owner.get(), "Only owner can call this method!"
+    pair = pair_key(token_a, token_b)
+    assert shards[pair[0], pair[1]] is None, "Pair already has a shard"
+    index = shard_count.get()
+    assert index < MAX_SHARDS, "Registry is full"
+
+    shard_module = I.import_module(shard)
+    assert importlib.enforce_interface(shard_module, shard_interface), 'Shard is not an OTC contract'
+    shard_router = ForeignVariable(foreign_contract=shard, foreign_name='router')
+    assert shard_router.get() == ctx.this, "Shard must set_router to this registry first"
+    shard_owner = ForeignVariable(foreign_contract=shard, foreign_name='owner')
+    assert shard_owner.get() == owner.get(), "Shard must be owned by the registry owner" # Its fees are paid to its owner
+
+    shards[pair[0], pair[1]] = shard
+    shard_names[index] = shard
+    shard_count.set(index + 1)
+
+    ShardRegisteredEvent({"token_x": pair[0], "token_y": pair[1], "shard": shard})
+
+@export
+def get_shard(token_a: str, token_b: str):
+    # The shard is the contract makers and takers approve, it pulls the tokens
+    pair = pair_key(token_a, token_b)
+    return shards[pair[0], pair[1]]
+
+@export
+def list_offer(
+    offer_token: str,
+    offer_amount: float,
+    take_token: str,
+    take_amount: float,
+    auto_cross: bool = False,
+    position_hint: str = ""
+):
+    assert_signed_by_caller()
+    return shard_for(offer_token, take_token).list_offer(
+        offer_token=offer_token,
+        offer_amount=offer_amount,
+        take_token=take_token,
+        take_amount=take_amount,
+        auto_cross=auto_cross,
+        position_hint=position_hint
+    )
+
+@export
+def take_offer(offer_token: str, take_token: str, listing_id: str):
+    assert_signed_by_caller()
+    return shard_for(offer_token, take_token).take_offer(listing_id=listing_id)
+
+@export
+def take_best(offer_token: str, take_token: str, max_take_amount: float, limit_price: float):
+    assert_signed_by_caller()
+    return shard_for(offer_token, take_token).take_best(
+        offer_token=offer_token,
+        take_token=take_token,
+        max_take_amount=max_take_amount,
+        limit_price=limit_price
+    )
+
+@export
+def adjust_fee(trading_fee_bps: int):
+    assert ctx.caller == owner.get(), "Only owner can call this method!"
+    for index in range(shard_count.get()):
+        I.import_module(shard_names[index]).adjust_fee(trading_fee_bps=trading_fee_bps)
+
+@export
+def withdraw(token_list: list):
+    # Each shard pays its earned fees to its owner, which register_shard checked is the registry owner
+    assert ctx.caller == owner.get(), "Only owner can call this method!"
+    for index in range(shard_count.get()):
+        I.import_module(shard_names[index]).withdraw(token_list=token_list)
+
+@export
+def view_earned_fees(token: str):
+    total_earned = decimal("0.0")
+    for index in range(shard_count.get()):
+        total_earned += I.import_module(shard_names[index]).view_earned_fees(token=token)
+    return total_earned
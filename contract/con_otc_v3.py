@@ -2,11 +2,44 @@ random.seed()
 I = importlib
 
 # State Variables
-fee = Variable()
-otc_listing = Hash()
+fee = Variable() # Trading fee in integer basis points (50 = 0.5%)
+otc_listing = Hash() # Amounts and fees are integer units of 10 ** -AMOUNT_DECIMALS, "price" is a sortable key
 owner = Variable()
-earned_fees = Hash(default_value=decimal("0.0"))
-reentrancyGuardActive = Variable(default_value=False) # New state variable for re-entrancy guard
+earned_fees = Hash(default_value=0) # [token, shard] -> fee units accrued in that shard
+fee_shards = Variable() # Number of earned_fees shards per token, trades on different listings write different shards
+reentrancyGuardActive = Hash(default_value=False) # Re-entrancy guard scoped to the transaction signer
+quote_nonces = Hash(default_value=0) # RFQ nonce bitmap: [maker, word] -> 256 nonce bits packed into an int
+router = Variable() # Registry contract that may route list/take calls and fee management to this pair shard
+migration_target = Variable() # Newer OTC contract that OPEN listings may be exported to
+migration_source = Variable() # Older OTC contract allowed to import its listings into this one
+migrated_tail = Hash(default_value="") # [offer_token, take_token] -> last listing migrate_in placed, the hint for the next
+
+# Price-ordered index of OPEN listings per pair, a doubly linked list sorted by take_amount / offer_amount
+book_head = Hash(default_value=None) # [offer_token, take_token] -> best priced OPEN listing id
+book_next = Hash(default_value=None) # listing id -> next listing id in price order
+book_prev = Hash(default_value=None) # listing id -> previous listing id in price order
+
+# Batch auctions: orders on a pair are only recorded during an epoch and cleared together at one price
+batch_epoch_seconds = Hash(default_value=0) # [base_token, quote_token] -> epoch length, 0 when batch mode is off
+batch_epoch = Hash(default_value=0) # [base_token, quote_token] -> current epoch number
+batch_epoch_start = Hash(default_value=None) # [base_token, quote_token] -> Datetime the current epoch opened
+batch_order_count = Hash(default_value=0) # [base_token, quote_token, epoch] -> orders recorded so far
+batch_orders = Hash(default_value=None) # [base_token, quote_token, epoch, index] -> order
+
+AMOUNT_DECIMALS = 8
+AMOUNT_SCALE = 10 ** AMOUNT_DECIMALS # Stored amounts are integers in units of 10 ** -8 tokens
+PRICE_SCALE = 10 ** 18 # Fixed-point scale of a listing's take / offer price
+PRICE_KEY_WIDTH = 40 # Price keys are zero padded to this width so string order is price order
+BPS_DENOMINATOR = 10_000
+MAX_FEE_BPS = 1_000 # 10%
+QUOTE_NONCE_WORD_BITS = 256
+MAX_FEE_SHARDS = 16
+MAX_BATCH_ORDERS = 50 # Per pair and epoch, clearing is quadratic in the number of orders
+MAX_BOOK_WALK = 500 # Listings visited while placing a new listing without a usable position_hint
+MAX_CROSS_STEPS = 10 # Opposite listings visited by list_offer(auto_cross=True)
+MAX_PAGE_SIZE = 100 # Listings returned by one get_open_offers call
+MAX_SWEEP_STEPS = 20 # Listings visited by one take_best call
+MAX_MIGRATION_BATCH = 50 # Listings moved by one migrate_out call
 
 token_interface = [
     importlib.Func('transfer_from', args=('amount', 'to', 'main_account')),
@@ -14,50 +47,91 @@ token_interface = [
     importlib.Func('balance_of', args=('address',)),
 ]
 
-# Event
+# Events, schema version EVENT_SCHEMA_VERSION.
+# Offer carries the full listing once and indexes the fields subscribers filter on. Lifecycle events after
+# that carry only the listing id, the actor and the amounts that moved; join on id for the rest.
+EVENT_SCHEMA_VERSION = 2
+
 OfferEvent = LogEvent(
     event="Offer",
     params={
-        "id":{'type':str, 'idx':True},
-        "maker": {'type':str, 'idx':False},
-        "taker": {'type':str, 'idx':True},
-        "offer_token": {'type':str, 'idx':False},
+        "v": {'type':int, 'idx':False},
+        "id": {'type':str, 'idx':False},
+        "maker": {'type':str, 'idx':True},
+        "offer_token": {'type':str, 'idx':True},
+        "take_token": {'type':str, 'idx':True},
         "offer_amount": {'type':(int, float, decimal)},
-        "take_token": {'type':str, 'idx':False},
         "take_amount": {'type':(int, float, decimal)},
+        "price": {'type':str, 'idx':False},
+        "fee": {'type':int, 'idx':False},
         "date_listed": {'type':str, 'idx':False},
-        "fee": {'type':(int, float, decimal)},
-        "status": {'type':str, 'idx':True}
     })
 
 TakeOfferEvent = LogEvent(
     event="TakeOffer",
     params={
-        "id":{'type':str, 'idx':True},
-        "maker": {'type':str, 'idx':False},
+        "v": {'type':int, 'idx':False},
+        "id": {'type':str, 'idx':True},
         "taker": {'type':str, 'idx':True},
-        "offer_token": {'type':str, 'idx':False},
-        "offer_amount": {'type':(int, float, decimal)},
-        "take_token": {'type':str, 'idx':False},
-        "take_amount": {'type':(int, float, decimal)},
-        "date_taken": {'type':str, 'idx':False},
-        "fee": {'type':(int, float, decimal)},
-        "status": {'type':str, 'idx':True}
+        "offer_amount": {'type':(int, float, decimal)}, # Paid out to the taker
+        "take_amount": {'type':(int, float, decimal)}, # Paid out to the maker
     })
 
 CancelOfferEvent = LogEvent(
     event="CancelOffer",
     params={
-        "id":{'type':str, 'idx':True},
-        "maker": {'type':str, 'idx':False},
-        "taker": {'type':str, 'idx':True},
-        "offer_token": {'type':str, 'idx':False},
+        "v": {'type':int, 'idx':False},
+        "id": {'type':str, 'idx':True},
+        "maker": {'type':str, 'idx':True},
+        "offer_amount": {'type':(int, float, decimal)}, # Returned to the maker, excluding the refunded fee
+    })
+
+MigrateOfferEvent = LogEvent(
+    event="MigrateOffer",
+    params={
+        "v": {'type':int, 'idx':False},
+        "id": {'type':str, 'idx':True},
+        "maker": {'type':str, 'idx':True},
+        "target": {'type':str, 'idx':True}, # The target emits an Offer event for the same id
+    })
+
+QuoteSettledEvent = LogEvent(
+    event="QuoteSettled",
+    params={
+        "v": {'type':int, 'idx':False},
+        "maker": {'type':str, 'idx':True},
+        "offer_token": {'type':str, 'idx':True},
+        "take_token": {'type':str, 'idx':True},
+        "taker": {'type':str, 'idx':False},
+        "nonce": {'type':int, 'idx':False},
         "offer_amount": {'type':(int, float, decimal)},
-        "take_token": {'type':str, 'idx':False},
         "take_amount": {'type':(int, float, decimal)},
-        "date_cancelled": {'type':str, 'idx':False},
-        "fee": {'type':(int, float, decimal)},
-        "status": {'type':str, 'idx':True}
+        "fee": {'type':int, 'idx':False},
+    })
+
+BatchOrderEvent = LogEvent(
+    event="BatchOrder",
+    params={
+        "v": {'type':int, 'idx':False},
+        "base_token": {'type':str, 'idx':True},
+        "quote_token": {'type':str, 'idx':True},
+        "trader": {'type':str, 'idx':True},
+        "epoch": {'type':int, 'idx':False},
+        "side": {'type':str, 'idx':False},
+        "amount": {'type':(int, float, decimal)},
+        "limit_price": {'type':(int, float, decimal)},
+    })
+
+EpochClearedEvent = LogEvent(
+    event="EpochCleared",
+    params={
+        "v": {'type':int, 'idx':False},
+        "base_token": {'type':str, 'idx':True},
+        "quote_token": {'type':str, 'idx':True},
+        "epoch": {'type':int, 'idx':False},
+        "clearing_price": {'type':(int, float, decimal)},
+        "base_volume": {'type':(int, float, decimal)},
+        "orders": {'type':int, 'idx':False},
     })
 
 FeeAdjustmentEvent = (LogEvent(event="FeeAdjustment", params={"new_fee":{'type':(int, float, decimal)}}))
@@ -65,18 +139,161 @@ FeeAdjustmentEvent = (LogEvent(event="FeeAdjustment", params={"new_fee":{'type':
 @construct
 def init():
     owner.set(ctx.caller)
-    fee.set(decimal("0.5"))
-    reentrancyGuardActive.set(False) # Initialize lock state
+    fee.set(50)
+    fee_shards.set(1)
+
+def acquire_guard(busy_message: str):
+    # Keyed by ctx.signer: every nested call in one transaction shares the signer, so any re-entry into a
+    # guarded function is caught, while transactions from different signers touch disjoint keys.
+    assert not reentrancyGuardActive[ctx.signer], busy_message
+    reentrancyGuardActive[ctx.signer] = True
+
+
+def release_guard():
+    reentrancyGuardActive[ctx.signer] = None # Drop the key; an unset guard reads as False
+
+
+def trader():
+    # Calls routed through the registry act for the transaction signer, every other call for its direct caller.
+    # The registry only forwards calls its signer made directly, so the signer is who asked for the trade.
+    if ctx.caller == router.get():
+        return ctx.signer
+    return ctx.caller
+
+
+def fee_shard(seed: str):
+    # seed is hex (listing id, signature or a sha256 digest); its prefix spreads fee writes over the shards
+    return int(seed[:8], 16) % fee_shards.get()
+
+
+def to_units(amount: float):
+    units = int(amount * AMOUNT_SCALE)
+    assert from_units(units) == amount, "Amounts support at most 8 decimal places"
+    return units
+
+
+def from_units(units: int):
+    # Token contracts still move decimals, convert only at the transfer and event boundary
+    return decimal(str(units)) / AMOUNT_SCALE
+
+
+def price_key(offer_units: int, take_units: int):
+    # take_token per offer_token, floored to PRICE_SCALE and zero padded so keys sort lexicographically
+    key = str(take_units * PRICE_SCALE // offer_units)
+    assert len(key) <= PRICE_KEY_WIDTH, "Price out of range"
+    return key.zfill(PRICE_KEY_WIDTH)
+
+
+def compute_fee(units: int, fee_bps: int):
+    # The one place fees are computed, in integer units and floored (rounding favours the payer).
+    # Refunds never recompute: they return the fee amount stored when the funds were escrowed.
+    return units * fee_bps // BPS_DENOMINATOR
+
+
+def accrue_fee(token: str, units: int, seed: str):
+    if units > 0:
+        earned_fees[token, fee_shard(seed)] += units
+
+
+def price_before(first: dict, second: dict):
+    # True when first asks strictly less take_token per offer_token than second
+    return first["price"] < second["price"]
+
+
+def hint_start(listing: dict, position_hint: str):
+    # Where a walk for listing may start: after position_hint when it is an OPEN listing of the same pair priced
+    # at or below listing, otherwise at the head of the book. Returns [previous_id, current_id].
+    offer_token = listing["offer_token"]
+    take_token = listing["take_token"]
+    if position_hint:
+        hint_listing = otc_listing[position_hint]
+        if hint_listing and hint_listing["status"] == "OPEN" \
+                and hint_listing["offer_token"] == offer_token and hint_listing["take_token"] == take_token \
+                and not price_before(listing, hint_listing):
+            return [position_hint, book_next[position_hint]]
+    return [None, book_head[offer_token, take_token]]
+
+
+def book_insert(listing_id: str, listing: dict, position_hint: str):
+    offer_token = listing["offer_token"]
+    take_token = listing["take_token"]
+    start = hint_start(listing, position_hint)
+    previous_id = start[0]
+    current_id = start[1]
+
+    # Equal prices keep listing order, so the new listing goes after all of them
+    steps = 0
+    while current_id is not None and not price_before(listing, otc_listing[current_id]):
+        assert steps < MAX_BOOK_WALK, "Order book too deep to place listing, pass a position_hint"
+        previous_id = current_id
+        current_id = book_next[current_id]
+        steps += 1
+
+    if previous_id is None:
+        book_head[offer_token, take_token] = listing_id
+    else:
+        book_prev[listing_id] = previous_id
+        book_next[previous_id] = listing_id
+    if current_id is not None:
+        book_next[listing_id] = current_id
+        book_prev[current_id] = listing_id
+
+
+def book_remove(listing_id: str, offer_token: str, take_token: str):
+    previous_id = book_prev[listing_id]
+    next_id = book_next[listing_id]
+    if previous_id is None:
+        if book_head[offer_token, take_token] != listing_id:
+            return # Listed before the index existed, nothing to unlink
+        book_head[offer_token, take_token] = next_id
+    else:
+        book_next[previous_id] = next_id
+    if next_id is not None:
+        book_prev[next_id] = previous_id
+    # The removed listing keeps its own pointers so a walk that stopped on it can still move forward
+
+
+def match_opposite(offer_token: str, offer_units: int, take_token: str, take_units: int, caller: str):
+    # Best opposite listings (offering our take_token for our offer_token) that cross our price and fit whole.
+    # Returns [matched_ids, still_crossing]; still_crossing is True when a crossing listing of another maker was
+    # left unfilled, because it was too large for what remained or lay past MAX_CROSS_STEPS.
+    matched_ids = []
+    still_crossing = False
+    remaining_offer_units = offer_units
+    resting_id = book_head[take_token, offer_token]
+    steps = 0
+    while resting_id is not None and remaining_offer_units > 0:
+        resting_listing = otc_listing[resting_id]
+        # Crosses while resting take / resting offer <= offer_units / take_units, exact in integers
+        if resting_listing["take_amount"] * take_units > offer_units * resting_listing["offer_amount"]:
+            break
+        if steps == MAX_CROSS_STEPS:
+            still_crossing = True # More crossing listings than one call may visit
+            break
+        if resting_listing["maker"] != caller:
+            if resting_listing["take_amount"] > remaining_offer_units:
+                still_crossing = True # Skipped like take_best does, a later smaller listing may still fit
+            else:
+                matched_ids.append(resting_id)
+                remaining_offer_units -= resting_listing["take_amount"]
+        resting_id = book_next[resting_id]
+        steps += 1
+    return [matched_ids, still_crossing]
+
 
 @export
 def list_offer(
     offer_token: str,
     offer_amount: float,
     take_token: str,
-    take_amount: float
+    take_amount: float,
+    auto_cross: bool = False,
+    position_hint: str = ""
 ):
-    assert not reentrancyGuardActive.get(), "Contract is busy, please try again." # Re-entrancy Guard Check
-    reentrancyGuardActive.set(True) # Activate Guard
+    # With auto_cross the maker first fills crossing opposite listings at their prices and only rests the remainder.
+    # Returns the id of the resting listing, or None when the offer was filled completely.
+    acquire_guard("Contract is busy, please try again.") # Re-entrancy Guard Check and Activate
+    caller = trader()
 
     # Checks
     assert offer_amount > decimal("0.0"), "Offer amount must be positive"
@@ -86,7 +303,7 @@ def list_offer(
     id_components = []
     id_components.append(str(now))
     id_components.append(ctx.this)
-    id_components.append(ctx.caller)
+    id_components.append(caller)
     id_components.append(ctx.signer)
     id_components.append(offer_token)
     id_components.append(str(offer_amount))
@@ -101,8 +318,9 @@ def list_offer(
     # --- End of Stronger ID Generation ---
 
     # Pre-calculate fee based on current contract fee
-    current_contract_fee_percent = fee.get()
-    maker_fee_to_collect = offer_amount / 100 * current_contract_fee_percent
+    current_contract_fee_bps = fee.get()
+    offer_units = to_units(offer_amount)
+    take_units = to_units(take_amount)
 
     # Import and validate tokens (Checks before effects/interactions)
     offer_token_contract_module = I.import_module(offer_token)
@@ -110,53 +328,171 @@ def list_offer(
     assert importlib.enforce_interface(offer_token_contract_module, token_interface), 'offer_token contract not XSC001-compliant'
     assert importlib.enforce_interface(take_token_contract_module, token_interface), 'take_token contract not XSC001-compliant'
 
-    # Effects: Create the listing data structure first (partially, if needed, or fully if no more abort conditions before interaction)
-    # In this case, we can prepare the listing object, but only store it after successful transfer.
-    # However, the critical part is that the transfer_from happens before the listing is finalized in state.
+    # Effects: fill crossing listings first. The maker pays each one as a taker would, at that listing's fee.
+    remaining_offer_units = offer_units
+    received_take_units = 0
+    maker_fees_earned = 0
+    taker_fees_payable = 0
+    payouts_per_maker = {}
+    crossed_listings = []
+    if auto_cross:
+        matched = match_opposite(offer_token, offer_units, take_token, take_units, caller)
+        for resting_id in matched[0]:
+            resting_listing = otc_listing[resting_id]
+            resting_listing["status"] = "EXECUTED"
+            resting_listing["taker"] = caller
+            otc_listing[resting_id] = resting_listing
+            book_remove(resting_id, take_token, offer_token)
+
+            resting_maker = resting_listing["maker"]
+            payouts_per_maker[resting_maker] = payouts_per_maker.get(resting_maker, 0) + resting_listing["take_amount"]
+            remaining_offer_units -= resting_listing["take_amount"]
+            received_take_units += resting_listing["offer_amount"]
+            maker_fees_earned += resting_listing["maker_fee"]
+            taker_fees_payable += resting_listing["taker_fee"]
+            crossed_listings.append([resting_id, resting_listing])
 
-    # Interaction: Transfer funds from maker
+        accrue_fee(take_token, maker_fees_earned, listing_id_generated)
+        accrue_fee(offer_token, taker_fees_payable, listing_id_generated)
+        # Resting a remainder that crosses a listing it could not fill would leave the book crossed
+        assert remaining_offer_units == 0 or not matched[1], \
+            "Remainder would cross a listing too large to fill, take that listing or list less"
+
+    # The remainder rests at the maker's own price, floored in the taker's favour
+    remaining_take_units = take_units * remaining_offer_units // offer_units
+    maker_fee_to_collect = compute_fee(remaining_offer_units, current_contract_fee_bps)
+    assert remaining_offer_units == 0 or remaining_take_units > 0, "Remainder too small to rest"
+
+    # Interaction: Transfer funds from maker, one pull covers the crossed fills and the resting escrow
     offer_token_contract_module.transfer_from(
-        amount=offer_amount + maker_fee_to_collect,
+        amount=from_units(offer_units + taker_fees_payable + maker_fee_to_collect), # Crossed take amounts plus the resting offer add up to offer_units
         to=ctx.this,
-        main_account=ctx.caller
+        main_account=caller
     )
+    for resting_maker, payout_units in payouts_per_maker.items():
+        offer_token_contract_module.transfer(amount=from_units(payout_units), to=resting_maker)
+    if received_take_units > 0:
+        take_token_contract_module.transfer(amount=from_units(received_take_units), to=caller)
+
+    for crossed in crossed_listings:
+        crossed_listing = crossed[1]
+        TakeOfferEvent({
+            "v": EVENT_SCHEMA_VERSION,
+            "id": crossed[0],
+            "taker": caller,
+            "offer_amount": from_units(crossed_listing["offer_amount"]),
+            "take_amount": from_units(crossed_listing["take_amount"]),
+        })
+
+    if remaining_offer_units == 0:
+        release_guard() # Deactivate Guard
+        return None
 
     current_time_for_id_and_listing = now
 
     # Effects (finalize state): Create the listing *after* successful transfer
-    otc_listing[listing_id_generated] = {
-        "maker": ctx.caller,
+    new_listing = {
+        "maker": caller,
         "taker": None,
         "offer_token": offer_token,
-        "offer_amount": offer_amount,
+        "offer_amount": remaining_offer_units,
         "take_token": take_token,
-        "take_amount": take_amount,
+        "take_amount": remaining_take_units,
+        "price": price_key(remaining_offer_units, remaining_take_units), # Sortable take / offer price
         "date_listed": current_time_for_id_and_listing, # Use consistent time
-        "fee": current_contract_fee_percent, # Store the fee percent at the time of listing
+        "fee": current_contract_fee_bps, # Fee rate at the time of listing
+        "maker_fee": maker_fee_to_collect, # Escrowed with the offer, refunded on cancel
+        "taker_fee": compute_fee(remaining_take_units, current_contract_fee_bps), # Charged to whoever takes it
         "status": "OPEN",
     }
+    otc_listing[listing_id_generated] = new_listing
+    book_insert(listing_id_generated, new_listing, position_hint)
 
     OfferEvent({
+        "v": EVENT_SCHEMA_VERSION,
         "id": listing_id_generated,
-        "maker": ctx.caller,
-        "taker": "None",
+        "maker": caller,
         "offer_token": offer_token,
-        "offer_amount": offer_amount,
         "take_token": take_token,
-        "take_amount": take_amount,
+        "offer_amount": from_units(remaining_offer_units),
+        "take_amount": from_units(remaining_take_units),
+        "price": new_listing["price"],
+        "fee": current_contract_fee_bps,
         "date_listed": str(current_time_for_id_and_listing),
-        "fee": current_contract_fee_percent,
-        "status": "OPEN",
     })
 
-    reentrancyGuardActive.set(False) # Deactivate Guard
+    release_guard() # Deactivate Guard
     return listing_id_generated
 
 
+@export
+def get_open_offers(offer_token: str, take_token: str, cursor: str = "", limit: int = 25):
+    # One page of a pair's OPEN listings, cheapest first. Pass the returned cursor to get the next page.
+    # The cursor is the last listing id returned, so pages stay in place while listings come and go, and a
+    # deep page costs the same as the first. Listings created before the book index existed are not included.
+    assert 0 < limit <= MAX_PAGE_SIZE, "Limit must be between 1 and MAX_PAGE_SIZE"
+    if cursor:
+        cursor_listing = otc_listing[cursor]
+        assert cursor_listing and cursor_listing["offer_token"] == offer_token \
+            and cursor_listing["take_token"] == take_token, "Cursor does not belong to this pair"
+        current_id = book_next[cursor] # A taken or cancelled cursor keeps the pointer it had when it left
+    else:
+        current_id = book_head[offer_token, take_token]
+
+    offers = []
+    last_id = None
+    steps = 0
+    while current_id is not None and len(offers) < limit and steps < MAX_BOOK_WALK:
+        listing = otc_listing[current_id]
+        if listing["status"] == "OPEN":
+            offers.append({
+                "id": current_id,
+                "maker": listing["maker"],
+                "offer_token": offer_token,
+                "offer_amount": from_units(listing["offer_amount"]),
+                "take_token": take_token,
+                "take_amount": from_units(listing["take_amount"]),
+                "price": listing["price"],
+                "fee": listing["fee"],
+                "date_listed": str(listing["date_listed"]),
+            })
+        last_id = current_id
+        current_id = book_next[current_id]
+        steps += 1
+
+    # A None cursor means the end of the book was reached
+    next_cursor = None
+    if current_id is not None:
+        next_cursor = last_id
+    return {"offers": offers, "cursor": next_cursor}
+
+
+@export
+def find_position_hint(offer_token: str, offer_amount: float, take_token: str, take_amount: float, cursor: str = ""):
+    # Read-only helper for clients: the listing a new offer at this price would be placed after. The walk starts
+    # after cursor when that is a usable hint and stops after MAX_BOOK_WALK listings. While done is False, call
+    # again with the returned hint as cursor; once done, pass the hint to list_offer as position_hint.
+    candidate = {
+        "offer_token": offer_token,
+        "take_token": take_token,
+        "price": price_key(to_units(offer_amount), to_units(take_amount)),
+    }
+    start = hint_start(candidate, cursor)
+    previous_id = start[0]
+    current_id = start[1]
+    steps = 0
+    while current_id is not None and not price_before(candidate, otc_listing[current_id]) and steps < MAX_BOOK_WALK:
+        previous_id = current_id
+        current_id = book_next[current_id]
+        steps += 1
+    done = current_id is None or price_before(candidate, otc_listing[current_id])
+    return {"hint": previous_id, "done": done}
+
+
 @export
 def take_offer(listing_id: str):
-    assert not reentrancyGuardActive.get(), "Contract is busy, please try again." # Re-entrancy Guard Check
-    reentrancyGuardActive.set(True) # Activate Guard
+    acquire_guard("Contract is busy, please try again.") # Re-entrancy Guard Check and Activate
+    caller = trader()
 
     # --- Checks ---
     # Retrieve offer data once and store for use
@@ -170,69 +506,140 @@ def take_offer(listing_id: str):
     original_offer_amount = initial_offer_state["offer_amount"]
     original_take_token = initial_offer_state["take_token"]
     original_take_amount = initial_offer_state["take_amount"]
-    listing_fee_percent = initial_offer_state["fee"] # Fee percent set at time of listing
+    taker_fee_payable = initial_offer_state["taker_fee"] # Fee amounts were fixed when the offer was listed
+    maker_fee_earned_from_listing = initial_offer_state["maker_fee"]
 
     # --- Effects: Modify state BEFORE interactions ---
     # Mark offer as EXECUTED IMMEDIATELY
     current_listing_data = otc_listing[listing_id] # Get a fresh reference to modify
     current_listing_data["status"] = "EXECUTED"
-    current_listing_data["taker"] = ctx.caller
+    current_listing_data["taker"] = caller
     otc_listing[listing_id] = current_listing_data # Save changes
+    book_remove(listing_id, original_offer_token, original_take_token)
 
-    # Calculations (based on original offer data and listing_fee_percent)
-    taker_fee_payable = original_take_amount / decimal("100.0") * listing_fee_percent
-    maker_fee_earned_from_listing = original_offer_amount / decimal("100.0") * listing_fee_percent
-
-    # Update earned fees
-    current_earned_for_offer_token = earned_fees[original_offer_token]
-    earned_fees[original_offer_token] = current_earned_for_offer_token + maker_fee_earned_from_listing
-
-    current_earned_for_take_token = earned_fees[original_take_token]
-    earned_fees[original_take_token] = current_earned_for_take_token + taker_fee_payable
+    # Update earned fees in this listing's shard
+    accrue_fee(original_offer_token, maker_fee_earned_from_listing, listing_id)
+    accrue_fee(original_take_token, taker_fee_payable, listing_id)
 
     # --- Interactions (External Calls) ---
     # 1. Taker sends their tokens (take_token + taker_fee) to the contract
     take_token_contract_instance = I.import_module(original_take_token)
     take_token_contract_instance.transfer_from(
-        amount=original_take_amount + taker_fee_payable,
+        amount=from_units(original_take_amount + taker_fee_payable),
         to=ctx.this,
-        main_account=ctx.caller # The taker
+        main_account=caller # The taker
     )
 
     # 2. Contract sends take_tokens to the maker
     take_token_contract_instance.transfer( # Re-use imported module
-        amount=original_take_amount,
+        amount=from_units(original_take_amount),
         to=original_maker
     )
 
-    # 3. Contract sends offer_tokens to the taker (ctx.caller)
+    # 3. Contract sends offer_tokens to the taker (caller)
     offer_token_contract_instance = I.import_module(original_offer_token)
     offer_token_contract_instance.transfer(
-        amount=original_offer_amount,
-        to=ctx.caller # The taker
+        amount=from_units(original_offer_amount),
+        to=caller # The taker
     )
 
-    # Event (Log using original values where appropriate, and new status)
+    # Event: the Offer event already described the listing, log only who took it and what moved
     TakeOfferEvent({
+        "v": EVENT_SCHEMA_VERSION,
         "id": listing_id,
-        "maker": original_maker,
-        "taker": ctx.caller,
-        "offer_token": original_offer_token,
-        "offer_amount": original_offer_amount,
-        "take_token": original_take_token,
-        "take_amount": original_take_amount,
-        "date_taken": str(now),
-        "fee": listing_fee_percent, # The fee percent for this specific offer
-        "status": "EXECUTED",
+        "taker": caller,
+        "offer_amount": from_units(original_offer_amount),
+        "take_amount": from_units(original_take_amount),
     })
 
-    reentrancyGuardActive.set(False) # Deactivate Guard
+    release_guard() # Deactivate Guard
+
+
+@export
+def take_best(offer_token: str, take_token: str, max_take_amount: float, limit_price: float):
+    # Buy offer_token with take_token from the cheapest OPEN listings of the pair, whole listings only.
+    # max_take_amount caps everything the taker pays, taker fees included; limit_price is the worst accepted
+    # take_token per offer_token. Listings that do not fit the remaining budget, and the taker's own, are skipped.
+    acquire_guard("Contract is busy, please try again.") # Re-entrancy Guard Check and Activate
+    caller = trader()
+
+    assert max_take_amount > decimal("0.0"), "Budget must be positive"
+    assert limit_price > decimal("0.0"), "Limit price must be positive"
+    budget_units = to_units(max_take_amount)
+    limit_price_fixed = int(limit_price * PRICE_SCALE)
+
+    # Effects: pick and close the listings first
+    filled_ids = []
+    paid_take_units = 0
+    taker_fees_payable = 0
+    maker_fees_earned = 0
+    received_offer_units = 0
+    payouts_per_maker = {}
+    current_id = book_head[offer_token, take_token]
+    steps = 0
+    while current_id is not None and steps < MAX_SWEEP_STEPS:
+        listing = otc_listing[current_id]
+        next_id = book_next[current_id]
+        # Listings are in price order, so the first one above the limit ends the sweep
+        if listing["take_amount"] * PRICE_SCALE > limit_price_fixed * listing["offer_amount"]:
+            break
+        cost = listing["take_amount"] + listing["taker_fee"]
+        if listing["maker"] != caller and paid_take_units + taker_fees_payable + cost <= budget_units:
+            listing["status"] = "EXECUTED"
+            listing["taker"] = caller
+            otc_listing[current_id] = listing
+            book_remove(current_id, offer_token, take_token)
+
+            maker = listing["maker"]
+            payouts_per_maker[maker] = payouts_per_maker.get(maker, 0) + listing["take_amount"]
+            paid_take_units += listing["take_amount"]
+            taker_fees_payable += listing["taker_fee"]
+            maker_fees_earned += listing["maker_fee"]
+            received_offer_units += listing["offer_amount"]
+            filled_ids.append(current_id)
+        current_id = next_id
+        steps += 1
+
+    assert len(filled_ids) > 0, "No listing within limit price and budget"
+    accrue_fee(offer_token, maker_fees_earned, filled_ids[0])
+    accrue_fee(take_token, taker_fees_payable, filled_ids[0])
+
+    # Interactions: one pull from the taker, one payout per maker, one transfer to the taker
+    take_token_contract = I.import_module(take_token)
+    offer_token_contract = I.import_module(offer_token)
+    assert importlib.enforce_interface(take_token_contract, token_interface), 'take_token contract not XSC001-compliant'
+    assert importlib.enforce_interface(offer_token_contract, token_interface), 'offer_token contract not XSC001-compliant'
+    take_token_contract.transfer_from(
+        amount=from_units(paid_take_units + taker_fees_payable),
+        to=ctx.this,
+        main_account=caller
+    )
+    for maker, payout_units in payouts_per_maker.items():
+        take_token_contract.transfer(amount=from_units(payout_units), to=maker)
+    offer_token_contract.transfer(amount=from_units(received_offer_units), to=caller)
+
+    for filled_id in filled_ids:
+        filled_listing = otc_listing[filled_id]
+        TakeOfferEvent({
+            "v": EVENT_SCHEMA_VERSION,
+            "id": filled_id,
+            "taker": caller,
+            "offer_amount": from_units(filled_listing["offer_amount"]),
+            "take_amount": from_units(filled_listing["take_amount"]),
+        })
+
+    release_guard() # Deactivate Guard
+    return {
+        "ids": filled_ids,
+        "offer_amount": from_units(received_offer_units),
+        "take_amount": from_units(paid_take_units),
+        "fee": from_units(taker_fees_payable),
+    }
 
 
 @export
 def cancel_offer(listing_id: str):
-    assert not reentrancyGuardActive.get(), "Contract is busy, please try again." # Re-entrancy Guard Check
-    reentrancyGuardActive.set(True) # Activate Guard
+    acquire_guard("Contract is busy, please try again.") # Re-entrancy Guard Check and Activate
 
     # --- Checks ---
     # Retrieve offer data once
@@ -244,79 +651,524 @@ def cancel_offer(listing_id: str):
     # Store original values needed for refund and event
     offer_token_to_refund_name = offer_details_to_cancel["offer_token"]
     offer_amount_to_refund_value = offer_details_to_cancel["offer_amount"]
-    fee_percent_at_listing = offer_details_to_cancel["fee"] # Fee percent stored with the offer
+    maker_fee_paid_at_listing_time = offer_details_to_cancel["maker_fee"] # Exactly what was escrowed
 
     # --- Effects: Modify state BEFORE interactions ---
     # Mark offer as CANCELLED IMMEDIATELY
     current_listing_data_for_cancel = otc_listing[listing_id] # Get a fresh reference
     current_listing_data_for_cancel["status"] = "CANCELLED"
     otc_listing[listing_id] = current_listing_data_for_cancel # Save changes
+    book_remove(listing_id, offer_token_to_refund_name, offer_details_to_cancel["take_token"])
 
     # Calculation for refund
-    maker_fee_paid_at_listing_time = offer_amount_to_refund_value / decimal("100.0") * fee_percent_at_listing
     total_amount_to_refund_maker = offer_amount_to_refund_value + maker_fee_paid_at_listing_time
 
     # --- Interaction: Refund tokens to maker ---
     offer_token_contract_for_refund = I.import_module(offer_token_to_refund_name)
     offer_token_contract_for_refund.transfer(
-        amount=total_amount_to_refund_maker,
+        amount=from_units(total_amount_to_refund_maker),
         to=ctx.caller # The maker
     )
 
-    # Event (Log using original values where appropriate, and new status)
+    # Event: id, actor and the amount returned
     CancelOfferEvent({
+        "v": EVENT_SCHEMA_VERSION,
         "id": listing_id,
-        "maker": offer_details_to_cancel["maker"],
-        "taker": "None", # Was None for an OPEN offer being cancelled
-        "offer_token": offer_token_to_refund_name,
-        "offer_amount": offer_amount_to_refund_value,
-        "take_token": offer_details_to_cancel["take_token"],
-        "take_amount": offer_details_to_cancel["take_amount"],
-        "date_cancelled": str(now),
-        "fee": fee_percent_at_listing,
-        "status": "CANCELLED",
+        "maker": ctx.caller,
+        "offer_amount": from_units(offer_amount_to_refund_value),
     })
 
-    reentrancyGuardActive.set(False) # Deactivate Guard
+    release_guard() # Deactivate Guard
 
 
 @export
-def adjust_fee(trading_fee: float):
-    # This function does not make external calls before its state change,
-    # but the global lock prevents it from running if a guarded operation is in progress.
-    assert not reentrancyGuardActive.get(), "Contract is busy, cannot adjust fee now."
+def migrate_out(listing_ids: list):
+    # Moves OPEN listings, escrow included, to migration_target without a cancel and relist per listing.
+    # The owner can move any listing, a maker only their own. Escrow moves in one transfer per token.
+    acquire_guard("Contract is busy, cannot migrate now.") # Re-entrancy Guard Check and Activate
+
+    target = migration_target.get()
+    assert target, "No migration target set"
+    assert 0 < len(listing_ids) <= MAX_MIGRATION_BATCH, "Migrate between 1 and MAX_MIGRATION_BATCH listings at a time"
+    caller_is_owner = ctx.caller == owner.get()
+
+    records = []
+    escrow_units = {} # offer_token -> units leaving with the batch
+    for listing_id in listing_ids:
+        listing = otc_listing[listing_id]
+        assert listing and listing["status"] == "OPEN", "Offer not available"
+        assert caller_is_owner or listing["maker"] == ctx.caller, "Only owner or maker can migrate offer"
+
+        records.append({
+            "id": listing_id,
+            "maker": listing["maker"],
+            "offer_token": listing["offer_token"],
+            "offer_amount": listing["offer_amount"],
+            "take_token": listing["take_token"],
+            "take_amount": listing["take_amount"],
+            "date_listed": listing["date_listed"],
+            "fee": listing["fee"],
+            "maker_fee": listing["maker_fee"],
+            "taker_fee": listing["taker_fee"],
+        })
+        escrow_units[listing["offer_token"]] = escrow_units.get(listing["offer_token"], 0) \
+            + listing["offer_amount"] + listing["maker_fee"]
+
+        # Effects: the listing is closed here before any escrow leaves
+        listing["status"] = "MIGRATED"
+        otc_listing[listing_id] = listing
+        book_remove(listing_id, listing["offer_token"], listing["take_token"])
+
+    # Interaction: escrow first, so the target holds the tokens by the time it records the listings
+    for token, units in escrow_units.items():
+        I.import_module(token).transfer(amount=from_units(units), to=target)
+    I.import_module(target).migrate_in(listings=records, escrow_units=escrow_units)
+
+    for record in records:
+        MigrateOfferEvent({
+            "v": EVENT_SCHEMA_VERSION,
+            "id": record["id"],
+            "maker": record["maker"],
+            "target": target,
+        })
+
+    release_guard() # Deactivate Guard
+
+
+@export
+def migrate_in(listings: list, escrow_units: dict):
+    # Records listings exported by migration_source's migrate_out, which has already sent their escrow.
+    # Exports arrive in book order, so each listing is placed after the last one imported for its pair, across
+    # batches too. That hint only goes stale when the last import was taken or cancelled in between; the walk
+    # from the head is then bounded by MAX_BOOK_WALK like any list_offer without a hint.
+    acquire_guard("Contract is busy, cannot migrate now.") # Re-entrancy Guard Check and Activate
+
+    source = migration_source.get()
+    assert source and ctx.caller == source, "Only the migration source can import listings"
+    assert 0 < len(listings) <= MAX_MIGRATION_BATCH, "Migrate between 1 and MAX_MIGRATION_BATCH listings at a time"
+
+    imported_units = {}
+    for record in listings:
+        listing_id = record["id"]
+        assert otc_listing[listing_id] is None, "Listing already exists"
+        offer_token = record["offer_token"]
+        take_token = record["take_token"]
+
+        listing = {
+            "maker": record["maker"],
+            "taker": None,
+            "offer_token": offer_token,
+            "offer_amount": record["offer_amount"],
+            "take_token": take_token,
+            "take_amount": record["take_amount"],
+            "price": price_key(record["offer_amount"], record["take_amount"]),
+            "date_listed": record["date_listed"],
+            "fee": record["fee"], # Listings keep the fee rate they were listed at
+            "maker_fee": record["maker_fee"],
+            "taker_fee": record["taker_fee"],
+            "status": "OPEN",
+        }
+        otc_listing[listing_id] = listing
+        book_insert(listing_id, listing, migrated_tail[offer_token, take_token])
+        migrated_tail[offer_token, take_token] = listing_id
+        imported_units[offer_token] = imported_units.get(offer_token, 0) + record["offer_amount"] + record["maker_fee"]
+
+        OfferEvent({
+            "v": EVENT_SCHEMA_VERSION,
+            "id": listing_id,
+            "maker": record["maker"],
+            "offer_token": offer_token,
+            "take_token": take_token,
+            "offer_amount": from_units(record["offer_amount"]),
+            "take_amount": from_units(record["take_amount"]),
+            "price": listing["price"],
+            "fee": record["fee"],
+            "date_listed": str(record["date_listed"]),
+        })
+
+    assert len(imported_units) == len(escrow_units), "Escrow does not match imported listings"
+    for token, units in imported_units.items():
+        assert escrow_units.get(token) == units, "Escrow does not match imported listings"
+
+    release_guard() # Deactivate Guard
+
+
+def quote_message(
+    maker: str,
+    offer_token: str,
+    offer_amount: str,
+    take_token: str,
+    take_amount: str,
+    expiry: datetime.datetime,
+    nonce: int
+):
+    # Must match otc_tools.rfq.quote_message byte for byte, the maker signs this string off-chain
+    return ":".join([
+        "otc_quote", ctx.this, maker,
+        offer_token, offer_amount,
+        take_token, take_amount,
+        str(expiry), str(nonce)
+    ])
+
+
+def use_quote_nonce(maker: str, nonce: int):
+    assert nonce >= 0, "Nonce must not be negative"
+    word = nonce // QUOTE_NONCE_WORD_BITS
+    bit = 2 ** (nonce % QUOTE_NONCE_WORD_BITS)
+    used_bits = quote_nonces[maker, word]
+    assert (used_bits // bit) % 2 == 0, "Quote nonce already used"
+    quote_nonces[maker, word] = used_bits + bit
+
+
+@export
+def settle_quote(
+    maker: str,
+    offer_token: str,
+    offer_amount: str,
+    take_token: str,
+    take_amount: str,
+    expiry: datetime.datetime,
+    nonce: int,
+    signature: str
+):
+    # RFQ mode: the maker signs the quote off-chain and never touches otc_listing.
+    # Amounts are signed as the exact strings submitted here so both sides hash the same text.
+    acquire_guard("Contract is busy, please try again.") # Re-entrancy Guard Check and Activate
+
+    # --- Checks ---
+    assert maker != ctx.caller, "Maker can not settle own quote"
+    assert offer_token != take_token, "Tokens must differ"
+    assert now <= expiry, "Quote expired"
+
+    message = quote_message(maker, offer_token, offer_amount, take_token, take_amount, expiry, nonce)
+    assert crypto.verify(maker, message, signature), "Invalid quote signature"
+
+    quoted_offer_units = to_units(decimal(offer_amount))
+    quoted_take_units = to_units(decimal(take_amount))
+    assert quoted_offer_units > 0, "Offer amount must be positive"
+    assert quoted_take_units > 0, "Take amount must be positive"
+
+    offer_token_contract = I.import_module(offer_token)
+    take_token_contract = I.import_module(take_token)
+    assert importlib.enforce_interface(offer_token_contract, token_interface), 'offer_token contract not XSC001-compliant'
+    assert importlib.enforce_interface(take_token_contract, token_interface), 'take_token contract not XSC001-compliant'
+
+    # --- Effects: burn the nonce and book fees before any token moves ---
+    use_quote_nonce(maker, nonce)
+
+    current_contract_fee_bps = fee.get()
+    maker_fee_payable = compute_fee(quoted_offer_units, current_contract_fee_bps)
+    taker_fee_payable = compute_fee(quoted_take_units, current_contract_fee_bps)
+    accrue_fee(offer_token, maker_fee_payable, signature)
+    accrue_fee(take_token, taker_fee_payable, signature)
+
+    # --- Interactions: swap directly between maker and taker, fees to the contract ---
+    offer_token_contract.transfer_from(amount=from_units(quoted_offer_units), to=ctx.caller, main_account=maker)
+    take_token_contract.transfer_from(amount=from_units(quoted_take_units), to=maker, main_account=ctx.caller)
+    if maker_fee_payable > 0:
+        offer_token_contract.transfer_from(amount=from_units(maker_fee_payable), to=ctx.this, main_account=maker)
+    if taker_fee_payable > 0:
+        take_token_contract.transfer_from(amount=from_units(taker_fee_payable), to=ctx.this, main_account=ctx.caller)
+
+    QuoteSettledEvent({
+        "v": EVENT_SCHEMA_VERSION,
+        "maker": maker,
+        "offer_token": offer_token,
+        "take_token": take_token,
+        "taker": ctx.caller,
+        "nonce": nonce,
+        "offer_amount": from_units(quoted_offer_units),
+        "take_amount": from_units(quoted_take_units),
+        "fee": current_contract_fee_bps,
+    })
+
+    release_guard() # Deactivate Guard
+
+
+@export
+def cancel_quote_nonces(nonces: list):
+    # Lets a maker invalidate quotes that are already signed and out in the wild
+    for nonce in nonces:
+        use_quote_nonce(ctx.caller, nonce)
+
+
+@export
+def is_quote_nonce_used(maker: str, nonce: int):
+    bit = 2 ** (nonce % QUOTE_NONCE_WORD_BITS)
+    return (quote_nonces[maker, nonce // QUOTE_NONCE_WORD_BITS] // bit) % 2 == 1
+
+
+def add_payout(payouts: dict, account: str, token: str, units: int):
+    if units > 0:
+        payouts[account + ":" + token] = payouts.get(account + ":" + token, 0) + units
+
+
+def clearing_volume(orders: list, price: int):
+    # Base units supplied by sells willing to sell at price and base units demanded by buys willing to pay it
+    supplied = 0
+    demanded = 0
+    for order in orders:
+        if order["side"] == "SELL" and order["limit_price"] <= price:
+            supplied += order["amount"]
+        elif order["side"] == "BUY" and order["limit_price"] >= price:
+            demanded += order["amount"] * PRICE_SCALE // price
+    return [supplied, demanded]
+
+
+def order_matches(order: dict, clearing_price: int):
+    if clearing_price == 0:
+        return False
+    if order["side"] == "SELL":
+        return order["limit_price"] <= clearing_price
+    return order["limit_price"] >= clearing_price
+
+
+@export
+def configure_batch_auction(base_token: str, quote_token: str, epoch_seconds: int):
+    # epoch_seconds = 0 switches batch mode off for the pair once its open epoch is empty
     assert ctx.caller == owner.get(), "Only owner can call this method!"
-    assert decimal("0.0") <= trading_fee <= decimal("10.0"), "Fee must be between 0.0 and 10.0 percent"
-    fee.set(trading_fee) # Effect
-    FeeAdjustmentEvent({"new_fee": trading_fee})
+    assert base_token != quote_token, "Tokens must differ"
+    assert epoch_seconds >= 0, "Epoch length must not be negative"
+    epoch = batch_epoch[base_token, quote_token]
+    if epoch_seconds == 0:
+        assert batch_order_count[base_token, quote_token, epoch] == 0, "Clear the open epoch first"
+    elif batch_epoch_seconds[base_token, quote_token] == 0:
+        batch_epoch_start[base_token, quote_token] = now
+    batch_epoch_seconds[base_token, quote_token] = epoch_seconds
+
+
+@export
+def submit_batch_order(base_token: str, quote_token: str, side: str, amount: float, limit_price: float):
+    # SELL escrows `amount` of base_token and accepts no less than limit_price quote per base.
+    # BUY escrows `amount` of quote_token and pays no more than limit_price quote per base.
+    acquire_guard("Contract is busy, please try again.") # Re-entrancy Guard Check and Activate
+
+    assert batch_epoch_seconds[base_token, quote_token] > 0, "Batch mode is not enabled for this pair"
+    assert side == "BUY" or side == "SELL", "Side must be BUY or SELL"
+    assert amount > decimal("0.0"), "Amount must be positive"
+    assert limit_price > decimal("0.0"), "Limit price must be positive"
+    amount_units = to_units(amount)
+    limit_price_fixed = int(limit_price * PRICE_SCALE)
+    assert limit_price_fixed > 0, "Limit price must be positive"
+
+    epoch = batch_epoch[base_token, quote_token]
+    order_index = batch_order_count[base_token, quote_token, epoch]
+    assert order_index < MAX_BATCH_ORDERS, "Epoch is full, wait for clear_epoch"
+
+    escrow_token = base_token
+    if side == "BUY":
+        escrow_token = quote_token
+    escrow_token_contract = I.import_module(escrow_token)
+    assert importlib.enforce_interface(escrow_token_contract, token_interface), 'Token contract not XSC001-compliant'
+
+    current_contract_fee_bps = fee.get()
+    order_fee = compute_fee(amount_units, current_contract_fee_bps)
+
+    batch_orders[base_token, quote_token, epoch, order_index] = {
+        "trader": ctx.caller,
+        "side": side,
+        "amount": amount_units,
+        "limit_price": limit_price_fixed,
+        "fee_bps": current_contract_fee_bps,
+        "fee": order_fee,
+    }
+    batch_order_count[base_token, quote_token, epoch] = order_index + 1
+
+    escrow_token_contract.transfer_from(amount=from_units(amount_units + order_fee), to=ctx.this, main_account=ctx.caller)
+
+    BatchOrderEvent({
+        "v": EVENT_SCHEMA_VERSION,
+        "base_token": base_token,
+        "quote_token": quote_token,
+        "trader": ctx.caller,
+        "epoch": epoch,
+        "side": side,
+        "amount": amount,
+        "limit_price": limit_price,
+    })
+
+    release_guard() # Deactivate Guard
+    return order_index
+
+
+@export
+def clear_epoch(base_token: str, quote_token: str):
+    # Anyone may clear once the epoch has run its length. All matched orders trade at one uniform price,
+    # filled pro rata on the heavier side, and every trader gets one transfer per token.
+    # All arithmetic is in integer units and floors, so payouts never exceed escrow; the dust goes to fees.
+    acquire_guard("Contract is busy, please try again.") # Re-entrancy Guard Check and Activate
+
+    epoch_seconds = batch_epoch_seconds[base_token, quote_token]
+    assert epoch_seconds > 0, "Batch mode is not enabled for this pair"
+    assert now >= batch_epoch_start[base_token, quote_token] + datetime.timedelta(seconds=epoch_seconds), "Epoch still running"
+
+    epoch = batch_epoch[base_token, quote_token]
+    order_count = batch_order_count[base_token, quote_token, epoch]
+    orders = []
+    for order_index in range(order_count):
+        orders.append(batch_orders[base_token, quote_token, epoch, order_index])
+        batch_orders[base_token, quote_token, epoch, order_index] = None # Orders live only until their epoch clears
+
+    # Clearing price: the limit price that matches the most base volume, then the least imbalance, then the lowest price
+    clearing_price = 0
+    best_volume = 0
+    best_imbalance = 0
+    best_supply = 0
+    best_demand = 0
+    for candidate in orders:
+        price = candidate["limit_price"]
+        volumes = clearing_volume(orders, price)
+        volume = min(volumes[0], volumes[1])
+        imbalance = abs(volumes[0] - volumes[1])
+        if volume <= 0:
+            continue
+        if volume > best_volume or (volume == best_volume and (imbalance < best_imbalance or (imbalance == best_imbalance and price < clearing_price))):
+            clearing_price = price
+            best_volume = volume
+            best_imbalance = imbalance
+            best_supply = volumes[0]
+            best_demand = volumes[1]
+
+    # Pro rata fills; the lighter side fills completely
+    payouts = {}
+    filled_per_order = []
+    base_taken = 0
+    quote_taken = 0
+    base_fees = 0
+    quote_fees = 0
+    for order in orders:
+        filled = 0
+        if order_matches(order, clearing_price):
+            if order["side"] == "SELL":
+                filled = order["amount"] * best_volume // best_supply
+                base_taken += filled
+            else:
+                filled = order["amount"] * best_volume // best_demand
+                quote_taken += filled
+        filled_per_order.append(filled)
+        fee_charged = compute_fee(filled, order["fee_bps"]) # Never above the escrowed fee since filled <= amount
+        refund = order["amount"] - filled + order["fee"] - fee_charged
+        if order["side"] == "SELL":
+            base_fees += fee_charged
+            add_payout(payouts, order["trader"], base_token, refund)
+        else:
+            quote_fees += fee_charged
+            add_payout(payouts, order["trader"], quote_token, refund)
+
+    # Each side's proceeds are split by its share of what the side handed over
+    base_paid = 0
+    quote_paid = 0
+    for order_index in range(order_count):
+        order = orders[order_index]
+        filled = filled_per_order[order_index]
+        if filled == 0:
+            continue
+        if order["side"] == "SELL":
+            proceeds = quote_taken * filled // base_taken
+            quote_paid += proceeds
+            add_payout(payouts, order["trader"], quote_token, proceeds)
+        else:
+            proceeds = base_taken * filled // quote_taken
+            base_paid += proceeds
+            add_payout(payouts, order["trader"], base_token, proceeds)
+
+    epoch_seed = hashlib.sha256(base_token + ":" + quote_token + ":" + str(epoch))
+    accrue_fee(base_token, base_fees + base_taken - base_paid, epoch_seed)
+    accrue_fee(quote_token, quote_fees + quote_taken - quote_paid, epoch_seed)
+
+    # Open the next epoch before paying out
+    batch_order_count[base_token, quote_token, epoch] = 0
+    batch_epoch[base_token, quote_token] = epoch + 1
+    batch_epoch_start[base_token, quote_token] = now
+
+    token_contracts = {base_token: I.import_module(base_token), quote_token: I.import_module(quote_token)}
+    for payout_key, payout_units in payouts.items():
+        account_and_token = payout_key.split(":")
+        token_contracts[account_and_token[1]].transfer(amount=from_units(payout_units), to=account_and_token[0])
+
+    clearing_price_decimal = decimal(str(clearing_price)) / PRICE_SCALE
+    EpochClearedEvent({
+        "v": EVENT_SCHEMA_VERSION,
+        "base_token": base_token,
+        "quote_token": quote_token,
+        "epoch": epoch,
+        "clearing_price": clearing_price_decimal,
+        "base_volume": from_units(base_taken),
+        "orders": order_count,
+    })
+
+    release_guard() # Deactivate Guard
+    return clearing_price_decimal
+
+
+@export
+def adjust_fee(trading_fee_bps: int):
+    # This function does not make external calls before its state change,
+    # but the guard prevents it from running inside a guarded operation of the same transaction.
+    assert not reentrancyGuardActive[ctx.signer], "Contract is busy, cannot adjust fee now."
+    assert ctx.caller == owner.get() or ctx.caller == router.get(), "Only owner can call this method!"
+    assert 0 <= trading_fee_bps <= MAX_FEE_BPS, "Fee must be between 0 and 1000 basis points"
+    fee.set(trading_fee_bps) # Effect
+    FeeAdjustmentEvent({"new_fee": trading_fee_bps})
 
 
 @export
 def withdraw(token_list: list):
-    assert not reentrancyGuardActive.get(), "Contract is busy, cannot withdraw now." # Re-entrancy Guard Check
-    reentrancyGuardActive.set(True) # Activate Guard
+    acquire_guard("Contract is busy, cannot withdraw now.") # Re-entrancy Guard Check and Activate
 
-    assert ctx.caller == owner.get(), "Only owner can call this method!"
+    assert ctx.caller == owner.get() or ctx.caller == router.get(), "Only owner can call this method!" # Fees still go to the owner
 
+    shard_count = fee_shards.get()
     for token_contract_name_in_list in token_list: # Renamed loop variable for clarity
-        amount_to_withdraw_for_token = earned_fees[token_contract_name_in_list]
-        if amount_to_withdraw_for_token > decimal("0.0"):
-            # Effect first: update internal accounting before external call
-            earned_fees[token_contract_name_in_list] = decimal("0.0")
+        amount_to_withdraw_for_token = 0
+        for shard in range(shard_count):
+            shard_amount = earned_fees[token_contract_name_in_list, shard]
+            if shard_amount > 0:
+                amount_to_withdraw_for_token += shard_amount
+                # Effect first: update internal accounting before external call
+                earned_fees[token_contract_name_in_list, shard] = 0
 
+        if amount_to_withdraw_for_token > 0:
             # Interaction
             token_module_to_withdraw_instance = I.import_module(token_contract_name_in_list) # Renamed for clarity
             token_module_to_withdraw_instance.transfer(
-                amount=amount_to_withdraw_for_token,
+                amount=from_units(amount_to_withdraw_for_token),
                 to=owner.get()
             )
-            # If transfer fails, the transaction aborts, earned_fees[token] = 0.0 is rolled back.
+            # If transfer fails, the transaction aborts and the shard resets are rolled back.
+
+    release_guard() # Deactivate Guard
 
-    reentrancyGuardActive.set(False) # Deactivate Guard
+@export
+def set_router(router_contract: str):
+    # Attach this contract to a registry as the shard of one pair
+    assert ctx.caller == owner.get(), "Only owner can call this method!"
+    router.set(router_contract)
+
+@export
+def set_migration_target(target_contract: str):
+    # The newer OTC contract migrate_out may send listings to; it must name this contract as its source
+    assert ctx.caller == owner.get(), "Only owner can call this method!"
+    migration_target.set(target_contract)
+
+@export
+def set_migration_source(source_contract: str):
+    assert ctx.caller == owner.get(), "Only owner can call this method!"
+    migration_source.set(source_contract)
+
+@export
+def set_fee_shards(shards: int):
+    # Shards can only be added, so fees already accrued in a shard are never left outside the sum
+    assert ctx.caller == owner.get(), "Only owner can call this method!"
+    assert fee_shards.get() <= shards <= MAX_FEE_SHARDS, "Fee shards can only grow, up to MAX_FEE_SHARDS"
+    fee_shards.set(shards)
 
 @export
 def view_earned_fees(token: str):
-    return earned_fees[token]
+    total_earned = 0
+    for shard in range(fee_shards.get()):
+        total_earned += earned_fees[token, shard]
+    return from_units(total_earned)
 
 @export
 def view_contract_balance(token: str):
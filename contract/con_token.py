@@ -33,6 +33,36 @@ def transfer_from(amount: float, to: str, main_account: str):
     balances[main_account] -= amount
     balances[to] += amount
 
+def total_of(recipients: dict):
+    assert len(recipients) > 0, 'No recipients!'
+    total = 0
+    for to, amount in recipients.items():
+        assert amount > 0, 'Cannot transfer negative!'
+        total += amount
+    return total
+
+@export
+def transfer_many(recipients: dict):
+    # recipients maps account -> amount; the sender is debited once for all of them
+    sender = ctx.caller
+    total = total_of(recipients)
+    assert balances[sender] >= total, 'Transfer amount exceeds balance!'
+    balances[sender] -= total
+    for to, amount in recipients.items():
+        balances[to] += amount
+
+@export
+def transfer_from_many(recipients: dict, main_account: str):
+    sender = ctx.caller
+    total = total_of(recipients)
+    assert balances[main_account, sender] >= total, \
+        f'Transfer amount exceeds allowance for {main_account}!'
+    assert balances[main_account] >= total, 'Transfer amount exceeds balance!'
+    balances[main_account, sender] -= total
+    balances[main_account] -= total
+    for to, amount in recipients.items():
+        balances[to] += amount
+
 @export
 def balance_of(address: str):
     return balances[address]
@@ -0,0 +1 @@
+"""Off-chain tooling for the OTC contracts in this directory."""
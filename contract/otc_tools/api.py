@@ -0,0 +1,225 @@
+"""Cached HTTP read API for OTC listings, served from a local listing store.
+
+The frontend's ``fetchOpenOffers`` sends a GraphQL query to the node on
+every page view, and the node scans state each time. This service instead
+answers from an ``otc_tools.book.ListingStore``. The store is seeded from
+a state dump and follows the contract's event log, so a read costs an
+index lookup and the node sees no read traffic.
+
+    GET /offers?offer_token=&take_token=&maker=&status=OPEN&cursor=&limit=25
+
+At least one of the pair or the maker narrows the scan; without them every
+listing of the status is paged, oldest first. A pair pages cheapest first.
+The response is ``{"offers": [...], "cursor": ...}``, the offers in the
+shape ``fetchOpenOffers`` returns. Pass the cursor back for the next page;
+it is null on the last one.
+
+Bodies are cached in an in-process LRU cache. An Offer, TakeOffer,
+CancelOffer or MigrateOffer event drops only the cached pages of the
+scopes it touched. Every response carries an ETag over its body, so a
+client sending If-None-Match for an unchanged page gets a bodyless 304.
+
+    python -m otc_tools.api state.jsonl --events events.jsonl --contract con_otc --port 8080
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlsplit
+
+from otc_tools.book import STATUSES, ListingStore, offer_shape
+from otc_tools.state import decode_value
+
+CACHE_SIZE = 1024  # Cached pages
+MAX_HEADER_BYTES = 16 * 1024
+REASONS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+
+class PageCache:
+    """LRU of response bodies, each filed under the store scope it was read from."""
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()  # key -> (scope, etag, body)
+        self.by_scope = {}  # scope -> keys cached from it
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[1], entry[2]
+
+    def put(self, key, scope, etag: str, body: bytes) -> None:
+        self.entries[key] = (scope, etag, body)
+        self.entries.move_to_end(key)
+        self.by_scope.setdefault(scope, set()).add(key)
+        while len(self.entries) > self.size:
+            old_key, (old_scope, _, _) = self.entries.popitem(last=False)
+            self.by_scope[old_scope].discard(old_key)
+
+    def invalidate(self, scopes) -> int:
+        dropped = 0
+        for scope in scopes:
+            for key in self.by_scope.pop(scope, ()):
+                if self.entries.pop(key, None) is not None:
+                    dropped += 1
+        return dropped
+
+
+class ReadService:
+    def __init__(self, store: ListingStore, contract: str = "con_otc", cache_size: int = CACHE_SIZE):
+        self.store = store
+        self.contract = contract
+        self.cache = PageCache(cache_size)
+
+    def on_event(self, event: dict) -> None:
+        if event.get("contract", self.contract) != self.contract:
+            return
+        _, scopes = self.store.apply(event)
+        self.cache.invalidate(scopes)
+
+    def offers(self, params: dict) -> tuple:
+        """``(etag, body)`` for one page; raises ValueError on bad parameters."""
+        status = params.get("status", "OPEN")
+        if status not in STATUSES:
+            raise ValueError(f"status must be one of {', '.join(STATUSES)}")
+        offer_token, take_token, maker = params.get("offer_token"), params.get("take_token"), params.get("maker")
+        if bool(offer_token) != bool(take_token):
+            raise ValueError("offer_token and take_token go together")
+        try:
+            limit = int(params.get("limit", 25))
+        except ValueError:
+            raise ValueError("limit must be an integer") from None
+        cursor = params.get("cursor", "")
+
+        def by_maker(listing):
+            return listing["maker"] == maker
+
+        where = None
+        if offer_token:
+            scope = ("pair", offer_token, take_token, status)
+            if maker:
+                where = by_maker  # Filter inside the pair's price order
+        elif maker:
+            scope = ("maker", maker, status)
+        else:
+            scope = ("status", status)
+
+        key = (scope, maker if where else None, cursor, limit)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        ids, next_cursor = self.store.page(scope, cursor, limit, where)
+        body = json.dumps(
+            {"offers": [offer_shape(listing_id, self.store.listings[listing_id]) for listing_id in ids],
+             "cursor": next_cursor},
+            separators=(",", ":"), default=str,
+        ).encode()
+        etag = '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+        self.cache.put(key, scope, etag, body)
+        return etag, body
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """One request per connection, then close."""
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+        status, headers, body = self.respond(head[:MAX_HEADER_BYTES].decode("latin-1"))
+        lines = [f"HTTP/1.1 {status} {REASONS[status]}", *(f"{name}: {value}" for name, value in headers.items()),
+                 f"Content-Length: {len(body)}", "Connection: close", "", ""]
+        writer.write("\r\n".join(lines).encode("latin-1") + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    def respond(self, head: str) -> tuple:
+        request_line, *header_lines = head.split("\r\n")
+        parts = request_line.split(" ")
+        if len(parts) != 3:
+            return 400, {}, b""
+        method, target, _ = parts
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        url = urlsplit(target)
+        if url.path != "/offers":
+            return 404, {}, b""
+        if method not in ("GET", "HEAD"):
+            return 405, {"Allow": "GET, HEAD"}, b""
+        try:
+            etag, body = self.offers(dict(parse_qsl(url.query)))
+        except ValueError as error:
+            return 400, {"Content-Type": "application/json"}, json.dumps({"error": str(error)}).encode()
+
+        response_headers = {"ETag": etag, "Cache-Control": "no-cache", "Access-Control-Allow-Origin": "*"}
+        if etag in (tag.strip() for tag in headers.get("if-none-match", "").split(",")):
+            return 304, response_headers, b""
+        response_headers["Content-Type"] = "application/json"
+        return 200, response_headers, b"" if method == "HEAD" else body
+
+    async def follow(self, events) -> None:
+        """Apply events from an async iterator until it ends."""
+        async for event in events:
+            self.on_event(event)
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8080):
+        return await asyncio.start_server(self.handle, host, port)
+
+
+async def tail_events(path, poll_seconds: float = 0.5):
+    """Yield events from a JSON-lines event log, then keep yielding lines appended to it."""
+    with open(path) as handle:
+        pending = ""
+        while True:
+            chunk = handle.readline()
+            if not chunk:
+                await asyncio.sleep(poll_seconds)
+                continue
+            pending += chunk
+            if not pending.endswith("\n"):
+                continue  # Partly written line
+            line, pending = pending, ""
+            if line.strip():
+                yield decode_value(json.loads(line))
+
+
+async def run(service: ReadService, host: str, port: int, events_path: str = None) -> None:
+    server = await service.serve(host, port)
+    tasks = [asyncio.ensure_future(server.serve_forever())]
+    if events_path:
+        tasks.append(asyncio.ensure_future(service.follow(tail_events(events_path))))
+    await asyncio.gather(*tasks)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("state", help="state dump the listing store starts from")
+    parser.add_argument("--events", help="JSON-lines event log to follow, starting where the dump was taken")
+    parser.add_argument("--contract", default="con_otc")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE)
+    args = parser.parse_args(argv)
+
+    store = ListingStore()
+    print(f"{store.load(args.state, args.contract)} listings loaded")
+    service = ReadService(store, args.contract, args.cache_size)
+    try:
+        asyncio.run(run(service, args.host, args.port, args.events))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
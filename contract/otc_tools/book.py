@@ -0,0 +1,199 @@
+"""A local, event-fed copy of the OTC listing book for read services.
+
+``ListingStore`` keeps every listing it has seen in the contract's own
+record shape: integer units, the sortable price key and the status. It
+also keeps sorted indexes per scope:
+- ``("pair", offer_token, take_token, status)``: cheapest first, the
+  order ``get_open_offers`` walks;
+- ``("maker", maker, status)``: oldest first;
+- ``("status", status)``: oldest first.
+
+It is seeded from a state dump and kept current by applying Offer,
+TakeOffer, CancelOffer and MigrateOffer events in log order. Every change
+reports the scopes it touched, so caches and feeds built on the store only
+invalidate what actually moved. Pages are cursor based, the cursor being
+the last id returned, so a page stays in place while listings come and go.
+
+``ClientEvents`` stands in for a node's event stream in tests and local
+runs. It makes calls on a ContractingClient market and forwards each
+call's events to its listeners.
+"""
+import bisect
+
+from otc_tools.model import compute_fee, from_units
+from otc_tools.state import amount_units, iter_listings
+
+MAX_PAGE_SIZE = 100  # Mirrors con_otc_v3.MAX_PAGE_SIZE
+STATUSES = ("OPEN", "EXECUTED", "CANCELLED", "MIGRATED")
+CLOSING_EVENTS = {"TakeOffer": "EXECUTED", "CancelOffer": "CANCELLED", "MigrateOffer": "MIGRATED"}
+
+
+def event_fields(event: dict) -> dict:
+    return {**(event.get("data") or {}), **(event.get("data_indexed") or {})}
+
+
+def units(value) -> int:
+    # Dumps of con_otc_v3 hold integer units, events and older listings hold decimals
+    return value if isinstance(value, int) else amount_units(value)
+
+
+def units_text(value: int) -> str:
+    """Decimal text of a unit count, as the frontend's ``fromUnits`` renders it."""
+    return format(from_units(value).normalize(), "f")
+
+
+def offer_shape(listing_id: str, listing: dict) -> dict:
+    """A listing as ``fetchOpenOffers`` returns it: the stored record with amounts as decimal text."""
+    return {
+        "id": listing_id,
+        **listing,
+        "offer_amount": units_text(listing["offer_amount"]),
+        "take_amount": units_text(listing["take_amount"]),
+        "date_listed": str(listing["date_listed"]),
+    }
+
+
+def listing_from_offer(fields: dict) -> dict:
+    offer_units, take_units = units(fields["offer_amount"]), units(fields["take_amount"])
+    fee_bps = int(fields["fee"])
+    return {
+        "maker": fields["maker"],
+        "taker": None,
+        "offer_token": fields["offer_token"],
+        "offer_amount": offer_units,
+        "take_token": fields["take_token"],
+        "take_amount": take_units,
+        "price": fields["price"],
+        "date_listed": fields["date_listed"],
+        "fee": fee_bps,
+        "maker_fee": compute_fee(offer_units, fee_bps),  # The contract fixes both fees from the rate at listing
+        "taker_fee": compute_fee(take_units, fee_bps),
+        "status": "OPEN",
+    }
+
+
+def listing_scopes(listing: dict) -> tuple:
+    status = listing["status"]
+    return (
+        ("pair", listing["offer_token"], listing["take_token"], status),
+        ("maker", listing["maker"], status),
+        ("status", status),
+    )
+
+
+class ListingStore:
+    def __init__(self):
+        self.listings = {}  # id -> record in the contract's shape
+        self.sequence = {}  # id -> listing order, the tie-break of every index
+        self.indexes = {}  # scope -> sorted [(sort key, id)]
+        self.version = 0  # Bumped on every change
+        self.unresolved = 0  # Closing events for listings the store never saw
+
+    def sort_key(self, scope: tuple, listing_id: str) -> tuple:
+        if scope[0] == "pair":
+            return self.listings[listing_id].get("price") or "", self.sequence[listing_id]
+        return (self.sequence[listing_id],)
+
+    def put(self, listing_id: str, listing: dict) -> set:
+        """Insert or replace a listing; returns the scopes whose contents changed."""
+        touched = set()
+        previous = self.listings.get(listing_id)
+        if previous is not None:
+            for scope in listing_scopes(previous):
+                entries = self.indexes[scope]
+                del entries[bisect.bisect_left(entries, (self.sort_key(scope, listing_id), listing_id))]
+                touched.add(scope)
+        else:
+            self.sequence[listing_id] = len(self.sequence)
+        self.listings[listing_id] = listing
+        for scope in listing_scopes(listing):
+            bisect.insort(self.indexes.setdefault(scope, []), (self.sort_key(scope, listing_id), listing_id))
+            touched.add(scope)
+        self.version += 1
+        return touched
+
+    def load(self, source, contract: str) -> int:
+        """Seed from a state dump (path, dict or nodes); listing order follows date_listed."""
+        listings = sorted(iter_listings(source, contract), key=lambda item: (str(item[1].get("date_listed")), item[0]))
+        for listing_id, listing in listings:
+            self.put(listing_id, {**listing, "offer_amount": units(listing["offer_amount"]),
+                                  "take_amount": units(listing["take_amount"])})
+        return len(listings)
+
+    def apply(self, event: dict) -> tuple:
+        """Apply one event. Returns ``(change, scopes)``, change being ``(kind, id, listing)`` or None.
+
+        kind is "add" for a new OPEN listing, "fill" when it was taken, "remove" when it was
+        cancelled or migrated away.
+        """
+        name = event.get("event")
+        fields = event_fields(event)
+        if name == "Offer":
+            listing = listing_from_offer(fields)
+            return ("add", fields["id"], listing), self.put(fields["id"], listing)
+        if name not in CLOSING_EVENTS:
+            return None, set()
+        listing = self.listings.get(fields["id"])
+        if listing is None:
+            self.unresolved += 1
+            return None, set()
+        if listing["status"] != "OPEN":
+            return None, set()  # Replayed event
+        closed = {**listing, "status": CLOSING_EVENTS[name]}
+        if name == "TakeOffer":
+            closed["taker"] = fields.get("taker")
+        kind = "fill" if name == "TakeOffer" else "remove"
+        return (kind, fields["id"], closed), self.put(fields["id"], closed)
+
+    def page(self, scope: tuple, cursor: str = "", limit: int = 25, where=None) -> tuple:
+        """``(ids, next_cursor)`` of one page of ``scope``; next_cursor is None once the scope is exhausted."""
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        entries = self.indexes.get(scope, [])
+        position = 0
+        if cursor:
+            cursor_listing = self.listings.get(cursor)
+            if cursor_listing is None or (scope[0] == "pair" and (
+                    cursor_listing["offer_token"], cursor_listing["take_token"]) != scope[1:3]):
+                raise ValueError("cursor does not belong to this scope")
+            # A cursor that has since left the scope still sorts where it was
+            position = bisect.bisect_right(entries, (self.sort_key(scope, cursor), cursor))
+
+        ids = []
+        while position < len(entries) and len(ids) < limit:
+            listing_id = entries[position][1]
+            if where is None or where(self.listings[listing_id]):
+                ids.append(listing_id)
+            position += 1
+        return ids, (ids[-1] if ids and position < len(entries) else None)
+
+    def open_offers(self, offer_token: str, take_token: str) -> list:
+        """Every OPEN listing of a pair, cheapest first, in the ``fetchOpenOffers`` shape."""
+        scope = ("pair", offer_token, take_token, "OPEN")
+        return [offer_shape(listing_id, self.listings[listing_id]) for _, listing_id in self.indexes.get(scope, [])]
+
+    def pairs(self) -> list:
+        """Pairs with at least one OPEN listing."""
+        return sorted(scope[1:3] for scope, entries in self.indexes.items()
+                      if scope[0] == "pair" and scope[3] == "OPEN" and entries)
+
+
+class ClientEvents:
+    def __init__(self, market):
+        self.market = market
+        self.listeners = []
+
+    def subscribe(self, listener) -> None:
+        self.listeners.append(listener)
+
+    def call(self, function: str, signer: str, **kwargs):
+        """Run an OTC call in the next block and hand its events to every listener; returns the result."""
+        output = getattr(self.market.otc, function)(
+            signer=signer, environment=self.market.tick(), return_full_output=True, **kwargs
+        )
+        for event in output.get("events") or []:
+            event.setdefault("contract", self.market.otc_name)
+            for listener in self.listeners:
+                listener(event)
+        return output["result"]
+
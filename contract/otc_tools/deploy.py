@@ -0,0 +1,104 @@
+"""Stand up con_otc and mock tokens in a ContractingClient for the off-chain tools.
+
+Each tool process owns its client. Pass a distinct ``storage_home`` per
+process so parallel workers never share a state directory.
+"""
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+
+CONTRACT_DIR = Path(__file__).resolve().parent.parent
+OWNER = "otc_owner_wallet"
+OTC_NAME = "con_otc"
+TOKEN_SUPPLY = 1_000_000_000  # Minted to the deployer by con_token.seed
+
+
+def read_source(filename: str) -> str:
+    return (CONTRACT_DIR / filename).read_text()
+
+
+def new_client(storage_home=None, metering: bool = False, flush: bool = True):
+    from contracting.client import ContractingClient
+    from contracting.storage.driver import Driver
+
+    if storage_home is None:
+        storage_home = tempfile.mkdtemp(prefix="otc_tools_")
+    client = ContractingClient(driver=Driver(storage_home=Path(storage_home)), metering=metering)
+    if flush:  # Tools that work on an existing state directory pass flush=False
+        client.flush()
+    return client
+
+
+def block_time(moment: datetime):
+    """A contracting Datetime for the ``now`` environment key."""
+    from contracting.stdlib.bridge.time import Datetime
+
+    return Datetime(
+        year=moment.year, month=moment.month, day=moment.day,
+        hour=moment.hour, minute=moment.minute, second=moment.second,
+    )
+
+
+@dataclass
+class Market:
+    client: object
+    otc: object
+    otc_name: str
+    tokens: dict = field(default_factory=dict)  # name -> contract handle
+    owner: str = OWNER
+    clock: datetime = datetime(2024, 6, 20, 10, 0, 0)
+
+    def tick(self, seconds: int = 1) -> dict:
+        """Advance the block clock and return the environment for the next call."""
+        self.clock += timedelta(seconds=seconds)
+        return {"chain_id": "otc-tools", "now": block_time(self.clock)}
+
+    def fund(self, accounts, amount) -> None:
+        from contracting.stdlib.bridge.decimal import ContractingDecimal
+
+        for token in self.tokens.values():
+            for account in accounts:
+                token.transfer(amount=ContractingDecimal(str(amount)), to=account, signer=self.owner)
+
+    def approve_all(self, accounts, amount) -> None:
+        """Give the OTC contract a standing allowance on every token, for tools that replay raw calls."""
+        from contracting.stdlib.bridge.decimal import ContractingDecimal
+
+        for token in self.tokens.values():
+            for account in accounts:
+                token.approve(amount=ContractingDecimal(str(amount)), to=self.otc_name, signer=account)
+
+
+def fund_stamps(client, accounts, amount: int = 1_000_000, owner: str = OWNER) -> None:
+    """Deploy con_token as ``currency`` and fund signers, so a metering client can charge stamps."""
+    if client.get_contract("currency") is None:
+        client.submit(
+            read_source("con_token.py"), name="currency",
+            constructor_args={"vk": owner, "name": "Stamps", "symbol": "XIAN"}, signer=owner,
+        )
+    currency = client.get_contract("currency")
+    for account in accounts:
+        if account != owner:
+            currency.transfer(amount=amount, to=account, signer=owner)
+
+
+def deploy_market(
+    client,
+    otc_file: str = "con_otc_v3.py",
+    otc_name: str = OTC_NAME,
+    token_names=("con_token_a", "con_token_b"),
+    owner: str = OWNER,
+) -> Market:
+    client.submit(read_source(otc_file), name=otc_name, signer=owner)
+    token_source = read_source("con_token.py")
+    tokens = {}
+    for index, token_name in enumerate(token_names):
+        client.submit(
+            token_source,
+            name=token_name,
+            constructor_args={"vk": owner, "name": token_name, "symbol": f"TK{index}"},
+            signer=owner,
+        )
+        tokens[token_name] = client.get_contract(token_name)
+    return Market(client=client, otc=client.get_contract(otc_name), otc_name=otc_name, tokens=tokens, owner=owner)
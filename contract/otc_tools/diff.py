@@ -0,0 +1,200 @@
+"""Differential execution of two OTC contract versions over one trace.
+
+Both versions are deployed with the same tokens, actors and funding, each in
+its own worker process with its own ContractingClient and storage, and the
+same trace is replayed against both. Every call's status, return value,
+emitted events and state writes are compared, and stamps are totalled per
+function so a rewrite can be checked against the reference for both
+behaviour and cost.
+
+Listing ids are random per deployment, so ids returned by ``list_offer`` on
+the second side are mapped onto the first side's ids before comparing.
+
+    python -m otc_tools.diff con_otc_v3.py con_otc_candidate.py --steps 500
+    python -m otc_tools.diff con_otc_v3.py con_otc_candidate.py --trace recorded.jsonl
+"""
+import argparse
+import shutil
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from decimal import Decimal
+
+from otc_tools.deploy import OWNER, deploy_market, fund_stamps, new_client
+from otc_tools.trace import OTC, generate_trace, load_trace, replay_call, trace_participants
+
+ID_PRODUCING = {"list_offer"}
+DEFAULT_IGNORE = ("currency.",)  # Stamp payments differ whenever costs differ
+
+
+def legacy_fee_percent(call):
+    # con_otc_vulnerable takes its fee as a percentage, traces are written in basis points
+    if call.contract == OTC and call.function == "adjust_fee":
+        percent = {"$decimal": str(Decimal(call.kwargs["trading_fee_bps"]) / 100)}
+        return replace(call, kwargs={"trading_fee": percent})
+    return call
+
+
+ADAPTERS = {"con_otc_vulnerable.py": legacy_fee_percent}
+
+
+def plain(value):
+    """Reduce contract values to comparable, picklable primitives."""
+    if isinstance(value, BaseException):
+        return f"error: {value}"
+    if isinstance(value, dict):
+        return {str(key): plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    if value is None or isinstance(value, (bool, int, str)):
+        return value
+    if type(value).__name__ in ("ContractingDecimal", "Decimal", "float"):
+        return str(Decimal(str(value)).normalize())
+    return str(value)
+
+
+def run_side(otc_file: str, trace, actors, token_names, funding: int) -> list:
+    """Worker: deploy ``otc_file`` in a private client and replay the trace, one record per call."""
+    storage_home = tempfile.mkdtemp(prefix="otc_diff_")
+    client = new_client(storage_home, metering=True)
+    try:
+        fund_stamps(client, list(actors) + [OWNER])
+        market = deploy_market(client, otc_file=otc_file, token_names=token_names)
+        market.fund(actors, funding)
+        market.approve_all(actors, funding * 1_000)
+
+        adapt = ADAPTERS.get(otc_file, lambda call: call)
+        results, records = [], []
+        for call in trace:
+            output = replay_call(market, adapt(call), results)
+            results.append(output["result"] if output["status_code"] == 0 else None)
+            records.append({
+                "status": output["status_code"],
+                "result": plain(output["result"]),
+                "stamps": output["stamps_used"],
+                "writes": plain(output["writes"]),
+                "events": [
+                    plain({"event": event.get("event"), "indexed": event.get("data_indexed"), "data": event.get("data")})
+                    for event in output["events"]
+                ],
+            })
+        return records
+    finally:
+        client.flush()
+        shutil.rmtree(storage_home, ignore_errors=True)
+
+
+def alias(value, aliases: dict):
+    """Rewrite side-B listing ids, alone or inside ``contract.variable:key`` strings, to side-A ids."""
+    if isinstance(value, str):
+        if value in aliases:
+            return aliases[value]
+        if ":" in value:
+            return ":".join(aliases.get(part, part) for part in value.split(":"))
+        return value
+    if isinstance(value, dict):
+        return {alias(key, aliases): alias(item, aliases) for key, item in value.items()}
+    if isinstance(value, list):
+        return [alias(item, aliases) for item in value]
+    return value
+
+
+@dataclass
+class Divergence:
+    index: int
+    function: str
+    aspect: str  # status, result, events or writes
+    detail: str
+
+
+@dataclass
+class DiffReport:
+    label_a: str
+    label_b: str
+    calls: int = 0
+    divergences: list = field(default_factory=list)
+    stamps: dict = field(default_factory=lambda: defaultdict(lambda: [0, 0, 0]))  # function -> [a, b, calls]
+
+    @property
+    def identical(self) -> bool:
+        return not self.divergences
+
+    def format(self, limit: int = 20) -> str:
+        lines = [f"{self.label_a} vs {self.label_b}: {self.calls} calls, {len(self.divergences)} divergence(s)"]
+        for divergence in self.divergences[:limit]:
+            lines.append(f"  #{divergence.index} {divergence.function} {divergence.aspect}: {divergence.detail}")
+        lines.append(f"  {'function':<16}{'calls':>8}{'stamps A':>12}{'stamps B':>12}{'saved':>9}")
+        for function, (stamps_a, stamps_b, calls) in sorted(self.stamps.items()):
+            saved = f"{(stamps_a - stamps_b) / stamps_a:.1%}" if stamps_a else "-"
+            lines.append(f"  {function:<16}{calls:>8}{stamps_a:>12}{stamps_b:>12}{saved:>9}")
+        return "\n".join(lines)
+
+
+def compare(trace, records_a: list, records_b: list, report: DiffReport, ignore=DEFAULT_IGNORE) -> DiffReport:
+    aliases = {}
+    for index, (call, a, b) in enumerate(zip(trace, records_a, records_b)):
+        report.calls += 1
+        totals = report.stamps[call.function]
+        totals[0] += a["stamps"]
+        totals[1] += b["stamps"]
+        totals[2] += 1
+
+        def flag(aspect, detail):
+            report.divergences.append(Divergence(index, call.function, aspect, detail))
+
+        if a["status"] != b["status"]:
+            flag("status", f"{a['result']!r} vs {b['result']!r}")
+            continue
+        if call.function in ID_PRODUCING and a["status"] == 0 and isinstance(b["result"], str):
+            aliases[b["result"]] = a["result"]
+
+        result_b = alias(b["result"], aliases)
+        if a["result"] != result_b:
+            flag("result", f"{a['result']!r} vs {result_b!r}")
+        events_b = alias(b["events"], aliases)
+        if a["events"] != events_b:
+            flag("events", f"{a['events']!r} vs {events_b!r}")
+
+        writes_a = {key: value for key, value in a["writes"].items() if not key.startswith(ignore)}
+        writes_b = {key: value for key, value in alias(b["writes"], aliases).items() if not key.startswith(ignore)}
+        changed = sorted(key for key in writes_a.keys() | writes_b.keys() if writes_a.get(key) != writes_b.get(key))
+        if changed:
+            flag("writes", ", ".join(f"{key}: {writes_a.get(key)!r} vs {writes_b.get(key)!r}" for key in changed[:5]))
+    return report
+
+
+def run_differential(trace, otc_file_a: str, otc_file_b: str, actors, token_names, funding: int = 100_000,
+                     ignore=DEFAULT_IGNORE) -> DiffReport:
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        side_a = pool.submit(run_side, otc_file_a, trace, actors, token_names, funding)
+        side_b = pool.submit(run_side, otc_file_b, trace, actors, token_names, funding)
+        records_a, records_b = side_a.result(), side_b.result()
+    return compare(trace, records_a, records_b, DiffReport(otc_file_a, otc_file_b), ignore=tuple(ignore))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("reference", help="contract file replayed as side A, e.g. con_otc_v3.py")
+    parser.add_argument("candidate", help="contract file replayed as side B")
+    parser.add_argument("--trace", help="JSON-lines trace to replay instead of a generated one")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--steps", type=int, default=300)
+    parser.add_argument("--actors", type=int, default=6)
+    parser.add_argument("--tokens", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    actors = [f"diff_actor_{index}" for index in range(args.actors)]
+    token_names = [f"con_diff_token_{index}" for index in range(args.tokens)]
+    if args.trace:
+        trace = load_trace(args.trace)
+        actors, token_names = trace_participants(trace, OWNER)
+    else:
+        trace = generate_trace(args.seed, args.steps, actors, token_names, OWNER)
+    report = run_differential(trace, args.reference, args.candidate, actors, token_names)
+    print(report.format())
+    return 0 if report.identical else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
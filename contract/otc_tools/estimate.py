@@ -0,0 +1,185 @@
+"""Dry-run OTC transactions against a snapshot of contract state.
+
+A snapshot is a state dump (see ``otc_tools.state``) holding the OTC
+contract and the tokens it trades, code included, as ``dump_state`` writes
+it for prefixes like ``["con_otc.", "con_token_a.", "con_token_b."]``. It
+is loaded once into a base storage directory. Each candidate, either one
+call or a sequence of calls written as an ``otc_tools.trace`` trace, then
+runs on a private copy of that directory in a metering ContractingClient.
+Nothing a dry run does reaches the base, so candidates never see each
+other's effects.
+
+For every call the estimate holds:
+- the stamps used;
+- the return value, or the assertion that reverted it;
+- the state it changed, each key with its value before and after.
+
+Candidates are spread over worker processes.
+
+    python -m otc_tools.estimate state.jsonl calls.jsonl --contract con_otc --each --workers 4
+
+Without ``--each``, the calls in the file run as one sequence.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal
+
+from otc_tools.deploy import OTC_NAME, OWNER, Market, new_client, read_source
+from otc_tools.diff import DEFAULT_IGNORE, plain
+from otc_tools.state import iter_state, split_key
+from otc_tools.trace import OTC, load_trace, replay_call
+
+STAMP_BUDGET = 1_000_000  # Stamp balance each signer gets in its dry-run copy
+
+
+def contracting_value(value):
+    """Dump values decode to Decimal and datetime; contracts expect contracting's own types."""
+    from contracting.stdlib.bridge.decimal import ContractingDecimal
+    from contracting.stdlib.bridge.time import Datetime
+
+    if isinstance(value, Decimal):
+        return ContractingDecimal(str(value))
+    if isinstance(value, datetime):
+        return Datetime(year=value.year, month=value.month, day=value.day, hour=value.hour,
+                        minute=value.minute, second=value.second, microsecond=value.microsecond)
+    if isinstance(value, dict):
+        return {key: contracting_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [contracting_value(item) for item in value]
+    return value
+
+
+def prepare(snapshot, storage_home=None) -> str:
+    """Load ``snapshot`` into a storage directory that dry runs copy from, and return its path."""
+    storage_home = storage_home or tempfile.mkdtemp(prefix="otc_estimate_base_")
+    client = new_client(storage_home)
+    driver = client.raw_driver
+    nodes = [(key, value) for key, value in iter_state(snapshot) if not key.endswith(".__compiled__")]
+    for key, value in nodes:
+        if key.endswith(".__code__"):
+            driver.set_contract(name=split_key(key)[0], code=value)  # Compiles the stored, already linted source
+    for key, value in nodes:
+        if not key.endswith(".__code__"):
+            driver.set(key, contracting_value(value))
+    if client.get_contract("currency") is None:
+        client.submit(read_source("con_token.py"), name="currency",
+                      constructor_args={"vk": OWNER, "name": "Stamps", "symbol": "XIAN"}, signer=OWNER)
+    driver.commit()
+    return storage_home
+
+
+@dataclass
+class Estimate:
+    function: str
+    signer: str
+    ok: bool
+    stamps: int
+    result: object = None  # Plain return value when ok
+    error: str = None  # Assertion message when reverted
+    changes: dict = field(default_factory=dict)  # key -> (before, after), stamp payments left out
+    events: list = field(default_factory=list)
+
+
+_base_clients = {}  # base path -> read-only client, one per worker process
+
+
+def before_value(base: str, key: str, earlier: list):
+    """The value ``key`` had before the current call: an earlier call's write, else the snapshot's."""
+    for estimate in reversed(earlier):
+        if key in estimate.changes:
+            return estimate.changes[key][1]
+    if base not in _base_clients:
+        _base_clients[base] = new_client(base, flush=False)
+    return _base_clients[base].raw_driver.get(key)
+
+
+def dry_run(base: str, calls, otc_name: str = OTC_NAME, now: datetime = None, ignore=DEFAULT_IGNORE) -> list:
+    """Run ``calls`` in order on a private copy of ``base``; one Estimate per call."""
+    from contracting.stdlib.bridge.decimal import ContractingDecimal
+
+    storage_home = tempfile.mkdtemp(prefix="otc_estimate_")
+    shutil.copytree(base, storage_home, dirs_exist_ok=True)
+    client = new_client(storage_home, metering=True, flush=False)
+    try:
+        driver = client.raw_driver
+        for signer in {call.signer for call in calls}:
+            driver.set(f"currency.balances:{signer}", ContractingDecimal(STAMP_BUDGET))
+        contracts = {call.contract for call in calls} - {OTC}
+        market = Market(
+            client=client, otc=client.get_contract(otc_name), otc_name=otc_name,
+            tokens={name: client.get_contract(name) for name in contracts},
+            clock=now or datetime.utcnow(),
+        )
+
+        estimates, results = [], []
+        for call in calls:
+            written = {}
+            output = replay_call(market, call, results)
+            ok = output["status_code"] == 0
+            results.append(output["result"] if ok else None)
+            for key, after in output["writes"].items():
+                if not key.startswith(tuple(ignore)):
+                    written[key] = (plain(before_value(base, key, estimates)), plain(after))
+            estimates.append(Estimate(
+                function=call.function,
+                signer=call.signer,
+                ok=ok,
+                stamps=output["stamps_used"],
+                result=plain(output["result"]) if ok else None,
+                error=None if ok else str(output["result"]),
+                changes=written,
+                events=[plain(event) for event in output["events"]],
+            ))
+        return estimates
+    finally:
+        shutil.rmtree(storage_home, ignore_errors=True)
+
+
+def estimate_many(base: str, candidates, otc_name: str = OTC_NAME, now: datetime = None, workers: int = None) -> list:
+    """Dry-run every candidate (a list of calls) in parallel; results are in candidate order."""
+    candidates = [list(candidate) for candidate in candidates]
+    workers = workers or min(len(candidates), os.cpu_count() or 1) or 1
+    if workers == 1:
+        return [dry_run(base, candidate, otc_name, now) for candidate in candidates]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(dry_run, base, candidate, otc_name, now) for candidate in candidates]
+        return [future.result() for future in futures]
+
+
+def format_estimates(estimates) -> str:
+    lines = []
+    for index, estimate in enumerate(estimates):
+        outcome = f"-> {estimate.result!r}" if estimate.ok else f"REVERTS: {estimate.error}"
+        lines.append(f"#{index} {estimate.function} by {estimate.signer}: {estimate.stamps} stamps {outcome}")
+        for key, (before, after) in sorted(estimate.changes.items()):
+            lines.append(f"    {key}: {before!r} -> {after!r}")
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("snapshot", help="state dump with the OTC contract, its tokens and their code")
+    parser.add_argument("calls", help="JSON-lines trace of the calls to estimate")
+    parser.add_argument("--contract", default=OTC_NAME)
+    parser.add_argument("--each", action="store_true", help="estimate every call on its own, in parallel")
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args(argv)
+
+    calls = load_trace(args.calls)
+    base = prepare(args.snapshot)
+    try:
+        candidates = [[call] for call in calls] if args.each else [calls]
+        for estimates in estimate_many(base, candidates, args.contract, workers=args.workers):
+            print(format_estimates(estimates))
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,304 @@
+"""Columnar export of OTC listings and lifecycle events for analytics.
+
+Listing records come from a state dump and events from an event log (see
+``otc_tools.state``). Both are streamed in fixed-size chunks into Parquet,
+one row group per chunk, or into a NumPy ``.npz`` archive. Tokens,
+accounts, statuses and event names are dictionary-encoded as int32 codes,
+with -1 for missing values. Amounts and fees are int64 fixed-point units
+of 10 ** -8, and dates are int64 UNIX seconds.
+
+    python -m otc_tools.export state.jsonl --events events.jsonl --contract con_otc --out otc --format parquet
+
+This writes otc_listings.parquet and otc_events.parquet, or otc.npz with
+``--format npz``.
+"""
+import argparse
+import calendar
+from array import array
+from datetime import datetime
+from decimal import Decimal
+
+from otc_tools.state import amount_units, iter_events, iter_listings
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - only needed for npz output and the reconciliation checker
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - only needed for Parquet output
+    pa = pq = None
+
+
+def _require(module, name: str):
+    if module is None:
+        raise ImportError(f"{name} is required for this output format: pip install {name}")
+
+
+CHUNK_ROWS = 100_000
+
+# column -> (array typecode, dictionary name or None). "str" columns are kept as plain strings.
+LISTING_COLUMNS = {
+    "id": ("str", None),
+    "maker": ("i", "accounts"),
+    "taker": ("i", "accounts"),
+    "offer_token": ("i", "tokens"),
+    "take_token": ("i", "tokens"),
+    "offer_amount": ("q", None),
+    "take_amount": ("q", None),
+    "maker_fee": ("q", None),
+    "taker_fee": ("q", None),
+    "fee_bps": ("i", None),
+    "status": ("i", "statuses"),
+    "date_listed": ("q", None),
+}
+
+EVENT_COLUMNS = {
+    "seq": ("q", None),  # Position in the event log
+    "event": ("i", "events"),
+    "id": ("str", None),
+    "actor": ("i", "accounts"),  # maker for Offer and CancelOffer, taker for TakeOffer
+    "offer_token": ("i", "tokens"),  # Only on Offer; join on id for the others
+    "take_token": ("i", "tokens"),
+    "offer_amount": ("q", None),
+    "take_amount": ("q", None),
+    "fee_bps": ("i", None),
+}
+
+LIFECYCLE_EVENTS = ("Offer", "TakeOffer", "CancelOffer")
+
+
+class Dictionary:
+    """Append-only string -> int32 code mapping shared by every column that uses it."""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, value) -> int:
+        if value is None or value == "None":
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+def to_units(value) -> int:
+    # con_otc_v3 stores integer units already; older listings and all events carry decimals
+    if value is None:
+        return 0
+    return value if isinstance(value, int) else amount_units(value)
+
+
+def to_seconds(value) -> int:
+    if isinstance(value, datetime):
+        return calendar.timegm(value.timetuple())
+    if isinstance(value, str) and value:
+        return calendar.timegm(datetime.fromisoformat(value).timetuple())
+    return -1
+
+
+def fee_bps(value) -> int:
+    if value is None:
+        return -1
+    if isinstance(value, (Decimal, float)):
+        return int(Decimal(str(value)) * 100)  # Legacy listings store a percentage
+    return int(value)
+
+
+class ColumnChunks:
+    """Buffers rows of one table and hands full chunks to a sink."""
+
+    def __init__(self, columns: dict, dictionaries: dict, sink, chunk_rows: int = CHUNK_ROWS):
+        self.columns = columns
+        self.dictionaries = dictionaries
+        self.sink = sink
+        self.chunk_rows = chunk_rows
+        self.rows = 0
+        self._reset()
+
+    def _reset(self):
+        self.buffers = {
+            name: [] if typecode == "str" else array(typecode)
+            for name, (typecode, _) in self.columns.items()
+        }
+        self.pending = 0
+
+    def append(self, row: dict) -> None:
+        for name, (_, dictionary) in self.columns.items():
+            value = row.get(name)
+            self.buffers[name].append(self.dictionaries[dictionary].encode(value) if dictionary else value)
+        self.pending += 1
+        self.rows += 1
+        if self.pending >= self.chunk_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.pending:
+            self.sink(self.buffers)
+            self._reset()
+
+
+def listing_rows(source, contract: str):
+    for listing_id, listing in iter_listings(source, contract):
+        yield {
+            "id": listing_id,
+            "maker": listing.get("maker"),
+            "taker": listing.get("taker"),
+            "offer_token": listing.get("offer_token"),
+            "take_token": listing.get("take_token"),
+            "offer_amount": to_units(listing.get("offer_amount")),
+            "take_amount": to_units(listing.get("take_amount")),
+            "maker_fee": to_units(listing.get("maker_fee")),
+            "taker_fee": to_units(listing.get("taker_fee")),
+            "fee_bps": fee_bps(listing.get("fee")),
+            "status": listing.get("status"),
+            "date_listed": to_seconds(listing.get("date_listed")),
+        }
+
+
+def event_rows(path, contract: str = None):
+    for seq, event in enumerate(iter_events(path, contract)):
+        name = event.get("event")
+        if name not in LIFECYCLE_EVENTS:
+            continue
+        fields = {**(event.get("data") or {}), **(event.get("data_indexed") or {})}
+        yield {
+            "seq": seq,
+            "event": name,
+            "id": fields.get("id"),
+            "actor": fields.get("taker") if name == "TakeOffer" else fields.get("maker"),
+            "offer_token": fields.get("offer_token"),
+            "take_token": fields.get("take_token"),
+            "offer_amount": to_units(fields.get("offer_amount")),
+            "take_amount": to_units(fields.get("take_amount")),
+            "fee_bps": fee_bps(fields.get("fee")),
+        }
+
+
+# Sinks ------------------------------------------------------------------------------------------------
+
+
+class NumpySink:
+    """Collects chunks as NumPy arrays; ``columns()`` concatenates them once the table is done."""
+
+    def __init__(self, columns: dict):
+        _require(np, "numpy")
+        self.spec = columns
+        self.chunks = {name: [] for name in columns}
+
+    def __call__(self, buffers: dict) -> None:
+        for name, buffer in buffers.items():
+            typecode = self.spec[name][0]
+            if typecode == "str":
+                self.chunks[name].append(np.array(buffer, dtype=str))
+            else:
+                self.chunks[name].append(np.frombuffer(buffer, dtype=typecode).copy())
+
+    def columns(self) -> dict:
+        result = {}
+        for name, chunks in self.chunks.items():
+            typecode = self.spec[name][0]
+            empty = np.array([], dtype=str if typecode == "str" else typecode)
+            result[name] = np.concatenate(chunks) if chunks else empty
+        return result
+
+
+class ParquetSink:
+    def __init__(self, path, columns: dict, dictionaries: dict):
+        _require(pa, "pyarrow")
+        self.path = path
+        self.spec = columns
+        self.dictionaries = dictionaries
+        self.schema = pa.schema([
+            (name, pa.string() if typecode == "str"
+             else pa.dictionary(pa.int32(), pa.string()) if dictionary
+             else pa.int64() if typecode == "q" else pa.int32())
+            for name, (typecode, dictionary) in columns.items()
+        ])
+        self.writer = None
+
+    def __call__(self, buffers: dict) -> None:
+        arrays = []
+        for name, (typecode, dictionary) in self.spec.items():
+            values = buffers[name]
+            if dictionary:
+                indices = pa.array([None if code == -1 else code for code in values], type=pa.int32())
+                values = pa.array(self.dictionaries[dictionary].values, type=pa.string())
+                arrays.append(pa.DictionaryArray.from_arrays(indices, values))
+            else:
+                arrays.append(pa.array(values, type=self.schema.field(name).type))
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, self.schema)
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))  # One row group per chunk
+
+    def close(self) -> None:
+        if self.writer is None:
+            pq.write_table(self.schema.empty_table(), self.path)
+        else:
+            self.writer.close()
+
+
+def export(state_source, contract: str, out: str, fmt: str = "parquet", events_path: str = None,
+           chunk_rows: int = CHUNK_ROWS) -> dict:
+    """Export listings (and events, when an event log is given). Returns row counts per table."""
+    dictionaries = {name: Dictionary() for name in ("accounts", "tokens", "statuses", "events")}
+    tables = [("listings", LISTING_COLUMNS, listing_rows(state_source, contract))]
+    if events_path:
+        tables.append(("events", EVENT_COLUMNS, event_rows(events_path, contract)))
+
+    counts, arrays = {}, {}
+    for table, columns, rows in tables:
+        sink = ParquetSink(f"{out}_{table}.parquet", columns, dictionaries) if fmt == "parquet" else NumpySink(columns)
+        chunks = ColumnChunks(columns, dictionaries, sink, chunk_rows)
+        for row in rows:
+            chunks.append(row)
+        chunks.flush()
+        counts[table] = chunks.rows
+        if fmt == "parquet":
+            sink.close()
+        else:
+            arrays.update({f"{table}.{name}": values for name, values in sink.columns().items()})
+
+    if fmt == "npz":
+        for name, dictionary in dictionaries.items():
+            arrays[f"dictionary.{name}"] = np.array(dictionary.values, dtype=str)
+        np.savez_compressed(out if out.endswith(".npz") else f"{out}.npz", **arrays)
+    return counts
+
+
+def load_npz(path) -> tuple:
+    """Read an ``export(..., fmt="npz")`` archive back as ``({table: {column: array}}, {dictionary: values})``."""
+    _require(np, "numpy")
+    tables, dictionaries = {}, {}
+    with np.load(path) as archive:
+        for key in archive.files:
+            group, name = key.split(".", 1)
+            if group == "dictionary":
+                dictionaries[name] = archive[key].tolist()
+            else:
+                tables.setdefault(group, {})[name] = archive[key]
+    return tables, dictionaries
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("state", help="state dump: JSON lines of key/value nodes, or a JSON document")
+    parser.add_argument("--events", help="JSON-lines event log")
+    parser.add_argument("--contract", default="con_otc")
+    parser.add_argument("--out", default="otc")
+    parser.add_argument("--format", choices=("parquet", "npz"), default="parquet")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args(argv)
+
+    counts = export(args.state, args.contract, args.out, args.format, args.events, args.chunk_rows)
+    print(", ".join(f"{count} {table}" for table, count in counts.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
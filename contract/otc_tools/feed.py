@@ -0,0 +1,270 @@
+"""Push order-book deltas for one pair over Server-Sent Events or WebSocket.
+
+Without a feed, clients poll the whole open-offer list to notice a change.
+This service follows the OTC contract's events through an
+``otc_tools.book.ListingStore`` and pushes each pair's changes as compact
+deltas:
+
+    {"type": "add", "seq": 7, "id": ..., "maker": ..., "offer_amount": "100", "take_amount": "50", "price": ...}
+    {"type": "fill", "seq": 8, "id": ..., "taker": ...}
+    {"type": "remove", "seq": 9, "id": ...}
+
+Every pair numbers its deltas. A new subscriber first gets
+``{"type": "snapshot", "seq": n, "pair": [...], "offers": [...]}``, the
+pair's OPEN listings in the ``fetchOpenOffers`` shape as of delta ``n``,
+then every later delta in order. A client that sees a gap in ``seq``
+resubscribes.
+
+A delta is encoded once and the same bytes are queued for every subscriber
+of the pair. Each subscriber's queue is bounded. When a slow subscriber's
+queue overflows, its backlog is dropped and the next thing it receives is a
+fresh snapshot. A slow reader therefore costs a bounded amount of memory
+and never holds up the others.
+
+    GET /stream?offer_token=...&take_token=...   text/event-stream
+    GET /ws?offer_token=...&take_token=...       WebSocket, one text frame per message
+
+    python -m otc_tools.feed state.jsonl --events events.jsonl --contract con_otc --port 8081
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+from collections import deque
+from urllib.parse import parse_qsl, urlsplit
+
+from otc_tools.api import REASONS, tail_events
+from otc_tools.book import ListingStore, units_text
+
+QUEUE_SIZE = 256  # Deltas buffered per subscriber before it is resynced with a snapshot
+HEARTBEAT_SECONDS = 15
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def encode(message: dict) -> bytes:
+    return json.dumps(message, separators=(",", ":"), default=str).encode()
+
+
+def delta_message(kind: str, listing_id: str, listing: dict, seq: int) -> dict:
+    if kind == "add":
+        return {"type": "add", "seq": seq, "id": listing_id, "maker": listing["maker"],
+                "offer_amount": units_text(listing["offer_amount"]),
+                "take_amount": units_text(listing["take_amount"]), "price": listing["price"]}
+    if kind == "fill":
+        return {"type": "fill", "seq": seq, "id": listing_id, "taker": listing["taker"]}
+    return {"type": "remove", "seq": seq, "id": listing_id}
+
+
+class Subscription:
+    def __init__(self, feed, pair: tuple, queue_size: int):
+        self.feed = feed
+        self.pair = pair
+        self.queue_size = queue_size
+        self.pending = deque()  # Encoded messages not yet delivered
+        self.ready = asyncio.Event()
+        self.resyncs = 0  # Times this subscriber fell behind and was sent a snapshot instead
+        self.push(feed.snapshot(pair))
+
+    def push(self, message: bytes) -> None:
+        if len(self.pending) >= self.queue_size:
+            self.pending.clear()
+            self.pending.append(self.feed.snapshot(self.pair))  # Replaces the backlog it could not keep up with
+            self.resyncs += 1
+        else:
+            self.pending.append(message)
+        self.ready.set()
+
+    async def next(self) -> bytes:
+        while not self.pending:
+            self.ready.clear()
+            await self.ready.wait()
+        return self.pending.popleft()
+
+    def close(self) -> None:
+        self.feed.unsubscribe(self)
+
+
+class BookFeed:
+    def __init__(self, store: ListingStore, contract: str = "con_otc", queue_size: int = QUEUE_SIZE):
+        self.store = store
+        self.contract = contract
+        self.queue_size = queue_size
+        self.seq = {}  # pair -> seq of its latest delta
+        self.subscribers = {}  # pair -> set of Subscription
+
+    def snapshot(self, pair: tuple) -> bytes:
+        return encode({"type": "snapshot", "seq": self.seq.get(pair, 0), "pair": list(pair),
+                       "offers": self.store.open_offers(*pair)})
+
+    def subscribe(self, offer_token: str, take_token: str) -> Subscription:
+        # Runs without yielding to the loop, so no delta can fall between the snapshot and the subscription
+        pair = (offer_token, take_token)
+        subscription = Subscription(self, pair, self.queue_size)
+        self.subscribers.setdefault(pair, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self.subscribers.get(subscription.pair, set()).discard(subscription)
+
+    def on_event(self, event: dict) -> None:
+        if event.get("contract", self.contract) != self.contract:
+            return
+        change, _ = self.store.apply(event)
+        if change is None:
+            return
+        kind, listing_id, listing = change
+        pair = (listing["offer_token"], listing["take_token"])
+        seq = self.seq[pair] = self.seq.get(pair, 0) + 1
+        subscribers = self.subscribers.get(pair)
+        if subscribers:
+            message = encode(delta_message(kind, listing_id, listing, seq))
+            for subscription in subscribers:
+                subscription.push(message)
+
+    async def follow(self, events) -> None:
+        async for event in events:
+            self.on_event(event)
+
+    # Transports ---------------------------------------------------------------------------------------
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+        request_line, *header_lines = head.split("\r\n")
+        method, target = (request_line.split(" ") + ["", ""])[:2]
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        url = urlsplit(target)
+        params = dict(parse_qsl(url.query))
+
+        if method != "GET" or url.path not in ("/stream", "/ws"):
+            await self.reject(writer, 404)
+            return
+        if not params.get("offer_token") or not params.get("take_token"):
+            await self.reject(writer, 400)
+            return
+        if url.path == "/ws" and "sec-websocket-key" not in headers:
+            await self.reject(writer, 400)
+            return
+
+        subscription = self.subscribe(params["offer_token"], params["take_token"])
+        try:
+            if url.path == "/stream":
+                await self.stream_sse(subscription, writer)
+            else:
+                await self.stream_websocket(subscription, headers["sec-websocket-key"], reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            subscription.close()
+            writer.close()
+
+    async def reject(self, writer, status: int) -> None:
+        writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        writer.close()
+
+    async def stream_sse(self, subscription: Subscription, writer) -> None:
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     b"Access-Control-Allow-Origin: *\r\nConnection: keep-alive\r\n\r\n")
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.next(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                writer.write(b": keep-alive\n\n")  # Comment line, keeps proxies from closing an idle stream
+            else:
+                writer.write(b"data: " + message + b"\n\n")
+            await writer.drain()  # A slow client blocks here while its queue absorbs, then resyncs
+
+    async def stream_websocket(self, subscription: Subscription, key: str, reader, writer) -> None:
+        accept = base64.b64encode(hashlib.sha1(key.encode() + WEBSOCKET_GUID).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+        await writer.drain()
+        closed = asyncio.ensure_future(read_until_close(reader, writer))
+        try:
+            while not closed.done():
+                delivery = asyncio.ensure_future(subscription.next())
+                await asyncio.wait({delivery, closed}, return_when=asyncio.FIRST_COMPLETED)
+                if not delivery.done():
+                    delivery.cancel()
+                    break
+                writer.write(websocket_frame(0x1, delivery.result()))
+                await writer.drain()
+        finally:
+            if closed.done() and not closed.cancelled():
+                closed.exception()  # A dropped connection ends the reader with an error; retrieve it so it is not logged
+            else:
+                closed.cancel()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8081):
+        return await asyncio.start_server(self.handle, host, port)
+
+
+def websocket_frame(opcode: int, payload: bytes) -> bytes:
+    """An unmasked, unfragmented server frame."""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+async def read_until_close(reader, writer) -> None:
+    """Answer pings and return once the client closes; clients have nothing else to send."""
+    while True:
+        first, second = await reader.readexactly(2)
+        opcode, length = first & 0x0F, second & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", await reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", await reader.readexactly(8))[0]
+        mask = await reader.readexactly(4) if second & 0x80 else b"\0\0\0\0"
+        payload = bytes(byte ^ mask[index % 4] for index, byte in enumerate(await reader.readexactly(length)))
+        if opcode == 0x8:
+            writer.write(websocket_frame(0x8, payload[:2]))
+            return
+        if opcode == 0x9:
+            writer.write(websocket_frame(0xA, payload))
+
+
+async def run(feed: BookFeed, host: str, port: int, events_path: str = None) -> None:
+    server = await feed.serve(host, port)
+    tasks = [asyncio.ensure_future(server.serve_forever())]
+    if events_path:
+        tasks.append(asyncio.ensure_future(feed.follow(tail_events(events_path))))
+    await asyncio.gather(*tasks)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("state", help="state dump the listing store starts from")
+    parser.add_argument("--events", help="JSON-lines event log to follow, starting where the dump was taken")
+    parser.add_argument("--contract", default="con_otc")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    args = parser.parse_args(argv)
+
+    store = ListingStore()
+    print(f"{store.load(args.state, args.contract)} listings loaded")
+    feed = BookFeed(store, args.contract, args.queue_size)
+    try:
+        asyncio.run(run(feed, args.host, args.port, args.events))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,272 @@
+"""Stateful, model-based fuzzer for con_otc_v3.
+
+Each campaign deploys a fresh market, then runs a seeded random sequence of
+list_offer / take_offer / cancel_offer / adjust_fee / withdraw calls from many
+actors over several con_token instances. Every call is mirrored on
+``OtcModel``; the contract and the model must agree on success or on the
+rejection message, and after every step the token balances, contract escrow
+and earned fees are compared. Campaigns are sharded over a process pool,
+each worker with its own ContractingClient and storage directory.
+
+    python -m otc_tools.fuzz --campaigns 64 --steps 20000 --workers 8
+
+A failing campaign reports its seed and step; rerun it alone with
+``--seed <seed> --campaigns 1`` to reproduce.
+"""
+import argparse
+import random
+import shutil
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from otc_tools.deploy import OWNER, deploy_market, new_client
+from otc_tools.model import AMOUNT_SCALE, OtcModel, Rejected, from_units
+
+OPERATIONS = ("list_offer", "take_offer", "cancel_offer", "adjust_fee", "withdraw")
+DEFAULT_WEIGHTS = (45, 30, 15, 5, 5)
+
+
+@dataclass
+class FuzzConfig:
+    steps: int = 1000
+    actors: int = 8
+    tokens: int = 3
+    actor_funding: int = 10_000
+    weights: tuple = DEFAULT_WEIGHTS
+    invalid_rate: float = 0.05  # Share of calls sent with deliberately bad arguments
+
+
+@dataclass
+class CampaignResult:
+    seed: int
+    steps: int
+    operations: Counter = field(default_factory=Counter)
+    rejections: Counter = field(default_factory=Counter)
+    divergence: str = None  # First mismatch, campaigns stop at the first one
+    trace: list = field(default_factory=list)  # Last calls before the divergence
+
+    @property
+    def ok(self) -> bool:
+        return self.divergence is None
+
+
+def random_amount(rng: random.Random, invalid: bool) -> Decimal:
+    if invalid:
+        return rng.choice([Decimal("0"), Decimal("0.000000001"), Decimal("1.123456789")])
+    return from_units(rng.randint(1, 500 * AMOUNT_SCALE))
+
+
+def read_units(value) -> int:
+    return 0 if value is None else int(Decimal(str(value)) * AMOUNT_SCALE)
+
+
+def contract_kwargs(kwargs: dict) -> dict:
+    from contracting.stdlib.bridge.decimal import ContractingDecimal
+
+    return {
+        name: ContractingDecimal(str(value)) if isinstance(value, Decimal) else value
+        for name, value in kwargs.items()
+    }
+
+
+class Campaign:
+    def __init__(self, seed: int, config: FuzzConfig, client):
+        self.rng = random.Random(seed)
+        self.config = config
+        self.result = CampaignResult(seed=seed, steps=0)
+        self.token_names = [f"con_fuzz_token_{index}" for index in range(config.tokens)]
+        self.actors = [f"fuzz_actor_{index}" for index in range(config.actors)]
+        self.market = deploy_market(client, token_names=self.token_names)
+        self.market.fund(self.actors, config.actor_funding)
+
+        self.model = OtcModel(contract=self.market.otc_name, owner=OWNER)
+        for token in self.token_names:
+            supply = read_units(self.market.tokens[token].balance_of(address=OWNER))
+            self.model.credit(token, OWNER, supply)
+            for actor in self.actors:
+                self.model.credit(token, actor, config.actor_funding * AMOUNT_SCALE)
+        self.known_ids = []
+
+    # Calls ---------------------------------------------------------------------------------------------
+
+    def approve(self, token: str, account: str, units: int) -> None:
+        from contracting.stdlib.bridge.decimal import ContractingDecimal
+
+        if units > 0:
+            self.market.tokens[token].approve(
+                amount=ContractingDecimal(str(from_units(units))), to=self.market.otc_name, signer=account,
+            )
+
+    def draw(self) -> tuple:
+        rng = self.rng
+        operation = rng.choices(OPERATIONS, weights=self.config.weights)[0]
+        invalid = rng.random() < self.config.invalid_rate
+        caller = rng.choice(self.actors)
+
+        if operation == "list_offer":
+            offer_token, take_token = rng.sample(self.token_names, 2)
+            return operation, caller, {
+                "offer_token": offer_token, "offer_amount": random_amount(rng, invalid),
+                "take_token": take_token, "take_amount": random_amount(rng, invalid and rng.random() < 0.5),
+            }
+        if operation in ("take_offer", "cancel_offer"):
+            if invalid or not self.known_ids:
+                listing_id = "%064x" % rng.getrandbits(256)
+            else:
+                listing_id = rng.choice(self.known_ids)
+                if operation == "cancel_offer" and rng.random() < 0.8:
+                    caller = self.model.listings[listing_id].maker
+            return operation, caller, {"listing_id": listing_id}
+        if operation == "adjust_fee":
+            fee_bps = rng.choice([-1, 1001, 5000]) if invalid else rng.randint(0, 1000)
+            return operation, (caller if invalid else OWNER), {"trading_fee_bps": fee_bps}
+        return operation, (caller if invalid else OWNER), {"token_list": rng.sample(self.token_names, 2)}
+
+    def prepare(self, operation: str, caller: str, kwargs: dict) -> None:
+        # Approve exactly what the model expects the call to pull, so allowances never mask a bug
+        if operation == "list_offer":
+            try:
+                units = self.model.listing_cost(kwargs["offer_amount"])
+            except Rejected:
+                return
+            self.approve(kwargs["offer_token"], caller, units)
+        elif operation == "take_offer":
+            listing = self.model.listings.get(kwargs["listing_id"])
+            if listing is not None:
+                self.approve(listing.take_token, caller, listing.take_units + listing.taker_fee)
+
+    def run_on_model(self, operation: str, caller: str, kwargs: dict, result) -> None:
+        model = self.model
+        if operation == "list_offer":
+            model.list_offer(result, caller, kwargs["offer_token"], kwargs["offer_amount"],
+                             kwargs["take_token"], kwargs["take_amount"])
+        elif operation == "take_offer":
+            model.take_offer(kwargs["listing_id"], caller)
+        elif operation == "cancel_offer":
+            model.cancel_offer(kwargs["listing_id"], caller)
+        elif operation == "adjust_fee":
+            model.adjust_fee(caller, kwargs["trading_fee_bps"])
+        else:
+            model.withdraw(caller, kwargs["token_list"])
+
+    def step(self) -> str:
+        operation, caller, kwargs = self.draw()
+        self.result.trace = (self.result.trace + [(operation, caller, kwargs)])[-20:]
+        self.prepare(operation, caller, kwargs)
+
+        contract_error = result = None
+        try:
+            result = getattr(self.market.otc, operation)(
+                signer=caller, environment=self.market.tick(), **contract_kwargs(kwargs)
+            )
+        except Exception as error:  # Contract assertions surface as plain exceptions
+            contract_error = str(error)
+
+        model_error = None
+        try:
+            self.run_on_model(operation, caller, kwargs, result)
+        except Rejected as rejection:
+            model_error = str(rejection)
+
+        self.result.operations[operation] += 1
+        if model_error is not None:
+            self.result.rejections[model_error] += 1
+            if contract_error is None:
+                return f"{operation}: contract accepted, model expected {model_error!r}"
+            if model_error not in contract_error:
+                return f"{operation}: contract failed with {contract_error!r}, model expected {model_error!r}"
+            return None
+        if contract_error is not None:
+            return f"{operation}: contract failed with {contract_error!r}, model accepted"
+        if operation == "list_offer":
+            self.known_ids.append(result)
+        return self.check_state()
+
+    def check_state(self) -> str:
+        market, model = self.market, self.model
+        for token_name in self.token_names:
+            token = market.tokens[token_name]
+            for account in self.actors + [OWNER, market.otc_name]:
+                actual = read_units(token.balances[account])
+                expected = model.balance(token_name, account)
+                if actual != expected:
+                    return f"balance {token_name}/{account}: contract {actual}, model {expected}"
+
+            # earned_fees already holds integer units, one accumulator per shard
+            earned = sum(market.otc.earned_fees[token_name, shard] for shard in range(market.otc.fee_shards.get()))
+            if earned != model.earned.get(token_name, 0):
+                return f"earned_fees {token_name}: contract {earned}, model {model.earned.get(token_name, 0)}"
+
+            # The contract must hold exactly the open escrow plus unwithdrawn fees, nothing more or less
+            held = read_units(token.balances[market.otc_name])
+            owed = model.escrow(token_name) + earned
+            if held != owed:
+                return f"escrow {token_name}: contract holds {held}, open listings and fees add up to {owed}"
+        if market.otc.fee.get() != model.fee_bps:
+            return f"fee: contract {market.otc.fee.get()}, model {model.fee_bps}"
+        return None
+
+    def run(self) -> CampaignResult:
+        for _ in range(self.config.steps):
+            divergence = self.step()
+            self.result.steps += 1
+            if divergence is not None:
+                self.result.divergence = divergence
+                break
+        return self.result
+
+
+def run_campaign(seed: int, config: FuzzConfig) -> CampaignResult:
+    """Worker entry point: one client and one storage directory per campaign."""
+    storage_home = tempfile.mkdtemp(prefix=f"otc_fuzz_{seed}_")
+    client = new_client(storage_home)
+    try:
+        return Campaign(seed, config, client).run()
+    finally:
+        client.flush()
+        shutil.rmtree(storage_home, ignore_errors=True)
+
+
+def run_campaigns(seeds, config: FuzzConfig, workers: int = 1):
+    """Yield campaign results as they finish."""
+    if workers <= 1:
+        for seed in seeds:
+            yield run_campaign(seed, config)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_campaign, seed, config) for seed in seeds]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seed", type=int, default=0, help="first campaign seed")
+    parser.add_argument("--campaigns", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=FuzzConfig.steps)
+    parser.add_argument("--actors", type=int, default=FuzzConfig.actors)
+    parser.add_argument("--tokens", type=int, default=FuzzConfig.tokens)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    config = FuzzConfig(steps=args.steps, actors=args.actors, tokens=args.tokens)
+    seeds = range(args.seed, args.seed + args.campaigns)
+    total_steps = failures = 0
+    for result in run_campaigns(seeds, config, workers=args.workers):
+        total_steps += result.steps
+        if result.ok:
+            print(f"seed {result.seed}: {result.steps} steps ok")
+            continue
+        failures += 1
+        print(f"seed {result.seed}: DIVERGED at step {result.steps}: {result.divergence}")
+        for operation, caller, kwargs in result.trace:
+            print(f"    {operation} by {caller} {kwargs}")
+    print(f"{total_steps} steps, {failures} diverged campaign(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
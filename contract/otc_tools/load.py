@@ -0,0 +1,263 @@
+"""Synthetic market load for con_otc_v3 on a metering ContractingClient.
+
+A population of makers and takers trades a set of token pairs. Arrivals
+are a Poisson process in block time, and each arrival is a list, take or
+cancel drawn from a configurable mix. Makers pass a position hint from a
+local copy of each pair's price-ordered book, as a real client would, so
+deep books stay listable. Takers choose from a snapshot of the open
+listings that is refreshed only every ``view_refresh`` seconds, so
+"Offer not available" races show up the way they would behind a stale
+frontend.
+
+The report has wall-clock transactions per second, stamp percentiles per
+function, failure counts by message, and a time series of open listings
+and contract state size.
+
+    python -m otc_tools.load --makers 500 --takers 500 --pairs 4 --rate 50 --duration 600 --json load.json
+"""
+import argparse
+import bisect
+import json
+import math
+import random
+import shutil
+import tempfile
+import time
+from collections import Counter, defaultdict
+from dataclasses import asdict, dataclass, field
+from decimal import Decimal
+from itertools import permutations
+
+from otc_tools.deploy import OWNER, deploy_market, fund_stamps, new_client
+from otc_tools.model import from_units, price_key
+
+
+@dataclass
+class LoadConfig:
+    makers: int = 50
+    takers: int = 50
+    tokens: int = 3
+    pairs: int = 4  # Directed (offer, take) pairs drawn from the token permutations
+    rate: float = 20.0  # Mean arrivals per second of block time
+    duration: int = 300  # Seconds of block time to simulate
+    mix: tuple = (0.55, 0.3, 0.15)  # list, take, cancel
+    view_refresh: int = 10  # Seconds between taker snapshots of the book
+    sample_every: int = 30  # Seconds between state size samples
+    funding: int = 1_000_000
+    seed: int = 0
+
+
+@dataclass
+class Sample:
+    at: int  # Seconds of block time since start
+    calls: int
+    open_listings: int
+    state_keys: int
+    state_bytes: int
+    wall_seconds: float
+
+
+@dataclass
+class LoadReport:
+    config: LoadConfig
+    calls: int = 0
+    wall_seconds: float = 0.0
+    stamps: dict = field(default_factory=lambda: defaultdict(list))  # function -> stamps per successful call
+    failures: Counter = field(default_factory=Counter)  # (function, message) -> count
+    samples: list = field(default_factory=list)
+
+    @property
+    def tps(self) -> float:
+        return self.calls / self.wall_seconds if self.wall_seconds else 0.0
+
+    def percentiles(self, function: str) -> dict:
+        values = sorted(self.stamps.get(function, []))
+        if not values:
+            return {}
+
+        def at(share):
+            return values[min(len(values) - 1, math.ceil(share * len(values)) - 1)]
+
+        return {"count": len(values), "p50": at(0.5), "p90": at(0.9), "p99": at(0.99), "max": values[-1]}
+
+    def to_dict(self) -> dict:
+        return {
+            "config": asdict(self.config),
+            "calls": self.calls,
+            "wall_seconds": self.wall_seconds,
+            "tps": self.tps,
+            "stamps": {function: self.percentiles(function) for function in self.stamps},
+            "failures": [
+                {"function": function, "message": message, "count": count}
+                for (function, message), count in self.failures.most_common()
+            ],
+            "samples": [asdict(sample) for sample in self.samples],
+        }
+
+    def format(self) -> str:
+        lines = [f"{self.calls} calls in {self.wall_seconds:.1f}s wall clock, {self.tps:.1f} tx/s"]
+        lines.append(f"  {'function':<14}{'ok':>8}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+        for function in sorted(self.stamps):
+            stats = self.percentiles(function)
+            lines.append(f"  {function:<14}{stats['count']:>8}{stats['p50']:>9}{stats['p90']:>9}"
+                         f"{stats['p99']:>9}{stats['max']:>9}")
+        for (function, message), count in self.failures.most_common(10):
+            lines.append(f"  failed {function} x{count}: {message}")
+        for sample in self.samples:
+            lines.append(f"  t={sample.at:>6}s open={sample.open_listings:>7} keys={sample.state_keys:>8} "
+                         f"bytes={sample.state_bytes:>11}")
+        return "\n".join(lines)
+
+
+def state_size(client, contract: str) -> tuple:
+    """Number of keys and encoded bytes stored under ``contract``."""
+    from contracting.storage.encoder import encode
+
+    items = client.raw_driver.items(f"{contract}.")
+    return len(items), sum(len(key) + len(encode(value)) for key, value in items.items())
+
+
+class LoadRun:
+    def __init__(self, config: LoadConfig, client):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.client = client
+        token_names = [f"con_load_token_{index}" for index in range(config.tokens)]
+        self.pairs = list(permutations(token_names, 2))[:config.pairs]
+        self.makers = [f"load_maker_{index}" for index in range(config.makers)]
+        self.takers = [f"load_taker_{index}" for index in range(config.takers)]
+
+        fund_stamps(client, self.makers + self.takers + [OWNER], amount=10 ** 9)
+        self.market = deploy_market(client, token_names=token_names)
+        self.market.fund(self.makers + self.takers, config.funding)
+        self.market.approve_all(self.makers + self.takers, config.funding * 1_000)
+
+        self.books = {pair: [] for pair in self.pairs}  # pair -> sorted [(price key, sequence, id)]
+        self.open = {}  # listing id -> (pair, book entry, maker)
+        self.snapshot = []  # Stale open ids the takers pick from
+        self.mid = {pair: Decimal(self.rng.randint(50, 200)) / 100 for pair in self.pairs}
+        self.sequence = 0
+        self.report = LoadReport(config=config)
+
+    def call(self, function: str, signer: str, **kwargs):
+        self.report.calls += 1
+        try:
+            output = getattr(self.market.otc, function)(
+                signer=signer, environment=self.environment, return_full_output=True, **kwargs
+            )
+        except Exception as error:
+            output = {"status_code": 1, "result": error}
+        if output["status_code"] != 0:
+            self.report.failures[function, str(output["result"])] += 1
+            return None, False
+        self.report.stamps[function].append(output.get("stamps_used", 0))
+        return output["result"], True
+
+    def list_offer(self) -> None:
+        from contracting.stdlib.bridge.decimal import ContractingDecimal
+
+        pair = self.rng.choice(self.pairs)
+        offer_units = self.rng.randint(1, 1_000) * 10 ** 6
+        price = self.mid[pair] * Decimal(self.rng.gauss(1.0, 0.05)).quantize(Decimal("0.0001"))
+        take_units = max(1, int(offer_units * price))
+        key = price_key(offer_units, take_units)
+
+        book = self.books[pair]
+        position = bisect.bisect_right(book, (key, math.inf, ""))
+        hint = book[position - 1][2] if position else ""
+        maker = self.rng.choice(self.makers)
+        listing_id, ok = self.call(
+            "list_offer", maker,
+            offer_token=pair[0], offer_amount=ContractingDecimal(str(from_units(offer_units))),
+            take_token=pair[1], take_amount=ContractingDecimal(str(from_units(take_units))),
+            position_hint=hint,
+        )
+        if ok:
+            self.sequence += 1
+            entry = (key, self.sequence, listing_id)
+            book.insert(position, entry)
+            self.open[listing_id] = (pair, entry, maker)
+
+    def close(self, listing_id: str) -> None:
+        pair, entry, _ = self.open.pop(listing_id)
+        book = self.books[pair]
+        del book[bisect.bisect_left(book, entry)]
+
+    def take_offer(self) -> None:
+        if not self.snapshot:
+            return
+        listing_id = self.rng.choice(self.snapshot)
+        _, ok = self.call("take_offer", self.rng.choice(self.takers), listing_id=listing_id)
+        if ok:
+            self.close(listing_id)
+
+    def cancel_offer(self) -> None:
+        if not self.open:
+            return
+        listing_id = self.rng.choice(self.snapshot or list(self.open))
+        maker = self.open[listing_id][2] if listing_id in self.open else self.rng.choice(self.makers)
+        _, ok = self.call("cancel_offer", maker, listing_id=listing_id)
+        if ok:
+            self.close(listing_id)
+
+    def sample(self, at: int, started: float) -> None:
+        keys, size = state_size(self.client, self.market.otc_name)
+        self.report.samples.append(Sample(
+            at=at, calls=self.report.calls, open_listings=len(self.open),
+            state_keys=keys, state_bytes=size, wall_seconds=time.perf_counter() - started,
+        ))
+
+    def run(self) -> LoadReport:
+        config = self.config
+        started = time.perf_counter()
+        clock = 0.0
+        elapsed = next_refresh = next_sample = 0
+        operations = (self.list_offer, self.take_offer, self.cancel_offer)
+        while True:
+            clock += self.rng.expovariate(config.rate)
+            if clock >= config.duration:
+                break
+            # Block time only moves in whole seconds; arrivals within one second share a block timestamp
+            self.environment = self.market.tick(int(clock) - elapsed)
+            elapsed = int(clock)
+            if elapsed >= next_refresh:
+                self.snapshot = list(self.open)
+                next_refresh = elapsed + config.view_refresh
+            if elapsed >= next_sample:
+                self.sample(elapsed, started)
+                next_sample = elapsed + config.sample_every
+            self.rng.choices(operations, weights=config.mix)[0]()
+        self.sample(config.duration, started)
+        self.report.wall_seconds = time.perf_counter() - started
+        return self.report
+
+
+def run_load(config: LoadConfig) -> LoadReport:
+    storage_home = tempfile.mkdtemp(prefix="otc_load_")
+    client = new_client(storage_home, metering=True)
+    try:
+        return LoadRun(config, client).run()
+    finally:
+        client.flush()
+        shutil.rmtree(storage_home, ignore_errors=True)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    for name, default in asdict(LoadConfig()).items():
+        if not isinstance(default, tuple):
+            parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+    parser.add_argument("--json", help="also write the full report, time series included, to this file")
+    args = vars(parser.parse_args(argv))
+    json_path = args.pop("json")
+
+    report = run_load(LoadConfig(**args))
+    print(report.format())
+    if json_path:
+        with open(json_path, "w") as handle:
+            json.dump(report.to_dict(), handle, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
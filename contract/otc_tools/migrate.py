@@ -0,0 +1,150 @@
+"""Move OPEN listings from one OTC contract to a newer deployment.
+
+The old contract's ``migrate_out`` closes up to ``MAX_MIGRATION_BATCH``
+listings, sends their escrow to the new contract in one transfer per token
+and hands the records to the new contract's ``migrate_in``, which relists
+them under the same ids. Both contracts must be pointed at each other
+first: ``set_migration_target`` on the old one, ``set_migration_source``
+on the new one.
+
+This tool drives that from a ContractingClient. It sends a pair's listings
+in book order, and the new contract places each one after the last listing
+it imported for that pair, so batches after the first skip the walk too.
+Only the first listing of a pair walks the new contract's book, bounded by
+``MAX_BOOK_WALK``; migrate into a new contract whose books are still empty
+or shallow. Per token, it checks that what left the old contract, in OPEN
+escrow and in token balances, is exactly what arrived in the new one.
+
+    python -m otc_tools.migrate --storage ./state --source con_otc --target con_otc_v4
+
+With ``--maker`` only that maker's listings move, signed by the maker.
+"""
+import argparse
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from otc_tools.deploy import OWNER, new_client
+from otc_tools.state import amount_units, iter_listings
+
+MAX_MIGRATION_BATCH = 50  # Mirrors con_otc_v3.MAX_MIGRATION_BATCH
+
+
+def open_listings(client, contract: str, maker: str = None) -> list:
+    """``(listing_id, listing)`` of every OPEN listing, grouped by pair and in book order within a pair."""
+    listings = [
+        (listing_id, listing)
+        for listing_id, listing in iter_listings(client.raw_driver.items(f"{contract}.otc_listing:"), contract)
+        if listing.get("status") == "OPEN" and (maker is None or listing.get("maker") == maker)
+    ]
+    # Equal prices keep listing order in the book, ties fall back to the id to stay deterministic
+    listings.sort(key=lambda item: (item[1]["offer_token"], item[1]["take_token"], item[1].get("price", ""),
+                                    str(item[1]["date_listed"]), item[0]))
+    return listings
+
+
+def escrow_units(listings) -> dict:
+    """token -> units escrowed for ``listings``: offer amount plus the maker fee refunded on cancel."""
+    totals = defaultdict(int)
+    for _, listing in listings:
+        totals[listing["offer_token"]] += listing["offer_amount"] + listing["maker_fee"]
+    return dict(totals)
+
+
+def held_units(client, contract: str, tokens) -> dict:
+    return {token: amount_units(client.raw_driver.get(f"{token}.balances:{contract}") or 0) for token in tokens}
+
+
+@dataclass
+class MigrationReport:
+    source: str
+    target: str
+    listings: int = 0  # Listings moved
+    batches: int = 0  # migrate_out transactions that succeeded
+    moved: dict = field(default_factory=dict)  # token -> escrow units moved
+    mismatches: list = field(default_factory=list)  # Failed per-token checks
+    error: str = None  # Assertion of the batch that stopped the run; earlier batches stay migrated
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.mismatches
+
+    def format(self) -> str:
+        lines = [f"{self.listings} listings moved from {self.source} to {self.target} in {self.batches} batches"]
+        lines += [f"  {token:<32}{units:>20} units" for token, units in sorted(self.moved.items())]
+        lines += [f"  MISMATCH {mismatch}" for mismatch in self.mismatches]
+        if self.error:
+            lines.append(f"  stopped: {self.error}")
+        return "\n".join(lines)
+
+
+def check_totals(report, before: dict, after: dict) -> None:
+    for token, units in report.moved.items():
+        expected = {
+            "source escrow": before["source escrow"].get(token, 0) - units,
+            "target escrow": before["target escrow"].get(token, 0) + units,
+            "source balance": before["source balance"][token] - units,
+            "target balance": before["target balance"][token] + units,
+        }
+        for name, value in expected.items():
+            actual = after[name].get(token, 0)
+            if actual != value:
+                report.mismatches.append(f"{token} {name}: expected {value}, found {actual}")
+
+
+def snapshot(client, source: str, target: str, tokens) -> dict:
+    return {
+        "source escrow": escrow_units(open_listings(client, source)),
+        "target escrow": escrow_units(open_listings(client, target)),
+        "source balance": held_units(client, source, tokens),
+        "target balance": held_units(client, target, tokens),
+    }
+
+
+def migrate(client, source: str, target: str, signer: str = OWNER, maker: str = None,
+            batch_size: int = MAX_MIGRATION_BATCH, environment: dict = None) -> MigrationReport:
+    """Migrate every OPEN listing of ``source`` (or only ``maker``'s) to ``target`` and check the totals."""
+    if not 0 < batch_size <= MAX_MIGRATION_BATCH:
+        raise ValueError(f"batch_size must be between 1 and {MAX_MIGRATION_BATCH}")
+    report = MigrationReport(source=source, target=target)
+    listings = open_listings(client, source, maker)
+    if not listings:
+        return report
+
+    tokens = {listing["offer_token"] for _, listing in listings}
+    before = snapshot(client, source, target, tokens)
+    contract = client.get_contract(source)
+    for start in range(0, len(listings), batch_size):
+        batch = listings[start:start + batch_size]
+        try:
+            contract.migrate_out(listing_ids=[listing_id for listing_id, _ in batch], signer=maker or signer,
+                                 environment=environment or {})
+        except Exception as error:  # The batch reverted as a whole; report it and keep what already moved
+            report.error = str(error)
+            break
+        report.batches += 1
+        report.listings += len(batch)
+        for token, units in escrow_units(batch).items():
+            report.moved[token] = report.moved.get(token, 0) + units
+
+    check_totals(report, before, snapshot(client, source, target, tokens))
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--storage", required=True, help="contracting storage directory holding both contracts")
+    parser.add_argument("--source", default="con_otc")
+    parser.add_argument("--target", required=True)
+    parser.add_argument("--signer", default=OWNER, help="owner of the source contract")
+    parser.add_argument("--maker", help="move only this maker's listings, signed by the maker")
+    parser.add_argument("--batch-size", type=int, default=MAX_MIGRATION_BATCH)
+    args = parser.parse_args(argv)
+
+    client = new_client(args.storage, flush=False)
+    report = migrate(client, args.source, args.target, args.signer, args.maker, args.batch_size)
+    print(report.format())
+    return 0 if report.ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
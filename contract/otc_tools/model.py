@@ -0,0 +1,167 @@
+"""Pure-Python reference model of con_otc_v3's listing book.
+
+Mirrors the contract's accounting in integer units: amounts are units of
+10 ** -8, fees are basis points floored in the payer's favour and fixed when
+a listing is created. Each operation either applies its effects or raises
+``Rejected`` with the assertion message the contract is expected to fail
+with. Auto-crossing, quotes and batch auctions are out of scope.
+"""
+from dataclasses import dataclass
+from decimal import Decimal
+
+AMOUNT_DECIMALS = 8
+AMOUNT_SCALE = 10 ** AMOUNT_DECIMALS
+PRICE_SCALE = 10 ** 18
+PRICE_KEY_WIDTH = 40
+BPS_DENOMINATOR = 10_000
+MAX_FEE_BPS = 1_000
+MAX_BOOK_WALK = 500
+DEFAULT_FEE_BPS = 50
+
+
+class Rejected(Exception):
+    """The contract should reject this call with the given message."""
+
+
+def to_units(amount) -> int:
+    """Exact unit count for ``amount``; raises Rejected past 8 decimal places."""
+    scaled = Decimal(str(amount)) * AMOUNT_SCALE
+    if scaled != scaled.to_integral_value():
+        raise Rejected("Amounts support at most 8 decimal places")
+    return int(scaled)
+
+
+def from_units(units: int) -> Decimal:
+    return Decimal(units) / AMOUNT_SCALE
+
+
+def price_key(offer_units: int, take_units: int) -> str:
+    return str(take_units * PRICE_SCALE // offer_units).zfill(PRICE_KEY_WIDTH)
+
+
+def compute_fee(units: int, fee_bps: int) -> int:
+    return units * fee_bps // BPS_DENOMINATOR
+
+
+@dataclass
+class ModelListing:
+    maker: str
+    offer_token: str
+    offer_units: int
+    take_token: str
+    take_units: int
+    fee_bps: int
+    maker_fee: int
+    taker_fee: int
+    price: str
+    status: str = "OPEN"
+
+
+class OtcModel:
+    def __init__(self, contract: str, owner: str, fee_bps: int = DEFAULT_FEE_BPS):
+        self.contract = contract
+        self.owner = owner
+        self.fee_bps = fee_bps
+        self.balances = {}  # (token, account) -> units
+        self.listings = {}  # listing id -> ModelListing
+        self.earned = {}  # token -> units, summed over fee shards
+
+    # Token ledger -------------------------------------------------------------------------------------
+
+    def balance(self, token: str, account: str) -> int:
+        return self.balances.get((token, account), 0)
+
+    def credit(self, token: str, account: str, units: int) -> None:
+        self.balances[token, account] = self.balance(token, account) + units
+
+    def move(self, token: str, sender: str, to: str, units: int) -> None:
+        if self.balance(token, sender) < units:
+            raise Rejected("Transfer amount exceeds balance!")
+        self.balances[token, sender] -= units
+        self.credit(token, to, units)
+
+    def escrow(self, token: str) -> int:
+        """Units the contract must hold for open listings offering ``token``."""
+        return sum(
+            listing.offer_units + listing.maker_fee
+            for listing in self.listings.values()
+            if listing.status == "OPEN" and listing.offer_token == token
+        )
+
+    # Contract entry points ------------------------------------------------------------------------------
+
+    def listing_cost(self, offer_amount) -> int:
+        """Units ``list_offer`` pulls from the maker at the current fee."""
+        offer_units = to_units(offer_amount)
+        return offer_units + compute_fee(offer_units, self.fee_bps)
+
+    def list_offer(self, listing_id, maker, offer_token, offer_amount, take_token, take_amount) -> None:
+        if Decimal(str(offer_amount)) <= 0:
+            raise Rejected("Offer amount must be positive")
+        if Decimal(str(take_amount)) <= 0:
+            raise Rejected("Take amount must be positive")
+        offer_units = to_units(offer_amount)
+        take_units = to_units(take_amount)
+        maker_fee = compute_fee(offer_units, self.fee_bps)
+        # Every check runs before any effect, so a rejected call leaves the model untouched like a reverted tx
+        if self.balance(offer_token, maker) < offer_units + maker_fee:
+            raise Rejected("Transfer amount exceeds balance!")
+        price = price_key(offer_units, take_units)
+        if len(price) > PRICE_KEY_WIDTH:
+            raise Rejected("Price out of range")
+
+        # Without a hint the contract walks every listing of the pair priced at or below the new one
+        walk = sum(
+            1 for listing in self.listings.values()
+            if listing.status == "OPEN" and listing.offer_token == offer_token
+            and listing.take_token == take_token and listing.price <= price
+        )
+        if walk > MAX_BOOK_WALK:
+            raise Rejected("Order book too deep to place listing, pass a position_hint")
+
+        self.move(offer_token, maker, self.contract, offer_units + maker_fee)
+        self.listings[listing_id] = ModelListing(
+            maker=maker, offer_token=offer_token, offer_units=offer_units,
+            take_token=take_token, take_units=take_units, fee_bps=self.fee_bps,
+            maker_fee=maker_fee, taker_fee=compute_fee(take_units, self.fee_bps), price=price,
+        )
+
+    def take_offer(self, listing_id, taker) -> None:
+        listing = self.listings.get(listing_id)
+        if listing is None:
+            raise Rejected("Offer ID does not exist")
+        if listing.status != "OPEN":
+            raise Rejected("Offer not available")
+        self.move(listing.take_token, taker, self.contract, listing.take_units + listing.taker_fee)
+        self.move(listing.take_token, self.contract, listing.maker, listing.take_units)
+        self.move(listing.offer_token, self.contract, taker, listing.offer_units)
+        self.earned[listing.offer_token] = self.earned.get(listing.offer_token, 0) + listing.maker_fee
+        self.earned[listing.take_token] = self.earned.get(listing.take_token, 0) + listing.taker_fee
+        listing.status = "EXECUTED"
+
+    def cancel_offer(self, listing_id, caller) -> None:
+        listing = self.listings.get(listing_id)
+        if listing is None:
+            raise Rejected("Offer ID does not exist")
+        if listing.status != "OPEN":
+            raise Rejected("Offer can not be cancelled")
+        if listing.maker != caller:
+            raise Rejected("Only maker can cancel offer")
+        self.move(listing.offer_token, self.contract, caller, listing.offer_units + listing.maker_fee)
+        listing.status = "CANCELLED"
+
+    def adjust_fee(self, caller, fee_bps: int) -> None:
+        if caller != self.owner:
+            raise Rejected("Only owner can call this method!")
+        if not 0 <= fee_bps <= MAX_FEE_BPS:
+            raise Rejected("Fee must be between 0 and 1000 basis points")
+        self.fee_bps = fee_bps
+
+    def withdraw(self, caller, tokens) -> None:
+        if caller != self.owner:
+            raise Rejected("Only owner can call this method!")
+        for token in tokens:
+            units = self.earned.get(token, 0)
+            if units > 0:
+                self.earned[token] = 0
+                self.move(token, self.contract, self.owner, units)
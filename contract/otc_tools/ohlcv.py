@@ -0,0 +1,204 @@
+"""Incremental OHLCV candles and rolling volume from OTC fill events.
+
+Feed events in log order to ``OhlcvAggregator.on_event``. Fills come from
+three events:
+- TakeOffer: a listing taken directly or crossed by ``auto_cross``;
+- QuoteSettled: an RFQ settlement;
+- EpochCleared: a batch auction clearing.
+Each fill updates one candle per resolution plus a rolling 24h volume
+for its directed ``(offer_token, take_token)`` pair, in constant time.
+The price is ``take_amount / offer_amount``, in take_token per
+offer_token.
+
+Fill events carry no block time, so pass the block's ``timestamp`` (or
+an event with a ``"timestamp"`` key) for every fill; a fill without one
+raises ValueError.
+
+TakeOffer only carries the listing id, so the aggregator remembers the
+pair of every Offer it sees until that listing is taken or cancelled.
+Memory stays proportional to the open book. Listings opened before the
+aggregator started are looked up through ``resolve_listing``, if given.
+
+Memory is bounded: each pair keeps at most ``retention`` candles per
+resolution, and volume is summed over fixed time slots.
+"""
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from decimal import Decimal
+
+RESOLUTIONS = (60, 300, 3600, 86400)  # Seconds per candle
+RETENTION = 1440  # Candles kept per pair and resolution
+VOLUME_WINDOW = 86400
+VOLUME_SLOT = 60
+FILL_EVENTS = ("TakeOffer", "QuoteSettled", "EpochCleared")
+
+
+def to_timestamp(value) -> int:
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    value = getattr(value, "_datetime", value)  # contracting's Datetime wraps a datetime
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)  # Block times are UTC
+    return int(value.timestamp())
+
+
+@dataclass
+class Candle:
+    start: int
+    open: Decimal
+    high: Decimal
+    low: Decimal
+    close: Decimal
+    base_volume: Decimal = Decimal(0)  # offer_token traded
+    quote_volume: Decimal = Decimal(0)  # take_token traded
+    trades: int = 0
+
+    def add(self, price: Decimal, base: Decimal, quote: Decimal) -> None:
+        self.high = max(self.high, price)
+        self.low = min(self.low, price)
+        self.close = price
+        self.base_volume += base
+        self.quote_volume += quote
+        self.trades += 1
+
+
+class CandleSeries:
+    """Candles of one resolution for one pair, the newest ``retention`` buckets only."""
+
+    def __init__(self, resolution: int, retention: int):
+        self.resolution = resolution
+        self.retention = retention
+        self.buckets = {}  # bucket start -> Candle
+        self.order = deque()  # bucket starts, oldest first
+
+    def add(self, timestamp: int, price: Decimal, base: Decimal, quote: Decimal) -> None:
+        start = timestamp - timestamp % self.resolution
+        candle = self.buckets.get(start)
+        if candle is None:
+            if self.order and start < self.order[0] and len(self.order) >= self.retention:
+                return  # Older than everything retained
+            candle = self.buckets[start] = Candle(start, price, price, price, price)
+            if not self.order or start > self.order[-1]:
+                self.order.append(start)
+            else:
+                # Late fill for a bucket with no trades yet: rare, so a sorted insert is fine
+                self.order = deque(sorted([*self.order, start]))
+            while len(self.order) > self.retention:
+                del self.buckets[self.order.popleft()]
+        candle.add(price, base, quote)
+
+    def candles(self) -> list:
+        return [self.buckets[start] for start in self.order]
+
+
+class RollingVolume:
+    """Volume over the trailing ``window`` seconds, kept in fixed slots."""
+
+    def __init__(self, window: int = VOLUME_WINDOW, slot: int = VOLUME_SLOT):
+        self.slot = slot
+        self.slots = window // slot
+        self.base = [Decimal(0)] * self.slots
+        self.quote = [Decimal(0)] * self.slots
+        self.total_base = Decimal(0)
+        self.total_quote = Decimal(0)
+        self.latest = None  # Newest slot number seen
+
+    def advance(self, slot_number: int) -> None:
+        if self.latest is None:
+            self.latest = slot_number
+            return
+        # Expire the slots that fell out of the window; never more than the ring size
+        for expired in range(self.latest + 1, min(slot_number, self.latest + self.slots) + 1):
+            index = expired % self.slots
+            self.total_base -= self.base[index]
+            self.total_quote -= self.quote[index]
+            self.base[index] = self.quote[index] = Decimal(0)
+        self.latest = max(self.latest, slot_number)
+
+    def add(self, timestamp: int, base: Decimal, quote: Decimal) -> None:
+        slot_number = timestamp // self.slot
+        self.advance(slot_number)
+        if slot_number <= self.latest - self.slots:
+            return  # Already outside the window
+        index = slot_number % self.slots
+        self.base[index] += base
+        self.quote[index] += quote
+        self.total_base += base
+        self.total_quote += quote
+
+    def totals(self, now: int = None) -> tuple:
+        if now is not None:
+            self.advance(now // self.slot)
+        return self.total_base, self.total_quote
+
+
+class OhlcvAggregator:
+    def __init__(self, resolutions=RESOLUTIONS, retention: int = RETENTION, volume_window: int = VOLUME_WINDOW,
+                 resolve_listing=None):
+        self.resolutions = tuple(resolutions)
+        self.retention = retention
+        self.volume_window = volume_window
+        self.resolve_listing = resolve_listing  # listing id -> (offer_token, take_token) or None
+        self.open_listings = {}  # listing id -> (offer_token, take_token)
+        self.series = {}  # pair -> {resolution: CandleSeries}
+        self.volume = {}  # pair -> RollingVolume
+        self.unresolved = 0  # TakeOffer events whose pair could not be found
+
+    def on_event(self, event: dict, timestamp=None) -> None:
+        name = event.get("event")
+        fields = {**(event.get("data") or {}), **(event.get("data_indexed") or {})}
+        if timestamp is None:
+            timestamp = event.get("timestamp")
+        if timestamp is None and name in FILL_EVENTS:
+            raise ValueError(f"{name} event has no timestamp; pass the block time to on_event")
+
+        if name == "Offer":
+            self.open_listings[fields["id"]] = (fields["offer_token"], fields["take_token"])
+        elif name == "CancelOffer":
+            self.open_listings.pop(fields["id"], None)
+        elif name == "TakeOffer":
+            pair = self.open_listings.pop(fields["id"], None)
+            if pair is None and self.resolve_listing is not None:
+                pair = self.resolve_listing(fields["id"])
+            if pair is None:
+                self.unresolved += 1
+                return
+            self.on_fill(pair[0], pair[1], fields["offer_amount"], fields["take_amount"], timestamp)
+        elif name == "QuoteSettled":
+            self.on_fill(fields["offer_token"], fields["take_token"], fields["offer_amount"],
+                         fields["take_amount"], timestamp)
+        elif name == "EpochCleared" and Decimal(str(fields["base_volume"])) > 0:
+            base_volume = Decimal(str(fields["base_volume"]))
+            quote_volume = base_volume * Decimal(str(fields["clearing_price"]))
+            self.on_fill(fields["base_token"], fields["quote_token"], base_volume, quote_volume, timestamp)
+
+    def on_fill(self, offer_token: str, take_token: str, offer_amount, take_amount, timestamp) -> None:
+        base, quote = Decimal(str(offer_amount)), Decimal(str(take_amount))
+        if base <= 0:
+            return
+        moment = to_timestamp(timestamp)
+        price = quote / base
+        pair = (offer_token, take_token)
+        series = self.series.get(pair)
+        if series is None:
+            series = self.series[pair] = {
+                resolution: CandleSeries(resolution, self.retention) for resolution in self.resolutions
+            }
+            self.volume[pair] = RollingVolume(self.volume_window)
+        for candle_series in series.values():
+            candle_series.add(moment, price, base, quote)
+        self.volume[pair].add(moment, base, quote)
+
+    def candles(self, offer_token: str, take_token: str, resolution: int) -> list:
+        series = self.series.get((offer_token, take_token))
+        return series[resolution].candles() if series else []
+
+    def rolling_volume(self, offer_token: str, take_token: str, now=None) -> tuple:
+        """(offer_token volume, take_token volume) over the trailing window."""
+        volume = self.volume.get((offer_token, take_token))
+        if volume is None:
+            return Decimal(0), Decimal(0)
+        return volume.totals(None if now is None else to_timestamp(now))
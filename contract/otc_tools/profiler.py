@@ -0,0 +1,190 @@
+"""State-access profiler for contract calls made through a ContractingClient.
+
+While the profiler is active, every top-level contract call becomes one
+``CallProfile``. The profile records each state read and write with its
+key, encoded size, whether the driver served it from cache, and the
+contract call stack it happened under. It also records every call into
+another contract, and the stamps spent in each stack segment, exclusive of
+nested segments.
+
+    with StateProfiler(client) as profiler:
+        otc.take_offer(signer=taker, listing_id=listing_id)
+    print(profiler.table())
+    open("take.folded", "w").write(profiler.folded())  # flamegraph.pl / speedscope input
+
+Stamps are read from the runtime's metering tracer, so segment stamps are
+only non-zero on a metering client.
+"""
+import sys
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+LOAD_SEGMENT = "<load>"  # Reads the executor makes before the entry function runs, e.g. the contract code
+
+
+@dataclass
+class Access:
+    op: str  # "read" or "write"
+    key: str
+    size: int
+    cached: bool
+    stack: tuple
+
+    @property
+    def variable(self) -> str:
+        # "con_otc.earned_fees:con_token_a:0" -> "con_otc.earned_fees"
+        return self.key.split(":", 1)[0]
+
+
+@dataclass
+class CallProfile:
+    contract: str
+    function: str
+    accesses: list = field(default_factory=list)
+    foreign_calls: list = field(default_factory=list)  # (caller stack, callee "contract.function")
+    segments: Counter = field(default_factory=Counter)  # stack -> exclusive stamps
+    stamps: int = 0
+
+    @property
+    def name(self) -> str:
+        return f"{self.contract}.{self.function}"
+
+
+def _encoded_size(value) -> int:
+    from contracting.storage.encoder import encode
+
+    return len(encode(value)) if value is not None else 0
+
+
+def _stamps_used() -> int:
+    from contracting.execution.runtime import rt
+
+    tracer = getattr(rt, "tracer", None)
+    return tracer.get_stamp_used() if tracer is not None else 0
+
+
+class StateProfiler:
+    def __init__(self, client):
+        self.client = client
+        self.driver = client.raw_driver
+        self.calls = []
+        self._contracts = {}  # module name -> is a deployed contract
+        self._stack = []  # [frame, "contract.function", stamps at entry, stamps in children]
+        self._pending = []  # Accesses made before the next entry function starts
+        self._current = None
+        self._resolving = False
+
+    # Hooks ---------------------------------------------------------------------------------------------
+
+    def __enter__(self):
+        driver = self.driver
+        original_get, original_set = driver.get, driver.set
+
+        def get(key, *args, **kwargs):
+            cached = key in getattr(driver, "pending_writes", {}) or key in getattr(driver, "cache", {})
+            value = original_get(key, *args, **kwargs)
+            self._record("read", key, value, cached)
+            return value
+
+        def set_(key, value, *args, **kwargs):
+            self._record("write", key, value, key in getattr(driver, "cache", {}))
+            return original_set(key, value, *args, **kwargs)
+
+        driver.get, driver.set = get, set_
+        self._previous_profile = sys.getprofile()
+        sys.setprofile(self._on_event)
+        return self
+
+    def __exit__(self, *exc_info):
+        sys.setprofile(self._previous_profile)
+        del self.driver.get, self.driver.set  # Drop the instance overrides, the class methods show through again
+        return False
+
+    def _is_contract(self, module_name) -> bool:
+        if module_name not in self._contracts:
+            self._resolving = True  # Our own lookup is not part of the profiled call
+            self._contracts[module_name] = bool(module_name) and self.driver.get_contract(module_name) is not None
+            self._resolving = False
+        return self._contracts[module_name]
+
+    def _stack_names(self) -> tuple:
+        return tuple(entry[1] for entry in self._stack) or (LOAD_SEGMENT,)
+
+    def _record(self, op, key, value, cached) -> None:
+        if self._resolving:
+            return
+        access = Access(op=op, key=key, size=_encoded_size(value), cached=cached, stack=self._stack_names())
+        (self._current.accesses if self._stack else self._pending).append(access)
+
+    def _on_event(self, frame, event, arg) -> None:
+        if event not in ("call", "return"):
+            return
+        module_name = frame.f_globals.get("__name__")
+        if not self._is_contract(module_name):
+            return
+        if event == "call":
+            name = f"{module_name}.{frame.f_code.co_name}"
+            if not self._stack:
+                self._current = CallProfile(contract=module_name, function=frame.f_code.co_name)
+                self._current.accesses.extend(self._pending)
+                self._pending = []
+            elif self._stack[-1][1].split(".")[0] != module_name:
+                self._current.foreign_calls.append((self._stack_names(), name))
+            self._stack.append([frame, name, _stamps_used(), 0])
+        elif self._stack and self._stack[-1][0] is frame:
+            _, _, entered, in_children = self._stack[-1]
+            spent = _stamps_used() - entered
+            self._current.segments[self._stack_names()] += spent - in_children
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1][3] += spent
+            else:
+                self._current.stamps = spent
+                self.calls.append(self._current)
+
+    # Reports -------------------------------------------------------------------------------------------
+
+    def folded(self) -> str:
+        """Collapsed stacks, one ``frame;frame;... stamps`` line per segment, for flamegraph tools."""
+        totals = Counter()
+        for call in self.calls:
+            for stack, stamps in call.segments.items():
+                totals[";".join(stack)] += stamps
+        return "\n".join(f"{stack} {stamps}" for stack, stamps in sorted(totals.items()))
+
+    def by_function(self) -> dict:
+        grouped = defaultdict(list)
+        for call in self.calls:
+            grouped[call.name].append(call)
+        return grouped
+
+    def table(self, top_keys: int = 8) -> str:
+        lines = []
+        for name, calls in sorted(self.by_function().items()):
+            accesses = [access for call in calls for access in call.accesses]
+            reads = [access for access in accesses if access.op == "read"]
+            writes = [access for access in accesses if access.op == "write"]
+            foreign = Counter(callee for call in calls for _, callee in call.foreign_calls)
+            lines.append(
+                f"{name}: {len(calls)} call(s), {sum(call.stamps for call in calls) // len(calls)} stamps/call, "
+                f"{len(reads)} reads ({sum(access.cached for access in reads)} cached, "
+                f"{sum(access.size for access in reads)} B), {len(writes)} writes ({sum(access.size for access in writes)} B)"
+            )
+            lines.append(f"  {'variable':<40}{'reads':>7}{'writes':>8}{'bytes':>9}{'cached':>8}")
+            variables = defaultdict(lambda: [0, 0, 0, 0])
+            for access in accesses:
+                row = variables[access.variable]
+                row[0 if access.op == "read" else 1] += 1
+                row[2] += access.size
+                row[3] += access.cached
+            hottest = sorted(variables.items(), key=lambda item: -(item[1][0] + item[1][1]))[:top_keys]
+            for variable, (read_count, write_count, size, cached) in hottest:
+                lines.append(f"  {variable:<40}{read_count:>7}{write_count:>8}{size:>9}{cached:>8}")
+            for callee, count in foreign.most_common():
+                lines.append(f"  -> {callee} x{count}")
+            segments = Counter()
+            for call in calls:
+                segments.update(call.segments)
+            for stack, stamps in segments.most_common(top_keys):
+                lines.append(f"  {' > '.join(stack)}: {stamps} stamps")
+        return "\n".join(lines)
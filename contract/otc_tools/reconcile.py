@@ -0,0 +1,151 @@
+"""Reconcile the OTC contract's token holdings against its books.
+
+For every token the contract must hold exactly:
+
+    escrow of OPEN listings (offer_amount + maker_fee)
+  + escrow of batch orders in each pair's running epoch (amount + fee)
+  + earned_fees summed over all shards
+
+This is the invariant test_21 checks by hand. Here it is checked over a
+whole state dump. Listings are loaded into NumPy columns chunk by chunk,
+and the per-token sums are grouped integer reductions, so millions of
+listings reconcile in the time it takes to read the dump. Every amount is
+compared in exact int64 units of 10 ** -8.
+
+    python -m otc_tools.reconcile state.jsonl --contract con_otc
+"""
+import argparse
+from dataclasses import dataclass
+
+from otc_tools.export import LISTING_COLUMNS, ColumnChunks, Dictionary, NumpySink, listing_rows, np, to_units
+from otc_tools.state import iter_state, split_key
+
+
+@dataclass
+class TokenReconciliation:
+    token: str
+    held: int
+    listing_escrow: int
+    batch_escrow: int
+    earned_fees: int
+
+    @property
+    def expected(self) -> int:
+        return self.listing_escrow + self.batch_escrow + self.earned_fees
+
+    @property
+    def difference(self) -> int:
+        """Positive when the contract holds more than its books account for, negative when it is short."""
+        return self.held - self.expected
+
+
+class StateTables:
+    """One pass over a dump: listings into columns, everything else the invariant needs into arrays."""
+
+    def __init__(self, contract: str, chunk_rows: int = 100_000):
+        if np is None:
+            raise ImportError("numpy is required for reconciliation: pip install numpy")
+        self.contract = contract
+        self.dictionaries = {name: Dictionary() for name in ("accounts", "tokens", "statuses", "events")}
+        self.tokens = self.dictionaries["tokens"]
+        self.listing_sink = NumpySink(LISTING_COLUMNS)
+        self.listing_chunks = ColumnChunks(LISTING_COLUMNS, self.dictionaries, self.listing_sink, chunk_rows)
+        self.fee_codes, self.fee_units = [], []
+        self.held = {}  # token code -> units the contract holds
+        self.batch_orders = []  # (base, quote, epoch, escrow token code, units)
+        self.batch_epoch = {}  # (base, quote) -> running epoch
+
+    def load(self, source) -> "StateTables":
+        listing_prefix = f"{self.contract}.otc_listing:"
+        listing_nodes = []
+        for key, value in iter_state(source):
+            if key.startswith(listing_prefix):
+                listing_nodes.append((key, value))
+                if len(listing_nodes) >= self.listing_chunks.chunk_rows:
+                    self._add_listings(listing_nodes)
+                    listing_nodes = []
+                continue
+            contract, variable, arguments = split_key(key)
+            if contract == self.contract and variable == "earned_fees" and arguments:
+                self.fee_codes.append(self.tokens.encode(arguments[0]))
+                self.fee_units.append(to_units(value))
+            elif contract == self.contract and variable == "batch_orders" and isinstance(value, dict):
+                base, quote, epoch = arguments[0], arguments[1], int(arguments[2])
+                escrow_token = quote if value.get("side") == "BUY" else base
+                units = to_units(value.get("amount")) + to_units(value.get("fee"))
+                self.batch_orders.append((base, quote, epoch, self.tokens.encode(escrow_token), units))
+            elif contract == self.contract and variable == "batch_epoch" and len(arguments) == 2:
+                self.batch_epoch[arguments[0], arguments[1]] = int(value or 0)
+            elif variable == "balances" and arguments == [self.contract]:
+                self.held[self.tokens.encode(contract)] = to_units(value)
+        self._add_listings(listing_nodes)
+        self.listing_chunks.flush()
+        return self
+
+    def _add_listings(self, nodes) -> None:
+        for row in listing_rows(nodes, self.contract):
+            self.listing_chunks.append(row)
+
+
+def grouped_sum(codes, units, size: int):
+    totals = np.zeros(size, dtype=np.int64)
+    np.add.at(totals, codes, units)  # Exact int64 accumulation, unlike bincount's float weights
+    return totals
+
+
+def reconcile(source, contract: str = "con_otc") -> list:
+    """Per-token reconciliation of a state dump (path, dict or iterable of key/value nodes)."""
+    tables = StateTables(contract).load(source)
+    size = len(tables.tokens.values)
+    listings = tables.listing_sink.columns()
+
+    open_code = tables.dictionaries["statuses"].codes.get("OPEN", -2)
+    is_open = listings["status"] == open_code
+    listing_escrow = grouped_sum(
+        listings["offer_token"][is_open],
+        listings["offer_amount"][is_open] + listings["maker_fee"][is_open],
+        size,
+    )
+
+    running = [order for order in tables.batch_orders if tables.batch_epoch.get(order[:2], 0) == order[2]]
+    batch_escrow = grouped_sum(
+        np.array([order[3] for order in running], dtype=np.int64),
+        np.array([order[4] for order in running], dtype=np.int64),
+        size,
+    )
+    earned = grouped_sum(np.array(tables.fee_codes, dtype=np.int64), np.array(tables.fee_units, dtype=np.int64), size)
+
+    return [
+        TokenReconciliation(
+            token=token,
+            held=tables.held.get(code, 0),
+            listing_escrow=int(listing_escrow[code]),
+            batch_escrow=int(batch_escrow[code]),
+            earned_fees=int(earned[code]),
+        )
+        for code, token in enumerate(tables.tokens.values)
+    ]
+
+
+def format_report(rows) -> str:
+    lines = [f"{'token':<32}{'held':>20}{'listings':>20}{'batches':>16}{'fees':>16}{'difference':>16}"]
+    for row in rows:
+        flag = "" if row.difference == 0 else "  <-- MISMATCH"
+        lines.append(f"{row.token:<32}{row.held:>20}{row.listing_escrow:>20}{row.batch_escrow:>16}"
+                     f"{row.earned_fees:>16}{row.difference:>16}{flag}")
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("state", help="state dump with the OTC contract's keys and each token's balances entry for it")
+    parser.add_argument("--contract", default="con_otc")
+    args = parser.parse_args(argv)
+
+    rows = reconcile(args.state, args.contract)
+    print(format_report(rows))
+    return 1 if any(row.difference for row in rows) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,170 @@
+"""Replay a recorded trace for performance regression checks.
+
+A trace recorded with ``otc_tools.trace.TraceRecorder`` holds each call's
+signer, clock movement, function, kwargs, and the status and stamps it had
+when it was recorded:
+
+    recorder = TraceRecorder(otc_name="con_otc")
+    otc = recorder.wrap(client.get_contract("con_otc"))
+    otc.list_offer(signer=maker, environment=environment, offer_token=..., ...)
+    recorder.dump("session.jsonl.gz")
+
+The replayer deploys con_otc_v3 and con_token afresh on a metering client.
+It funds every signer the trace uses, gives the OTC contract a standing
+allowance, and runs the calls in order. Each call is timed on its own.
+Stamps and timings are totalled per function. A call whose status differs
+from the recorded one is a divergence, meaning the trace no longer
+reproduces; that usually needs funding or setup the trace did not capture.
+
+A replay's per-function figures can be saved as a baseline and compared on
+later replays. Stamps are deterministic, so any increase is a regression.
+Median and p95 wall time are allowed ``--time-tolerance`` before they count.
+
+    python -m otc_tools.replay session.jsonl.gz --save-baseline baseline.json
+    python -m otc_tools.replay session.jsonl.gz --baseline baseline.json
+"""
+import argparse
+import json
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from otc_tools.deploy import OWNER, TOKEN_SUPPLY, deploy_market, fund_stamps, new_client
+from otc_tools.trace import OTC, load_trace, replay_call, trace_participants
+
+FUNDING = 100_000
+TIME_TOLERANCE = 0.25  # Fractional slowdown of p50 / p95 allowed before it is a regression
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+@dataclass
+class ReplayReport:
+    otc_file: str
+    calls: int = 0
+    seconds: float = 0.0
+    stamps: dict = field(default_factory=lambda: defaultdict(int))  # function -> stamps spent on replay
+    recorded_stamps: dict = field(default_factory=lambda: defaultdict(int))  # function -> stamps as recorded
+    timings: dict = field(default_factory=lambda: defaultdict(list))  # function -> seconds per call
+    failures: dict = field(default_factory=lambda: defaultdict(int))
+    divergences: list = field(default_factory=list)  # (call index, function, recorded status, replayed status)
+
+    def functions(self) -> dict:
+        """Per-function figures, in the shape a baseline stores them."""
+        return {
+            name: {
+                "calls": len(timings),
+                "failures": self.failures[name],
+                "stamps": self.stamps[name],
+                "p50_ms": round(percentile(timings, 0.5) * 1000, 3),
+                "p95_ms": round(percentile(timings, 0.95) * 1000, 3),
+            }
+            for name, timings in sorted(self.timings.items())
+        }
+
+    def baseline(self) -> dict:
+        return {"otc_file": self.otc_file, "calls": self.calls, "functions": self.functions()}
+
+    def format(self, limit: int = 10) -> str:
+        lines = [f"{self.calls} calls replayed against {self.otc_file} in {self.seconds:.1f}s "
+                 f"({self.calls / max(self.seconds, 1e-9):.0f} calls/s)"]
+        lines.append(f"{'function':<28}{'calls':>8}{'failed':>8}{'stamps':>12}{'recorded':>12}{'p50 ms':>10}{'p95 ms':>10}")
+        for name, row in self.functions().items():
+            lines.append(f"{name:<28}{row['calls']:>8}{row['failures']:>8}{row['stamps']:>12}"
+                         f"{self.recorded_stamps[name]:>12}{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}")
+        if self.divergences:
+            lines.append(f"{len(self.divergences)} calls diverged from the recording:")
+            for index, name, recorded, replayed in self.divergences[:limit]:
+                lines.append(f"  #{index} {name}: status {recorded} recorded, {replayed} on replay")
+        return "\n".join(lines)
+
+
+def replay_trace(trace, otc_file: str = "con_otc_v3.py", owner: str = OWNER, funding: int = FUNDING) -> ReplayReport:
+    """Deploy ``otc_file`` and the trace's tokens in a private client and replay ``trace`` against them."""
+    actors, token_names = trace_participants(trace, owner)
+    storage_home = tempfile.mkdtemp(prefix="otc_replay_")
+    client = new_client(storage_home, metering=True)
+    report = ReplayReport(otc_file)
+    try:
+        fund_stamps(client, list(actors) + [owner], amount=TOKEN_SUPPLY // (len(actors) + 2), owner=owner)
+        market = deploy_market(client, otc_file=otc_file, token_names=token_names, owner=owner)
+        market.fund(actors, funding)
+        market.approve_all(actors, funding * 1_000)
+
+        results = []
+        started = time.perf_counter()
+        for index, call in enumerate(trace):
+            call_started = time.perf_counter()
+            output = replay_call(market, call, results)
+            elapsed = time.perf_counter() - call_started
+            results.append(output["result"] if output["status_code"] == 0 else None)
+
+            name = call.function if call.contract == OTC else f"{call.contract}.{call.function}"
+            report.timings[name].append(elapsed)
+            report.stamps[name] += output["stamps_used"]
+            if output["status_code"] != 0:
+                report.failures[name] += 1
+            if call.expect:
+                report.recorded_stamps[name] += call.expect.get("stamps", 0)
+                if call.expect["status"] != output["status_code"]:
+                    report.divergences.append((index, name, call.expect["status"], output["status_code"]))
+        report.calls = len(trace)
+        report.seconds = time.perf_counter() - started
+        return report
+    finally:
+        client.flush()
+        shutil.rmtree(storage_home, ignore_errors=True)
+
+
+def compare_baseline(report: ReplayReport, baseline: dict, time_tolerance: float = TIME_TOLERANCE) -> list:
+    """Regressions of ``report`` against ``baseline``, as ``(function, measure, baseline, replayed)``."""
+    regressions = []
+    current = report.functions()
+    for name, before in sorted(baseline["functions"].items()):
+        after = current.get(name)
+        if after is None:
+            regressions.append((name, "calls", before["calls"], 0))
+            continue
+        if after["calls"] != before["calls"]:
+            regressions.append((name, "calls", before["calls"], after["calls"]))
+        elif after["stamps"] > before["stamps"]:
+            regressions.append((name, "stamps", before["stamps"], after["stamps"]))
+        for measure in ("p50_ms", "p95_ms"):
+            if after[measure] > before[measure] * (1 + time_tolerance):
+                regressions.append((name, measure, before[measure], after[measure]))
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("trace", help="JSON-lines trace, gzip compressed if it ends in .gz")
+    parser.add_argument("--otc-file", default="con_otc_v3.py")
+    parser.add_argument("--owner", default=OWNER, help="the signer that owned the OTC contract when recording")
+    parser.add_argument("--funding", type=int, default=FUNDING, help="tokens given to every signer before the replay")
+    parser.add_argument("--baseline", help="baseline JSON to compare against; exit 1 on a regression")
+    parser.add_argument("--save-baseline", help="write this replay's figures as a baseline")
+    parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    report = replay_trace(load_trace(args.trace), args.otc_file, args.owner, args.funding)
+    print(report.format())
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as handle:
+            json.dump(report.baseline(), handle, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as handle:
+            regressions = compare_baseline(report, json.load(handle), args.time_tolerance)
+        for name, measure, before, after in regressions:
+            print(f"REGRESSION {name} {measure}: {before} -> {after}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,227 @@
+"""Static, content-hashed order-book snapshots for CDN delivery.
+
+Browsing the public order book costs a GraphQL query per visit. This tool
+follows the contract's events into an ``otc_tools.book.ListingStore`` and
+publishes the open book as static gzipped JSON instead. It writes one file
+per pair plus one global file, each a JSON array of OPEN listings in the
+shape ``fetchOpenOffers`` returns. A pair is cheapest first; the global
+file is in listing order.
+
+Snapshot files are named by a hash of their content and never change once
+written, so a CDN can cache them forever. ``index.json`` is the only file
+that changes in place. It maps each pair, and the global book, to its
+current file, and is written last, so it never points at a file that is
+not there yet. Every file is written to a temporary name and renamed into
+place, so readers see the old version or the new one, never half of
+either. Files referenced by the previous index are kept for clients that
+are still fetching them; older ones are removed.
+
+A publish happens every ``every_events`` book changes, or ``every_seconds``
+after the first change not yet published. Only pairs that changed are
+re-encoded.
+
+    python -m otc_tools.snapshots state.jsonl --events events.jsonl --contract con_otc --out book
+
+The publisher is meant to run as its own long-lived process next to the
+node, following the event log with ``--events`` and writing into a
+directory a static host or CDN serves. It is not part of the site build.
+Serve ``v/*`` as immutable and make ``index.json`` revalidate on every
+request. With ``--graphql`` the starting book is read from a node's
+GraphQL endpoint instead of a dump; a node that cannot be reached ends the
+run with exit status 1 before anything is written. ``--plain`` writes
+uncompressed ``.json`` files for hosts that compress responses
+themselves, where a pre-gzipped file served with a fixed Content-Encoding
+could be compressed a second time.
+
+    python -m otc_tools.snapshots --graphql https://node.xian.org/graphql --events events.jsonl --contract con_otc_v3 --out /srv/book
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+from otc_tools.api import tail_events
+from otc_tools.book import ListingStore, offer_shape
+
+EVERY_EVENTS = 50
+EVERY_SECONDS = 10.0
+HASH_LENGTH = 16
+GRAPHQL_PAGE = 100
+GLOBAL = "*"  # Manifest key of the all-pairs book
+
+
+def atomic_write(path: Path, data: bytes) -> None:
+    handle, temporary = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(handle, "wb") as output:
+            output.write(data)
+            output.flush()
+            os.fsync(output.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def encode_offers(offers: list, compress: bool = True) -> tuple:
+    """``(content hash, bytes)``; gzip without a timestamp, so equal books give equal files."""
+    body = json.dumps(offers, separators=(",", ":"), default=str).encode()
+    return hashlib.sha256(body).hexdigest()[:HASH_LENGTH], gzip.compress(body, mtime=0) if compress else body
+
+
+def fetch_open_listings(url: str, contract: str, page_size: int = GRAPHQL_PAGE):
+    """Yield the OPEN listing nodes of ``contract`` from a GraphQL endpoint, the query ``fetchOpenOffers`` sends."""
+    offset = 0
+    while True:
+        query = (
+            '{ allStates(filter: {key: {startsWith: "%s.otc_listing"}, value: {contains: {status: "OPEN"}}}, '
+            'offset: %d, first: %d) { nodes { key value } } }' % (contract, offset, page_size)
+        )
+        request = urllib.request.Request(
+            url, data=json.dumps({"query": query}).encode(), headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=30) as response:
+            nodes = json.load(response)["data"]["allStates"]["nodes"]
+        yield from nodes
+        if len(nodes) < page_size:
+            return
+        offset += page_size
+
+
+class SnapshotWriter:
+    def __init__(self, store: ListingStore, out, contract: str = "con_otc", every_events: int = EVERY_EVENTS,
+                 every_seconds: float = EVERY_SECONDS, clock=time.monotonic, compress: bool = True):
+        self.store = store
+        self.compress = compress
+        self.out = Path(out)
+        self.contract = contract
+        self.every_events = every_events
+        self.every_seconds = every_seconds
+        self.clock = clock
+        self.files = {}  # manifest key -> {"path", "hash", "count"}
+        self.previous_paths = set()  # Files the index before the current one referenced
+        self.dirty = set(store.pairs())  # Pairs changed since the last publish; everything loaded so far
+        self.pending_events = 0
+        self.dirty_since = clock() if self.dirty else None
+        self.publishes = 0
+
+    def on_event(self, event: dict) -> None:
+        if event.get("contract", self.contract) != self.contract:
+            return
+        _, scopes = self.store.apply(event)
+        pairs = {scope[1:3] for scope in scopes if scope[0] == "pair" and scope[3] == "OPEN"}
+        if not pairs:
+            return
+        self.dirty |= pairs
+        self.pending_events += 1
+        if self.dirty_since is None:
+            self.dirty_since = self.clock()
+        if self.pending_events >= self.every_events:
+            self.publish()
+
+    def maybe_publish(self) -> bool:
+        if self.dirty_since is not None and self.clock() - self.dirty_since >= self.every_seconds:
+            self.publish()
+            return True
+        return False
+
+    def publish(self) -> dict:
+        """Write the changed pairs, the global book and then the index; returns the index."""
+        versions = self.out / "v"
+        versions.mkdir(parents=True, exist_ok=True)
+        for pair in self.dirty:
+            key = f"{pair[0]}/{pair[1]}"
+            offers = self.store.open_offers(*pair)
+            if offers:
+                self.files[key] = self.write_book(f"{pair[0]}.{pair[1]}", offers)
+            else:
+                self.files.pop(key, None)  # An empty pair leaves the index
+        open_ids = [listing_id for _, listing_id in self.store.indexes.get(("status", "OPEN"), [])]
+        self.files[GLOBAL] = self.write_book(
+            "open-offers", [offer_shape(listing_id, self.store.listings[listing_id]) for listing_id in open_ids]
+        )
+
+        index = {
+            "contract": self.contract,
+            "version": self.store.version,
+            "generated_at": int(time.time()),
+            "global": self.files[GLOBAL],
+            "pairs": {key: entry for key, entry in sorted(self.files.items()) if key != GLOBAL},
+        }
+        atomic_write(self.out / "index.json", json.dumps(index, separators=(",", ":")).encode())
+
+        current_paths = {entry["path"] for entry in self.files.values()}
+        for stale in versions.iterdir():
+            relative = f"v/{stale.name}"
+            if relative not in current_paths and relative not in self.previous_paths and not stale.name.startswith("."):
+                stale.unlink()
+        self.previous_paths = current_paths
+        self.dirty.clear()
+        self.pending_events = 0
+        self.dirty_since = None
+        self.publishes += 1
+        return index
+
+    def write_book(self, name: str, offers: list) -> dict:
+        digest, data = encode_offers(offers, self.compress)
+        relative = f"v/{name}.{digest}.json" + (".gz" if self.compress else "")
+        path = self.out / relative
+        if not path.exists():  # Same content, same name: nothing to upload again
+            atomic_write(path, data)
+        return {"path": relative, "hash": digest, "count": len(offers)}
+
+    async def follow(self, events) -> None:
+        async for event in events:
+            self.on_event(event)
+
+    async def tick(self, interval: float = 1.0) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.maybe_publish()
+
+
+async def run(writer: SnapshotWriter, events_path: str) -> None:
+    await asyncio.gather(writer.follow(tail_events(events_path)), writer.tick())
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("state", nargs="?", help="state dump the listing store starts from")
+    parser.add_argument("--graphql", help="read the open listings from this GraphQL endpoint instead of a dump")
+    parser.add_argument("--events", help="JSON-lines event log to follow; without it, publish once and exit")
+    parser.add_argument("--contract", default="con_otc")
+    parser.add_argument("--out", default="book")
+    parser.add_argument("--every-events", type=int, default=EVERY_EVENTS)
+    parser.add_argument("--every-seconds", type=float, default=EVERY_SECONDS)
+    parser.add_argument("--plain", action="store_true", help="write uncompressed .json, for hosts that compress")
+    args = parser.parse_args(argv)
+    if bool(args.state) == bool(args.graphql):
+        parser.error("pass either a state dump or --graphql")
+
+    store = ListingStore()
+    try:
+        store.load(args.state or fetch_open_listings(args.graphql, args.contract), args.contract)
+    except OSError as error:  # URLError included: the node or the dump could not be read
+        print(f"could not load the open listings: {error}", file=sys.stderr)
+        return 1
+    writer = SnapshotWriter(store, args.out, args.contract, args.every_events, args.every_seconds,
+                            compress=not args.plain)
+    index = writer.publish()
+    print(f"{index['global']['count']} open listings in {len(index['pairs'])} pairs written to {args.out}")
+    if args.events:
+        try:
+            asyncio.run(run(writer, args.events))
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
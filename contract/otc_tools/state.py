@@ -0,0 +1,105 @@
+"""Read OTC state dumps and event logs.
+
+A state dump is either JSON lines of ``{"key": ..., "value": ...}`` (the
+node shape GraphQL ``allStates`` returns), a JSON array of such nodes, a
+saved GraphQL response, or a JSON object mapping keys to values. An event
+log is JSON lines of events as the executor emits them. Values may carry
+contracting's JSON tags (``__fixed__``, ``__time__``, ``__big_int__``);
+``decode_value`` turns those back into Decimal, datetime and int.
+"""
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from otc_tools.model import AMOUNT_SCALE
+
+
+def decode_value(value):
+    if isinstance(value, dict):
+        if "__fixed__" in value:
+            return Decimal(value["__fixed__"])
+        if "__time__" in value:
+            return datetime(*value["__time__"])
+        if "__big_int__" in value:
+            return int(value["__big_int__"])
+        return {key: decode_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode_value(item) for item in value]
+    return value
+
+
+def split_key(key: str) -> tuple:
+    """``"con_otc.earned_fees:con_token_a:0"`` -> ``("con_otc", "earned_fees", ["con_token_a", "0"])``."""
+    head, *arguments = key.split(":")
+    contract, _, variable = head.partition(".")
+    return contract, variable, arguments
+
+
+def iter_state(source):
+    """Yield decoded ``(key, value)`` pairs from a dump path, a dict or an iterable of nodes."""
+    if isinstance(source, dict):
+        nodes = source.items()
+    elif isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+        nodes = _read_nodes(source)
+    else:
+        nodes = source
+    for node in nodes:
+        key, value = (node["key"], node["value"]) if isinstance(node, dict) else node
+        if isinstance(value, str) and value[:1] in "{[":
+            value = json.loads(value)  # Some indexers return values as JSON text
+        yield key, decode_value(value)
+
+
+def _read_nodes(path):
+    with open(path) as handle:
+        first = handle.read(1)
+        handle.seek(0)
+        if first == "{" and not str(path).endswith(".jsonl"):
+            document = json.load(handle)
+            if "data" in document:
+                yield from document["data"]["allStates"]["nodes"]
+            else:
+                yield from document.items()
+        elif first == "[":
+            yield from json.load(handle)
+        else:
+            for line in handle:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def dump_state(client, prefixes, path) -> int:
+    """Write every key under ``prefixes`` (e.g. ``["con_otc.", "con_token_a.balances"]``) as a JSON-lines dump."""
+    from contracting.storage.encoder import encode
+
+    count = 0
+    with open(path, "w") as handle:
+        for prefix in prefixes:
+            for key, value in sorted(client.raw_driver.items(prefix).items()):
+                handle.write('{"key": %s, "value": %s}\n' % (json.dumps(key), encode(value)))
+                count += 1
+    return count
+
+
+def iter_listings(source, contract: str):
+    """Yield ``(listing_id, listing)`` for every ``otc_listing`` record of ``contract``."""
+    prefix = f"{contract}.otc_listing:"
+    for key, value in iter_state(source):
+        if key.startswith(prefix) and isinstance(value, dict):
+            yield key[len(prefix):], value
+
+
+def iter_events(path, contract: str = None):
+    """Yield events from a JSON-lines event log, optionally only those ``contract`` emitted."""
+    with open(path) as handle:
+        for line in handle:
+            if not line.strip():
+                continue
+            event = decode_value(json.loads(line))
+            if contract is None or event.get("contract") == contract:
+                yield event
+
+
+def amount_units(amount) -> int:
+    """Event amounts are decimals; the columnar tools keep them as fixed-point units."""
+    return int(Decimal(str(amount)) * AMOUNT_SCALE)
@@ -0,0 +1,213 @@
+"""Operation traces: portable, replayable sequences of contract calls.
+
+A trace is a JSON-lines file with one call per line. Amounts are tagged as
+``{"$decimal": "1.5"}`` so they replay as ContractingDecimal, and a listing id
+returned by an earlier call is referenced as ``{"$result": <call index>}``, so
+the same trace replays against deployments that generate different ids.
+The contract name ``"otc"`` stands for whichever OTC deployment is replaying.
+A trace whose path ends in ``.gz`` is gzip compressed.
+
+``TraceRecorder`` captures a trace from live ContractingClient calls, with
+each call's status and stamps as recorded, for ``otc_tools.replay``.
+"""
+import gzip
+import json
+import random
+from dataclasses import asdict, dataclass, field
+from decimal import Decimal
+
+OTC = "otc"
+
+
+@dataclass
+class Call:
+    contract: str  # OTC or a token contract name
+    function: str
+    signer: str
+    kwargs: dict = field(default_factory=dict)
+    advance: int = 1  # Seconds the block clock moves before this call
+    expect: dict = None  # {"status", "stamps"} as recorded, when the trace was captured from real calls
+
+    def resolve(self, results: list, contract_decimal) -> dict:
+        """Concrete kwargs for this replay: decimals wrapped, references looked up in ``results``."""
+        return {name: _resolve(value, results, contract_decimal) for name, value in self.kwargs.items()}
+
+
+def _resolve(value, results, contract_decimal):
+    if isinstance(value, dict) and "$decimal" in value:
+        return contract_decimal(value["$decimal"])
+    if isinstance(value, dict) and "$result" in value:
+        return results[value["$result"]]
+    if isinstance(value, list):
+        return [_resolve(item, results, contract_decimal) for item in value]
+    return value
+
+
+def amount(value) -> dict:
+    return {"$decimal": str(Decimal(str(value)))}
+
+
+def result_of(index: int) -> dict:
+    return {"$result": index}
+
+
+def replay_call(market, call: Call, results: list) -> dict:
+    """Run one call against ``market`` and return the executor's full output.
+
+    The returned dict always has status_code, result, stamps_used, writes and events;
+    a failed call's result is the exception it raised.
+    """
+    from contracting.stdlib.bridge.decimal import ContractingDecimal
+
+    handle = market.otc if call.contract == OTC else market.tokens[call.contract]
+    kwargs = call.resolve(results, ContractingDecimal)
+    environment = market.tick(call.advance)
+    try:
+        output = getattr(handle, call.function)(
+            signer=call.signer, environment=environment, return_full_output=True, **kwargs
+        )
+    except Exception as error:
+        output = {"status_code": 1, "result": error}
+    for key, empty in (("stamps_used", 0), ("writes", {}), ("events", [])):
+        output.setdefault(key, empty)
+    return output
+
+
+def _open(path, mode: str):
+    return gzip.open(path, mode + "t") if str(path).endswith(".gz") else open(path, mode)
+
+
+def dump_trace(path, calls) -> None:
+    with _open(path, "w") as handle:
+        for call in calls:
+            record = asdict(call)
+            if record["expect"] is None:
+                del record["expect"]
+            handle.write(json.dumps(record, sort_keys=True, separators=(",", ":")) + "\n")
+
+
+def load_trace(path) -> list:
+    with _open(path, "r") as handle:
+        return [Call(**json.loads(line)) for line in handle if line.strip()]
+
+
+def _moment(environment):
+    now = (environment or {}).get("now")
+    return getattr(now, "_datetime", now)  # contracting's Datetime wraps a datetime
+
+
+class TraceRecorder:
+    """Records calls made through ``wrap``-ed contract handles.
+
+    Amounts are tagged as decimals, arguments equal to an id an earlier recorded call returned
+    become ``$result`` references, and the block clock's movement between calls becomes ``advance``.
+    """
+
+    def __init__(self, otc_name: str):
+        self.otc_name = otc_name
+        self.calls = []
+        self.result_index = {}  # string result -> index of the call that returned it
+        self.last_moment = None
+
+    def wrap(self, handle):
+        return _RecordingContract(self, handle)
+
+    def encode(self, value):
+        if type(value).__name__ in ("ContractingDecimal", "Decimal", "float"):
+            return amount(value)
+        if isinstance(value, str) and value in self.result_index:
+            return result_of(self.result_index[value])
+        if isinstance(value, (list, tuple)):
+            return [self.encode(item) for item in value]
+        if isinstance(value, dict):
+            return {key: self.encode(item) for key, item in value.items()}
+        return value
+
+    def record(self, contract: str, function: str, signer: str, environment, kwargs: dict, output: dict) -> None:
+        moment = _moment(environment)
+        advance = 1
+        if moment is not None:
+            if self.last_moment is not None:
+                advance = max(0, int((moment - self.last_moment).total_seconds()))
+            self.last_moment = moment
+        self.calls.append(Call(
+            contract=OTC if contract == self.otc_name else contract,
+            function=function,
+            signer=signer,
+            kwargs={name: self.encode(value) for name, value in kwargs.items()},
+            advance=advance,
+            expect={"status": output["status_code"], "stamps": output.get("stamps_used", 0)},
+        ))
+        if output["status_code"] == 0 and isinstance(output["result"], str):
+            self.result_index.setdefault(output["result"], len(self.calls) - 1)
+
+    def dump(self, path) -> None:
+        dump_trace(path, self.calls)
+
+
+class _RecordingContract:
+    def __init__(self, recorder: TraceRecorder, handle):
+        self._recorder = recorder
+        self._handle = handle
+
+    def __getattr__(self, function: str):
+        target = getattr(self._handle, function)
+        if not callable(target):
+            return target  # State accessors such as otc_listing pass through unrecorded
+
+        def call(signer: str, environment: dict = None, **kwargs):
+            try:
+                output = target(signer=signer, environment=environment or {}, return_full_output=True, **kwargs)
+            except Exception as error:
+                output = {"status_code": 1, "result": error}
+            self._recorder.record(self._handle.name, function, signer, environment, kwargs, output)
+            if output["status_code"] != 0:
+                raise output["result"] if isinstance(output["result"], Exception) else AssertionError(output["result"])
+            return output["result"]
+
+        return call
+
+
+def trace_participants(calls, owner: str) -> tuple:
+    """Actors (every signer but the owner) and token names a trace touches, for setting up a replay."""
+    actors, tokens = set(), set()
+    for call in calls:
+        if call.signer != owner:
+            actors.add(call.signer)
+        if call.contract != OTC:
+            tokens.add(call.contract)
+        for name in ("offer_token", "take_token"):
+            if name in call.kwargs:
+                tokens.add(call.kwargs[name])
+        tokens.update(call.kwargs.get("token_list", []))
+    return sorted(actors), sorted(tokens)
+
+
+def generate_trace(seed: int, steps: int, actors, token_names, owner: str) -> list:
+    """A random list / take / cancel / adjust_fee / withdraw mix written in con_otc_v3 terms.
+
+    Actors are expected to be funded and to have approved the OTC contract up front.
+    """
+    rng = random.Random(seed)
+    calls = []
+    listings = []  # (call index, maker) of every list_offer so far
+    for _ in range(steps):
+        roll = rng.random()
+        if roll < 0.45 or not listings:
+            offer_token, take_token = rng.sample(list(token_names), 2)
+            calls.append(Call(OTC, "list_offer", rng.choice(actors), {
+                "offer_token": offer_token, "offer_amount": amount(rng.randint(1, 50_000) / 100),
+                "take_token": take_token, "take_amount": amount(rng.randint(1, 50_000) / 100),
+            }))
+            listings.append((len(calls) - 1, calls[-1].signer))
+        elif roll < 0.75:
+            index, _ = rng.choice(listings)
+            calls.append(Call(OTC, "take_offer", rng.choice(actors), {"listing_id": result_of(index)}))
+        elif roll < 0.9:
+            index, maker = rng.choice(listings)
+            calls.append(Call(OTC, "cancel_offer", maker, {"listing_id": result_of(index)}))
+        elif roll < 0.95:
+            calls.append(Call(OTC, "adjust_fee", owner, {"trading_fee_bps": rng.randint(0, 1000)}))
+        else:
+            calls.append(Call(OTC, "withdraw", owner, {"token_list": list(token_names)}))
+    return calls
@@ -0,0 +1,107 @@
+"""Stamp cost of con_token's batched transfers against one call per recipient.
+
+OTC settlement pays many accounts in one token: ``take_best`` and
+``list_offer(auto_cross=True)`` pay every filled maker, and
+``clear_epoch`` pays every filled batch order. Today that is one
+``transfer`` per recipient, and each call reads and writes the payer's
+balance again. ``transfer_many`` and ``transfer_from_many`` debit the
+payer once and credit every recipient in one call.
+
+For each recipient count this measures, on a metering client:
+- the stamps and wall time of N single calls;
+- the stamps and wall time of one batched call.
+Every measurement pays fresh recipients, so both sides write the same new
+keys.
+
+    python -m otc_tools.transfer_bench --recipients 1 10 50
+"""
+import argparse
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass
+
+from otc_tools.deploy import OWNER, fund_stamps, new_client, read_source
+
+TOKEN = "con_bench_token"
+PAYER = "bench_payer"
+SPENDER = "bench_spender"  # Pulls from PAYER with an allowance, as the OTC contract does
+
+
+@dataclass
+class BenchRow:
+    function: str  # transfer or transfer_from
+    recipients: int
+    looped_stamps: int
+    batched_stamps: int
+    looped_seconds: float
+    batched_seconds: float
+
+    @property
+    def saved(self) -> float:
+        return 1 - self.batched_stamps / self.looped_stamps if self.looped_stamps else 0.0
+
+
+def timed(call, **kwargs) -> tuple:
+    started = time.perf_counter()
+    output = call(return_full_output=True, **kwargs)
+    assert output["status_code"] == 0, output["result"]
+    return output["stamps_used"], time.perf_counter() - started
+
+
+def run_bench(recipient_counts=(1, 10, 50), amount: str = "1.5") -> list:
+    from contracting.stdlib.bridge.decimal import ContractingDecimal
+
+    storage_home = tempfile.mkdtemp(prefix="otc_transfer_bench_")
+    client = new_client(storage_home, metering=True)
+    try:
+        fund_stamps(client, [OWNER, PAYER, SPENDER])
+        client.submit(read_source("con_token.py"), name=TOKEN,
+                      constructor_args={"vk": OWNER, "name": "Bench", "symbol": "BNCH"}, signer=OWNER)
+        token = client.get_contract(TOKEN)
+        token.transfer(amount=ContractingDecimal("10000000"), to=PAYER, signer=OWNER)
+        token.approve(amount=ContractingDecimal("10000000"), to=SPENDER, signer=PAYER)
+        value = ContractingDecimal(amount)
+
+        rows = []
+        for count in recipient_counts:
+            for function in ("transfer", "transfer_from"):
+                def fresh(side):
+                    return [f"bench_{function}_{side}_{count}_{index}" for index in range(count)]
+
+                signer, extra = (PAYER, {}) if function == "transfer" else (SPENDER, {"main_account": PAYER})
+                looped_stamps, looped_seconds = 0, 0.0
+                for recipient in fresh("looped"):
+                    stamps, seconds = timed(getattr(token, function), signer=signer, amount=value, to=recipient, **extra)
+                    looped_stamps += stamps
+                    looped_seconds += seconds
+                batched_stamps, batched_seconds = timed(
+                    getattr(token, f"{function}_many"), signer=signer,
+                    recipients={recipient: value for recipient in fresh("batched")}, **extra,
+                )
+                rows.append(BenchRow(function, count, looped_stamps, batched_stamps, looped_seconds, batched_seconds))
+        return rows
+    finally:
+        client.flush()
+        shutil.rmtree(storage_home, ignore_errors=True)
+
+
+def format_rows(rows) -> str:
+    lines = [f"{'function':<16}{'recipients':>11}{'looped':>10}{'batched':>10}{'saved':>8}{'looped ms':>11}{'batched ms':>12}"]
+    for row in rows:
+        lines.append(f"{row.function:<16}{row.recipients:>11}{row.looped_stamps:>10}{row.batched_stamps:>10}"
+                     f"{row.saved:>8.1%}{row.looped_seconds * 1000:>11.1f}{row.batched_seconds * 1000:>12.1f}")
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recipients", type=int, nargs="+", default=[1, 10, 50])
+    args = parser.parse_args(argv)
+
+    print(format_rows(run_bench(args.recipients)))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,7 +1,39 @@
+import asyncio
+import base64
+import gc
+import gzip
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import struct
+import tempfile
 import unittest
+from datetime import datetime, timedelta
+from decimal import Decimal as PyDecimal
 from contracting.client import ContractingClient
 from contracting.stdlib.bridge.time import Datetime
 from contracting.stdlib.bridge.decimal import ContractingDecimal as Decimal
+from otc_tools.api import ReadService
+from otc_tools.book import ClientEvents, ListingStore
+from otc_tools.deploy import OWNER, deploy_market, new_client, read_source
+from otc_tools.diff import run_differential
+from otc_tools.estimate import estimate_many, prepare
+from otc_tools.export import export, load_npz
+from otc_tools.feed import BookFeed
+from otc_tools.fuzz import FuzzConfig, run_campaigns
+from otc_tools.load import LoadConfig, run_load
+from otc_tools.migrate import migrate, open_listings
+from otc_tools.ohlcv import OhlcvAggregator
+from otc_tools.profiler import StateProfiler
+from otc_tools.reconcile import format_report, reconcile
+from otc_tools.replay import compare_baseline, replay_trace
+from otc_tools.rfq import Quote, sign_quote, verify_quote
+from otc_tools.snapshots import SnapshotWriter
+from otc_tools.state import dump_state, iter_state
+from otc_tools.trace import OTC, Call, TraceRecorder, generate_trace, load_trace
+from otc_tools.transfer_bench import run_bench
 
 # Define fixed date for deterministic tests
 TEST_DATETIME = Datetime(year=2024, month=6, day=20, hour=10, minute=0, second=0)
@@ -28,6 +60,9 @@ class TestOtcContract(unittest.TestCase):
 
     initial_balance = Decimal("10000.0")
     default_fee_percent = Decimal("0.5")
+    default_fee_bps = 50
+    event_schema_version = 2
+    amount_scale = 10 ** 8 # Listings store amounts as integer units of 10 ** -8
 
     def setUp(self):
         self.client = ContractingClient()
@@ -99,6 +134,10 @@ class TestOtcContract(unittest.TestCase):
         # FIX: Compare ContractingDecimal with Decimal directly
         self.assertEqual(token_contract.balances[vk, spender_vk], amount)
 
+    def _units(self, amount) -> int:
+        # Fixed-point integer form the OTC contract stores amounts in
+        return int(PyDecimal(str(amount)) * self.amount_scale)
+
     # Helper to get balance - returns ContractingDecimal or Decimal(0)
     def _get_balance_contracting_or_zero(self, token_contract, vk: str):
         balance = token_contract.balance_of(address=vk)
@@ -110,7 +149,7 @@ class TestOtcContract(unittest.TestCase):
     def test_01_init_state(self):
         self.assertEqual(self.otc_contract.owner.get(), self.otc_owner_vk)
         # FIX: Compare ContractingDecimal with Decimal directly
-        self.assertEqual(self.otc_contract.fee.get(), self.default_fee_percent)
+        self.assertEqual(self.otc_contract.fee.get(), self.default_fee_bps)
 
     def test_02_list_offer_happy_path(self):
         offer_amount = Decimal("100.0")
@@ -141,10 +180,13 @@ class TestOtcContract(unittest.TestCase):
         self.assertEqual(offer["maker"], self.maker_vk)
         self.assertEqual(offer["offer_token"], self.token_a_name)
         # FIX: Compare ContractingDecimal/Decimal from state with Decimal directly
-        self.assertEqual(offer["offer_amount"], offer_amount)
+        self.assertEqual(offer["offer_amount"], self._units(offer_amount))
         self.assertEqual(offer["take_token"], self.token_b_name)
-        self.assertEqual(offer["take_amount"], take_amount)
-        self.assertEqual(offer["fee"], self.default_fee_percent) # Compare fee
+        self.assertEqual(offer["take_amount"], self._units(take_amount))
+        self.assertEqual(offer["price"], str(5 * 10 ** 17).zfill(40)) # 0.5 take per offer at 18 decimals
+        self.assertEqual(offer["fee"], self.default_fee_bps) # Compare fee
+        self.assertEqual(offer["maker_fee"], self._units(maker_fee)) # Fee amounts are fixed at list time
+        self.assertEqual(offer["taker_fee"], self._units(take_amount / Decimal("100.0") * self.default_fee_percent))
         self.assertEqual(offer["status"], "OPEN")
         self.assertIsNone(offer["taker"])
 
@@ -158,6 +200,18 @@ class TestOtcContract(unittest.TestCase):
             contract_initial_balance + required_approval,
         )
 
+    def test_02b_list_offer_rejects_sub_unit_amounts(self):
+        self._approve_transfer(self.token_a, self.maker_vk, self.otc_contract_name, Decimal("200.0"))
+        with self.assertRaisesRegex(AssertionError, "Amounts support at most 8 decimal places"):
+            self.otc_contract.list_offer(
+                signer=self.maker_vk,
+                environment={**self.environment, "now": TEST_DATETIME},
+                offer_token=self.token_a_name,
+                offer_amount=Decimal("100.000000001"),
+                take_token=self.token_b_name,
+                take_amount=Decimal("50.0"),
+            )
+
     def test_03_list_offer_negative_amounts(self):
         required_approval = Decimal("100.5")
         self._approve_transfer(self.token_a, self.maker_vk, self.otc_contract_name, required_approval)
@@ -300,7 +354,7 @@ class TestOtcContract(unittest.TestCase):
     def test_09_take_offer_maker_is_taker(self):
         offer_amount = Decimal("100.0")
         take_amount = Decimal("50.0")
-        current_fee_percent = self.otc_contract.fee.get()
+        current_fee_percent = self.otc_contract.fee.get() / Decimal("100.0")
         maker_fee = offer_amount / Decimal("100.0") * current_fee_percent
         taker_fee_for_maker = take_amount / Decimal("100.0") * current_fee_percent
         
@@ -430,38 +484,33 @@ class TestOtcContract(unittest.TestCase):
 
     # Example for test_14
     def test_14_adjust_fee_happy_path(self):
-        new_fee = Decimal("1.5")
-        self.otc_contract.adjust_fee(signer=self.otc_owner_vk, trading_fee=new_fee) # Pass Decimal
-        # FIX: Direct comparison
+        new_fee = 150 # 1.5% in basis points
+        self.otc_contract.adjust_fee(signer=self.otc_owner_vk, trading_fee_bps=new_fee)
         self.assertEqual(self.otc_contract.fee.get(), new_fee)
 
-        self.otc_contract.adjust_fee(signer=self.otc_owner_vk, trading_fee=Decimal("0.0"))
-        # FIX: Direct comparison
-        self.assertEqual(self.otc_contract.fee.get(), Decimal("0.0"))
-        self.otc_contract.adjust_fee(signer=self.otc_owner_vk, trading_fee=Decimal("10.0"))
-        # FIX: Direct comparison
-        self.assertEqual(self.otc_contract.fee.get(), Decimal("10.0"))
+        self.otc_contract.adjust_fee(signer=self.otc_owner_vk, trading_fee_bps=0)
+        self.assertEqual(self.otc_contract.fee.get(), 0)
+        self.otc_contract.adjust_fee(signer=self.otc_owner_vk, trading_fee_bps=1000)
+        self.assertEqual(self.otc_contract.fee.get(), 1000)
 
     def test_15_adjust_fee_not_owner(self):
         original_fee = self.otc_contract.fee.get()
-        new_fee = Decimal("2.0")
+        new_fee = 200
         
         with self.assertRaisesRegex(AssertionError, "Only owner can call this method!"): # CORRECTED message
-            self.otc_contract.adjust_fee(signer=self.maker_vk, trading_fee=new_fee) # Environment not needed
+            self.otc_contract.adjust_fee(signer=self.maker_vk, trading_fee_bps=new_fee) # Environment not needed
         
         self.assertEqual(self.otc_contract.fee.get(), original_fee) 
         
         self.assertEqual(self.otc_contract.fee.get(), original_fee) 
 
     def test_16_adjust_fee_invalid_value(self):
-        # FIX: Update expected assertion message
-        with self.assertRaisesRegex(AssertionError, "Fee must be between 0.0 and 10.0 percent"):
-            self.otc_contract.adjust_fee(signer=self.otc_owner_vk, trading_fee=Decimal("-0.1"))
-        # FIX: Update expected assertion message
-        with self.assertRaisesRegex(AssertionError, "Fee must be between 0.0 and 10.0 percent"):
-            self.otc_contract.adjust_fee(signer=self.otc_owner_vk, trading_fee=Decimal("10.1"))
+        with self.assertRaisesRegex(AssertionError, "Fee must be between 0 and 1000 basis points"):
+            self.otc_contract.adjust_fee(signer=self.otc_owner_vk, trading_fee_bps=-10)
+        with self.assertRaisesRegex(AssertionError, "Fee must be between 0 and 1000 basis points"):
+            self.otc_contract.adjust_fee(signer=self.otc_owner_vk, trading_fee_bps=1010)
         # FIX: Direct comparison
-        self.assertEqual(self.otc_contract.fee.get(), self.default_fee_percent)
+        self.assertEqual(self.otc_contract.fee.get(), self.default_fee_bps)
 
     # Example for test_17
     def test_17_withdraw_happy_path(self):
@@ -944,7 +993,7 @@ class TestOtcContract(unittest.TestCase):
         token_a_contract = self.token_a # Attacker offers this, it will be the target of theft by exploit_contract
         token_a_name = self.token_a_name
         
-        otc_fee_percent = safeguarded_otc.fee.get()
+        otc_fee_percent = safeguarded_otc.fee.get() / Decimal("100.0") # Basis points to percent
 
         # --- Phase 1: Fund Vulnerable OTC with Token A (Simulates general liquidity) ---
         otc_initial_token_a_liquidity = Decimal("500.0")
@@ -1035,7 +1084,7 @@ class TestOtcContract(unittest.TestCase):
         )
 
         # 2. Verify initial guard state (should be False)
-        self.assertEqual(safeguarded_otc.reentrancyGuardActive.get(), False, "Guard should be initially false.")
+        self.assertEqual(safeguarded_otc.reentrancyGuardActive[self.maker_vk], False, "Guard should be initially false.")
 
         # 3. Prepare for a call to list_offer that will fail an assertion
         #    AFTER the guard is set but BEFORE it's released.
@@ -1065,13 +1114,13 @@ class TestOtcContract(unittest.TestCase):
 
         # 5. Verify guard state AFTER the failed transaction
         # Due to transaction atomicity, the reentrancyGuardActive should have been rolled back to False.
-        self.assertEqual(safeguarded_otc.reentrancyGuardActive.get(), False,
+        self.assertEqual(safeguarded_otc.reentrancyGuardActive[self.maker_vk], False,
                          "Guard should be false after a failed transaction due to atomicity.")
 
         # 6. Verify contract usability by making a successful call
         # This proves the contract is not locked.
         valid_offer_amount = Decimal("100.0")
-        required_approval_for_valid_offer = valid_offer_amount + (valid_offer_amount * safeguarded_otc.fee.get() / Decimal("100.0"))
+        required_approval_for_valid_offer = valid_offer_amount + (valid_offer_amount * safeguarded_otc.fee.get() / Decimal("10000.0"))
         self._approve_transfer(self.token_a, self.maker_vk, "con_otc_safeguarded_for_recovery_test", required_approval_for_valid_offer)
 
         environment_for_success = {"chain_id": "test-chain", "now": TEST_DATETIME_PLUS_1SEC}
@@ -1089,9 +1138,21 @@ class TestOtcContract(unittest.TestCase):
             self.fail(f"Subsequent successful call failed, contract might be locked or another issue: {e}")
 
         # 7. Verify guard state again after a successful transaction (should also be False)
-        self.assertEqual(safeguarded_otc.reentrancyGuardActive.get(), False,
+        self.assertEqual(safeguarded_otc.reentrancyGuardActive[self.maker_vk], False,
                          "Guard should be false after a successful transaction.")
 
+    def test_26b_guard_is_scoped_to_signer(self):
+        # A guard held by another signer's transaction must not block unrelated trades
+        self.client.set_var(
+            contract=self.otc_contract_name, variable="reentrancyGuardActive",
+            arguments=[self.other_vk], value=True
+        )
+        listing_id = self._list(self.maker_vk, self.token_a_name, Decimal("100.0"), self.token_b_name, Decimal("50.0"), TEST_DATETIME)
+        self.assertIsNotNone(listing_id)
+
+        with self.assertRaisesRegex(AssertionError, "Contract is busy, cannot adjust fee now."):
+            self.otc_contract.adjust_fee(signer=self.other_vk, trading_fee_bps=100)
+
     # Miscellaneous ------------------------------------------------------------------------------------------
 
     def test_27_event_emission_list_offer(self):
@@ -1106,8 +1167,8 @@ class TestOtcContract(unittest.TestCase):
         # 2. Setup for list_offer
         offer_amount = Decimal("100.0")
         take_amount = Decimal("50.0")
-        current_fee_percent = safeguarded_otc.fee.get()
-        maker_fee = offer_amount / Decimal("100.0") * current_fee_percent
+        current_fee_bps = safeguarded_otc.fee.get()
+        maker_fee = offer_amount * current_fee_bps / Decimal("10000.0")
         required_approval = offer_amount + maker_fee
 
         self._approve_transfer(self.token_a, self.maker_vk, safeguarded_otc_contract_name, required_approval)
@@ -1150,32 +1211,1013 @@ class TestOtcContract(unittest.TestCase):
         self.assertEqual(emitted_event['signer'], self.maker_vk) # Signer of this specific tx
         self.assertEqual(emitted_event['caller'], self.maker_vk) # Caller of list_offer
 
-        # Verify indexed data
-        self.assertIn('id', emitted_event['data_indexed'])
-        self.assertEqual(emitted_event['data_indexed']['id'], listing_id_from_result)
-        self.assertIn('taker', emitted_event['data_indexed'])
-        self.assertEqual(emitted_event['data_indexed']['taker'], "None") # As per OfferEvent params
-        self.assertIn('status', emitted_event['data_indexed'])
-        self.assertEqual(emitted_event['data_indexed']['status'], "OPEN")
+        # Verify indexed data: the fields subscribers filter on
+        self.assertEqual(
+            emitted_event['data_indexed'],
+            {'maker': self.maker_vk, 'offer_token': self.token_a_name, 'take_token': self.token_b_name},
+        )
 
         # Verify non-indexed data
-        self.assertIn('maker', emitted_event['data'])
-        self.assertEqual(emitted_event['data']['maker'], self.maker_vk)
-        self.assertIn('offer_token', emitted_event['data'])
-        self.assertEqual(emitted_event['data']['offer_token'], self.token_a_name)
-        self.assertIn('offer_amount', emitted_event['data'])
+        self.assertEqual(emitted_event['data']['v'], self.event_schema_version)
+        self.assertEqual(emitted_event['data']['id'], listing_id_from_result)
         self.assertEqual(emitted_event['data']['offer_amount'], offer_amount)
-        self.assertIn('take_token', emitted_event['data'])
-        self.assertEqual(emitted_event['data']['take_token'], self.token_b_name)
-        self.assertIn('take_amount', emitted_event['data'])
         self.assertEqual(emitted_event['data']['take_amount'], take_amount)
-        self.assertIn('date_listed', emitted_event['data'])
+        self.assertEqual(emitted_event['data']['price'], str(5 * 10 ** 17).zfill(40))
         self.assertEqual(emitted_event['data']['date_listed'], str(TEST_DATETIME))
-        self.assertIn('fee', emitted_event['data'])
-        self.assertEqual(emitted_event['data']['fee'], current_fee_percent)
+        self.assertEqual(emitted_event['data']['fee'], current_fee_bps)
+        self.assertNotIn('status', emitted_event['data'])
 
         # 6. Sanity check: verify the returned result is still the listing ID
         self.assertIsInstance(listing_id_from_result, str)
 
+    # RFQ ----------------------------------------------------------------------------------------------------
+
+    def _signed_quote(self, nonce: int, expiry: datetime = datetime(2024, 6, 20, 11, 0, 0)):
+        from nacl.signing import SigningKey
+
+        signing_key = SigningKey.generate()
+        rfq_maker_vk = signing_key.verify_key.encode().hex()
+        quote = Quote(
+            contract=self.otc_contract_name,
+            maker=rfq_maker_vk,
+            offer_token=self.token_a_name,
+            offer_amount="100.0",
+            take_token=self.token_b_name,
+            take_amount="50.0",
+            expiry=expiry,
+            nonce=nonce,
+        )
+        return quote, sign_quote(quote, signing_key.encode().hex())
+
+    @unittest.skipUnless(importlib.util.find_spec("nacl"), "PyNaCl is not installed")
+    def test_28_settle_quote_happy_path(self):
+        quote, signature = self._signed_quote(nonce=7)
+        self.assertTrue(verify_quote(quote, signature))
+
+        offer_amount = Decimal(quote.offer_amount)
+        take_amount = Decimal(quote.take_amount)
+        maker_fee = offer_amount / Decimal("100.0") * self.default_fee_percent
+        taker_fee = take_amount / Decimal("100.0") * self.default_fee_percent
+
+        self._fund_account(self.token_a, quote.maker)
+        self._approve_transfer(self.token_a, quote.maker, self.otc_contract_name, offer_amount + maker_fee)
+        self._approve_transfer(self.token_b, self.taker_vk, self.otc_contract_name, take_amount + taker_fee)
+        taker_token_b_bal = self._get_balance_contracting_or_zero(self.token_b, self.taker_vk)
+
+        self.otc_contract.settle_quote(
+            signer=self.taker_vk,
+            environment={**self.environment, "now": TEST_DATETIME},
+            **quote.settle_kwargs(signature)
+        )
+
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_a, self.taker_vk), offer_amount)
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_b, quote.maker), take_amount)
+        self.assertEqual(
+            self._get_balance_contracting_or_zero(self.token_b, self.taker_vk),
+            taker_token_b_bal - take_amount - taker_fee,
+        )
+        self.assertEqual(self.otc_contract.view_earned_fees(token=self.token_a_name), maker_fee)
+        self.assertEqual(self.otc_contract.view_earned_fees(token=self.token_b_name), taker_fee)
+        self.assertTrue(self.otc_contract.is_quote_nonce_used(maker=quote.maker, nonce=7))
+        self.assertFalse(self.otc_contract.is_quote_nonce_used(maker=quote.maker, nonce=8))
+
+    @unittest.skipUnless(importlib.util.find_spec("nacl"), "PyNaCl is not installed")
+    def test_29_settle_quote_rejects_replay_tamper_and_expiry(self):
+        quote, signature = self._signed_quote(nonce=300)
+        self._fund_account(self.token_a, quote.maker)
+        self._approve_transfer(self.token_a, quote.maker, self.otc_contract_name, Decimal("1000.0"))
+        self._approve_transfer(self.token_b, self.taker_vk, self.otc_contract_name, Decimal("1000.0"))
+        environment = {**self.environment, "now": TEST_DATETIME}
+
+        tampered = quote.settle_kwargs(signature)
+        tampered["take_amount"] = "1.0"
+        with self.assertRaisesRegex(AssertionError, "Invalid quote signature"):
+            self.otc_contract.settle_quote(signer=self.taker_vk, environment=environment, **tampered)
+
+        with self.assertRaisesRegex(AssertionError, "Quote expired"):
+            self.otc_contract.settle_quote(
+                signer=self.taker_vk,
+                environment={**self.environment, "now": Datetime(year=2024, month=6, day=20, hour=12)},
+                **quote.settle_kwargs(signature)
+            )
+
+        self.otc_contract.settle_quote(signer=self.taker_vk, environment=environment, **quote.settle_kwargs(signature))
+        with self.assertRaisesRegex(AssertionError, "Quote nonce already used"):
+            self.otc_contract.settle_quote(signer=self.taker_vk, environment=environment, **quote.settle_kwargs(signature))
+
+        # Makers can burn nonces of quotes they no longer want filled
+        cancelled, cancelled_signature = self._signed_quote(nonce=301)
+        self.otc_contract.cancel_quote_nonces(signer=cancelled.maker, nonces=[301])
+        self._fund_account(self.token_a, cancelled.maker)
+        self._approve_transfer(self.token_a, cancelled.maker, self.otc_contract_name, Decimal("1000.0"))
+        with self.assertRaisesRegex(AssertionError, "Quote nonce already used"):
+            self.otc_contract.settle_quote(
+                signer=self.taker_vk, environment=environment, **cancelled.settle_kwargs(cancelled_signature)
+            )
+
+    # Order book index ----------------------------------------------------------------------------------------
+
+    def _list(self, maker_vk, offer_token, offer_amount, take_token, take_amount, now, **kwargs):
+        token = self.token_a if offer_token == self.token_a_name else self.token_b
+        self._approve_transfer(token, maker_vk, self.otc_contract_name, offer_amount * Decimal("2.0"))
+        return self.otc_contract.list_offer(
+            signer=maker_vk,
+            environment={**self.environment, "now": now},
+            offer_token=offer_token, offer_amount=offer_amount,
+            take_token=take_token, take_amount=take_amount,
+            **kwargs
+        )
+
+    def test_30_book_index_orders_listings_by_price(self):
+        cheap_id = self._list(self.maker_vk, self.token_a_name, Decimal("100.0"), self.token_b_name, Decimal("40.0"), TEST_DATETIME)
+        dear_id = self._list(self.maker_vk, self.token_a_name, Decimal("100.0"), self.token_b_name, Decimal("60.0"), TEST_DATETIME_PLUS_1SEC)
+        mid_id = self._list(self.maker_vk, self.token_a_name, Decimal("100.0"), self.token_b_name, Decimal("50.0"), TEST_DATETIME_LIST_EXPLOIT)
+
+        self.assertEqual(self.otc_contract.book_head[self.token_a_name, self.token_b_name], cheap_id)
+        self.assertEqual(self.otc_contract.book_next[cheap_id], mid_id)
+        self.assertEqual(self.otc_contract.book_next[mid_id], dear_id)
+        self.assertEqual(
+            self.otc_contract.find_position_hint(
+                offer_token=self.token_a_name, offer_amount=Decimal("10.0"),
+                take_token=self.token_b_name, take_amount=Decimal("5.5"),
+            ),
+            {"hint": mid_id, "done": True},
+        )
+
+        self.otc_contract.cancel_offer(signer=self.maker_vk, listing_id=mid_id)
+        self.assertEqual(self.otc_contract.book_next[cheap_id], dear_id)
+        self.assertEqual(self.otc_contract.book_prev[dear_id], cheap_id)
+
+        self._approve_transfer(self.token_b, self.taker_vk, self.otc_contract_name, Decimal("100.0"))
+        self.otc_contract.take_offer(signer=self.taker_vk, listing_id=cheap_id)
+        self.assertEqual(self.otc_contract.book_head[self.token_a_name, self.token_b_name], dear_id)
+
+    def test_31_list_offer_auto_cross_fills_and_rests_remainder(self):
+        # Taker rests 50 B asking 100 A (2 A per B)
+        resting_id = self._list(self.taker_vk, self.token_b_name, Decimal("50.0"), self.token_a_name, Decimal("100.0"), TEST_DATETIME)
+        taker_token_a_bal = self._get_balance_contracting_or_zero(self.token_a, self.taker_vk)
+        maker_token_a_bal = self._get_balance_contracting_or_zero(self.token_a, self.maker_vk)
+
+        # Maker offers 150 A for 60 B (2.5 A per B), which crosses the resting listing
+        new_id = self._list(
+            self.maker_vk, self.token_a_name, Decimal("150.0"), self.token_b_name, Decimal("60.0"),
+            TEST_DATETIME_PLUS_1SEC, auto_cross=True
+        )
+
+        resting = self.otc_contract.otc_listing[resting_id]
+        self.assertEqual(resting["status"], "EXECUTED")
+        self.assertEqual(resting["taker"], self.maker_vk)
+        self.assertIsNone(self.otc_contract.book_head[self.token_b_name, self.token_a_name])
+
+        remainder = self.otc_contract.otc_listing[new_id]
+        self.assertEqual(remainder["status"], "OPEN")
+        self.assertEqual(remainder["offer_amount"], self._units("50.0"))
+        self.assertEqual(remainder["take_amount"], self._units("20.0"))
+
+        fee_factor = self.default_fee_percent / Decimal("100.0")
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_b, self.maker_vk), Decimal("50.0"))
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_a, self.taker_vk), taker_token_a_bal + Decimal("100.0"))
+        self.assertEqual(
+            self._get_balance_contracting_or_zero(self.token_a, self.maker_vk),
+            maker_token_a_bal - Decimal("150.0") - Decimal("100.0") * fee_factor - Decimal("50.0") * fee_factor,
+        )
+        self.assertEqual(self.otc_contract.view_earned_fees(token=self.token_a_name), Decimal("100.0") * fee_factor)
+        self.assertEqual(self.otc_contract.view_earned_fees(token=self.token_b_name), Decimal("50.0") * fee_factor)
+
+    # Batch auctions ------------------------------------------------------------------------------------------
+
+    def test_32_batch_auction_clears_at_uniform_price(self):
+        self.otc_contract.configure_batch_auction(
+            signer=self.otc_owner_vk, environment={**self.environment, "now": TEST_DATETIME},
+            base_token=self.token_a_name, quote_token=self.token_b_name, epoch_seconds=60
+        )
+        environment = {**self.environment, "now": TEST_DATETIME_PLUS_1SEC}
+        self._approve_transfer(self.token_a, self.maker_vk, self.otc_contract_name, Decimal("100.5"))
+        self._approve_transfer(self.token_b, self.taker_vk, self.otc_contract_name, Decimal("60.3"))
+        maker_token_a_bal = self._get_balance_contracting_or_zero(self.token_a, self.maker_vk)
+        taker_token_b_bal = self._get_balance_contracting_or_zero(self.token_b, self.taker_vk)
+
+        order_output = self.otc_contract.submit_batch_order(
+            signer=self.maker_vk, environment=environment, base_token=self.token_a_name, quote_token=self.token_b_name,
+            side="SELL", amount=Decimal("100.0"), limit_price=Decimal("0.4"), return_full_output=True
+        )
+        self.otc_contract.submit_batch_order(
+            signer=self.taker_vk, environment=environment, base_token=self.token_a_name, quote_token=self.token_b_name,
+            side="BUY", amount=Decimal("60.0"), limit_price=Decimal("0.6")
+        )
+
+        with self.assertRaisesRegex(AssertionError, "Epoch still running"):
+            self.otc_contract.clear_epoch(
+                signer=self.other_vk, environment=environment,
+                base_token=self.token_a_name, quote_token=self.token_b_name
+            )
+
+        clear_output = self.otc_contract.clear_epoch(
+            signer=self.other_vk,
+            environment={**self.environment, "now": Datetime(year=2024, month=6, day=20, hour=10, minute=1)},
+            base_token=self.token_a_name, quote_token=self.token_b_name, return_full_output=True
+        )
+        clearing_price = clear_output['result']
+        order_event = [event for event in order_output['events'] if event['event'] == "BatchOrder"][0]
+        cleared_event = [event for event in clear_output['events'] if event['event'] == "EpochCleared"][0]
+        self.assertEqual(order_event['data']['v'], self.event_schema_version)
+        self.assertEqual(cleared_event['data']['v'], self.event_schema_version)
+
+        # 0.6 matches the full 100 A with no imbalance
+        self.assertEqual(clearing_price, Decimal("0.6"))
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_a, self.maker_vk), maker_token_a_bal - Decimal("100.5"))
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_b, self.maker_vk), Decimal("60.0"))
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_a, self.taker_vk), Decimal("100.0"))
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_b, self.taker_vk), taker_token_b_bal - Decimal("60.3"))
+        self.assertEqual(self.otc_contract.view_earned_fees(token=self.token_a_name), Decimal("0.5"))
+        self.assertEqual(self.otc_contract.view_earned_fees(token=self.token_b_name), Decimal("0.3"))
+        self.assertEqual(self.otc_contract.batch_epoch[self.token_a_name, self.token_b_name], 1)
+
+    # Fee shards ----------------------------------------------------------------------------------------------
+
+    def test_33_fee_shards_spread_accrual_and_sum_on_withdraw(self):
+        self.otc_contract.set_fee_shards(signer=self.otc_owner_vk, shards=4)
+        with self.assertRaisesRegex(AssertionError, "Fee shards can only grow"):
+            self.otc_contract.set_fee_shards(signer=self.otc_owner_vk, shards=2)
+
+        offer_amount = Decimal("100.0")
+        take_amount = Decimal("50.0")
+        maker_fee = offer_amount / Decimal("100.0") * self.default_fee_percent
+        taker_fee = take_amount / Decimal("100.0") * self.default_fee_percent
+        listing_ids = [
+            self._list(self.maker_vk, self.token_a_name, offer_amount, self.token_b_name, take_amount, TEST_DATETIME),
+            self._list(self.maker_vk, self.token_a_name, offer_amount, self.token_b_name, take_amount, TEST_DATETIME_PLUS_1SEC),
+        ]
+        for listing_id in listing_ids:
+            self._approve_transfer(self.token_b, self.taker_vk, self.otc_contract_name, take_amount + taker_fee)
+            self.otc_contract.take_offer(signer=self.taker_vk, listing_id=listing_id)
+
+        # Each take only wrote the shard picked by its listing id prefix
+        expected_per_shard = {}
+        for listing_id in listing_ids:
+            shard = int(listing_id[:8], 16) % 4
+            expected_per_shard[shard] = expected_per_shard.get(shard, 0) + self._units(maker_fee)
+        for shard in range(4):
+            self.assertEqual(
+                self.otc_contract.earned_fees[self.token_a_name, shard],
+                expected_per_shard.get(shard, 0),
+            )
+
+        self.assertEqual(self.otc_contract.view_earned_fees(token=self.token_a_name), maker_fee * 2)
+        self.assertEqual(self.otc_contract.view_earned_fees(token=self.token_b_name), taker_fee * 2)
+
+        owner_token_a_bal = self._get_balance_contracting_or_zero(self.token_a, self.otc_owner_vk)
+        self.otc_contract.withdraw(signer=self.otc_owner_vk, token_list=[self.token_a_name, self.token_b_name])
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_a, self.otc_owner_vk), owner_token_a_bal + maker_fee * 2)
+        self.assertEqual(self.otc_contract.view_earned_fees(token=self.token_a_name), Decimal("0.0"))
+        self.assertEqual(self.otc_contract.view_earned_fees(token=self.token_b_name), Decimal("0.0"))
+
+    def test_34_lifecycle_events_carry_only_id_actor_and_delta(self):
+        offer_amount = Decimal("100.0")
+        take_amount = Decimal("50.0")
+        taker_fee = take_amount / Decimal("100.0") * self.default_fee_percent
+        taken_id = self._list(self.maker_vk, self.token_a_name, offer_amount, self.token_b_name, take_amount, TEST_DATETIME)
+        cancelled_id = self._list(self.maker_vk, self.token_a_name, offer_amount, self.token_b_name, take_amount, TEST_DATETIME_PLUS_1SEC)
+
+        self._approve_transfer(self.token_b, self.taker_vk, self.otc_contract_name, take_amount + taker_fee)
+        take_output = self.otc_contract.take_offer(signer=self.taker_vk, listing_id=taken_id, return_full_output=True)
+        take_event = [event for event in take_output['events'] if event['event'] == "TakeOffer"][0]
+        self.assertEqual(take_event['data_indexed'], {'id': taken_id, 'taker': self.taker_vk})
+        self.assertEqual(
+            take_event['data'],
+            {'v': self.event_schema_version, 'offer_amount': offer_amount, 'take_amount': take_amount},
+        )
+
+        cancel_output = self.otc_contract.cancel_offer(signer=self.maker_vk, listing_id=cancelled_id, return_full_output=True)
+        cancel_event = [event for event in cancel_output['events'] if event['event'] == "CancelOffer"][0]
+        self.assertEqual(cancel_event['data_indexed'], {'id': cancelled_id, 'maker': self.maker_vk})
+        self.assertEqual(cancel_event['data'], {'v': self.event_schema_version, 'offer_amount': offer_amount})
+
+    def test_35_get_open_offers_pages_with_a_stable_cursor(self):
+        listing_ids = [
+            self._list(self.maker_vk, self.token_a_name, Decimal("10.0"), self.token_b_name, Decimal(take_amount),
+                       Datetime(year=2024, month=6, day=20, hour=10, minute=0, second=index))
+            for index, take_amount in enumerate(["1.0", "2.0", "3.0", "4.0", "5.0"])
+        ]
+
+        first_page = self.otc_contract.get_open_offers(offer_token=self.token_a_name, take_token=self.token_b_name, limit=2)
+        self.assertEqual([offer["id"] for offer in first_page["offers"]], listing_ids[:2])
+        self.assertEqual(first_page["offers"][0]["take_amount"], Decimal("1.0"))
+        self.assertEqual(first_page["cursor"], listing_ids[1])
+
+        # The cursor listing and the next one leave the book between pages: nothing is skipped or repeated
+        self._approve_transfer(self.token_b, self.taker_vk, self.otc_contract_name, Decimal("10.0"))
+        self.otc_contract.take_offer(signer=self.taker_vk, listing_id=listing_ids[1])
+        self.otc_contract.cancel_offer(signer=self.maker_vk, listing_id=listing_ids[2])
+        second_page = self.otc_contract.get_open_offers(
+            offer_token=self.token_a_name, take_token=self.token_b_name, cursor=first_page["cursor"], limit=2
+        )
+        self.assertEqual([offer["id"] for offer in second_page["offers"]], listing_ids[3:])
+        self.assertIsNone(second_page["cursor"])
+
+        with self.assertRaisesRegex(AssertionError, "Cursor does not belong to this pair"):
+            self.otc_contract.get_open_offers(offer_token=self.token_b_name, take_token=self.token_a_name, cursor=listing_ids[0])
+        with self.assertRaisesRegex(AssertionError, "Limit must be between 1 and MAX_PAGE_SIZE"):
+            self.otc_contract.get_open_offers(offer_token=self.token_a_name, take_token=self.token_b_name, limit=101)
+
+    def test_36_take_best_sweeps_cheapest_listings_within_budget_and_limit(self):
+        def at(second):
+            return Datetime(year=2024, month=6, day=20, hour=10, minute=0, second=second)
+
+        cheap_id = self._list(self.maker_vk, self.token_a_name, Decimal("10.0"), self.token_b_name, Decimal("4.0"), at(0))
+        too_big_id = self._list(self.maker_vk, self.token_a_name, Decimal("100.0"), self.token_b_name, Decimal("45.0"), at(1))
+        mid_id = self._list(self.maker_vk, self.token_a_name, Decimal("10.0"), self.token_b_name, Decimal("5.0"), at(2))
+        dear_id = self._list(self.maker_vk, self.token_a_name, Decimal("10.0"), self.token_b_name, Decimal("7.0"), at(3))
+
+        budget = Decimal("9.045") # 4 + 5 plus 0.5% taker fees
+        self._approve_transfer(self.token_b, self.taker_vk, self.otc_contract_name, budget)
+        taker_a_before = self._get_balance_contracting_or_zero(self.token_a, self.taker_vk)
+        taker_b_before = self._get_balance_contracting_or_zero(self.token_b, self.taker_vk)
+        maker_b_before = self._get_balance_contracting_or_zero(self.token_b, self.maker_vk)
+
+        result = self.otc_contract.take_best(
+            signer=self.taker_vk, offer_token=self.token_a_name, take_token=self.token_b_name,
+            max_take_amount=budget, limit_price=Decimal("0.6"),
+        )
+
+        self.assertEqual(result["ids"], [cheap_id, mid_id])
+        self.assertEqual(result["offer_amount"], Decimal("20.0"))
+        self.assertEqual(result["take_amount"], Decimal("9.0"))
+        self.assertEqual(result["fee"], Decimal("0.045"))
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_a, self.taker_vk), taker_a_before + Decimal("20.0"))
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_b, self.taker_vk), taker_b_before - budget)
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_b, self.maker_vk), maker_b_before + Decimal("9.0"))
+        self.assertEqual(self.otc_contract.otc_listing[too_big_id]["status"], "OPEN")
+        self.assertEqual(self.otc_contract.otc_listing[dear_id]["status"], "OPEN")
+        self.assertEqual(self.otc_contract.book_head[self.token_a_name, self.token_b_name], too_big_id)
+        self.assertEqual(self.otc_contract.view_earned_fees(token=self.token_b_name), Decimal("0.045"))
+
+        with self.assertRaisesRegex(AssertionError, "No listing within limit price and budget"):
+            self.otc_contract.take_best(
+                signer=self.taker_vk, offer_token=self.token_a_name, take_token=self.token_b_name,
+                max_take_amount=Decimal("100.0"), limit_price=Decimal("0.4"),
+            )
+
+    def test_37_registry_routes_trades_to_pair_shard_and_aggregates_fees(self):
+        registry = self._deploy_contract_from_file("con_otc_registry.py", "con_otc_registry", self.otc_owner_vk)
+        token_c = self._deploy_mock_token("con_token_c", "TokenC", "TKC")
+        self.otc_contract.set_router(router_contract="con_otc_registry", signer=self.otc_owner_vk)
+        other_shard = self._deploy_contract_from_file("con_otc_v3.py", "con_otc_shard_ac", self.otc_owner_vk)
+
+        with self.assertRaisesRegex(AssertionError, "Shard must set_router to this registry first"):
+            registry.register_shard(token_a="con_token_c", token_b=self.token_a_name, shard="con_otc_shard_ac", signer=self.otc_owner_vk)
+        registry.register_shard(token_a=self.token_b_name, token_b=self.token_a_name, shard=self.otc_contract_name, signer=self.otc_owner_vk)
+        other_shard.set_router(router_contract="con_otc_registry", signer=self.otc_owner_vk)
+        registry.register_shard(token_a="con_token_c", token_b=self.token_a_name, shard="con_otc_shard_ac", signer=self.otc_owner_vk)
+        with self.assertRaisesRegex(AssertionError, "Pair already has a shard"):
+            registry.register_shard(token_a=self.token_a_name, token_b=self.token_b_name, shard="con_otc_shard_ac", signer=self.otc_owner_vk)
+        self.assertEqual(registry.get_shard(token_a=self.token_a_name, token_b=self.token_b_name), self.otc_contract_name)
+
+        # Makers and takers approve the shard, which pulls the tokens
+        self._approve_transfer(self.token_a, self.maker_vk, self.otc_contract_name, Decimal("200.0"))
+        listing_id = registry.list_offer(
+            signer=self.maker_vk, environment={**self.environment, "now": TEST_DATETIME},
+            offer_token=self.token_a_name, offer_amount=Decimal("100.0"),
+            take_token=self.token_b_name, take_amount=Decimal("50.0"),
+        )
+        self.assertEqual(self.otc_contract.otc_listing[listing_id]["maker"], self.maker_vk)
+
+        self._approve_transfer(self.token_b, self.taker_vk, self.otc_contract_name, Decimal("100.0"))
+        registry.take_offer(signer=self.taker_vk, offer_token=self.token_a_name, take_token=self.token_b_name, listing_id=listing_id)
+        self.assertEqual(self.otc_contract.otc_listing[listing_id]["taker"], self.taker_vk)
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_a, self.taker_vk), Decimal("100.0"))
+
+        self._fund_account(token_c, self.maker_vk)
+        self._approve_transfer(token_c, self.maker_vk, "con_otc_shard_ac", Decimal("20.0"))
+        registry.list_offer(
+            signer=self.maker_vk, environment={**self.environment, "now": TEST_DATETIME},
+            offer_token="con_token_c", offer_amount=Decimal("10.0"),
+            take_token=self.token_a_name, take_amount=Decimal("10.0"),
+        )
+        with self.assertRaisesRegex(AssertionError, "No shard registered for this pair"):
+            registry.list_offer(
+                signer=self.maker_vk, offer_token="con_token_c", offer_amount=Decimal("10.0"),
+                take_token=self.token_b_name, take_amount=Decimal("10.0"),
+            )
+
+        self.assertEqual(registry.view_earned_fees(token=self.token_a_name), Decimal("0.5"))
+        self.assertEqual(registry.view_earned_fees(token=self.token_b_name), Decimal("0.25"))
+        registry.adjust_fee(trading_fee_bps=20, signer=self.otc_owner_vk)
+        self.assertEqual(other_shard.fee.get(), 20)
+
+        owner_a_before = self._get_balance_contracting_or_zero(self.token_a, self.otc_owner_vk)
+        registry.withdraw(token_list=[self.token_a_name, self.token_b_name], signer=self.otc_owner_vk)
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_a, self.otc_owner_vk), owner_a_before + Decimal("0.5"))
+        self.assertEqual(registry.view_earned_fees(token=self.token_b_name), Decimal("0.0"))
+        with self.assertRaisesRegex(AssertionError, "Only owner can call this method!"):
+            registry.withdraw(token_list=[self.token_a_name], signer=self.maker_vk)
+
+
+    def test_38_migrate_moves_open_listings_and_escrow_to_new_contract(self):
+        new_otc = self._deploy_contract_from_file("con_otc_v3.py", "con_otc_next", self.otc_owner_vk)
+        first_id = self._list(self.maker_vk, self.token_a_name, Decimal("100.0"), self.token_b_name, Decimal("50.0"), TEST_DATETIME)
+        second_id = self._list(self.maker_vk, self.token_a_name, Decimal("100.0"), self.token_b_name, Decimal("40.0"), TEST_DATETIME_PLUS_1SEC)
+        reverse_id = self._list(self.taker_vk, self.token_b_name, Decimal("10.0"), self.token_a_name, Decimal("20.0"), TEST_DATETIME_PLUS_1SEC)
+
+        with self.assertRaisesRegex(AssertionError, "No migration target set"):
+            self.otc_contract.migrate_out(listing_ids=[first_id], signer=self.maker_vk)
+        self.otc_contract.set_migration_target(target_contract="con_otc_next", signer=self.otc_owner_vk)
+        new_otc.set_migration_source(source_contract=self.otc_contract_name, signer=self.otc_owner_vk)
+        with self.assertRaisesRegex(AssertionError, "Only owner or maker can migrate offer"):
+            self.otc_contract.migrate_out(listing_ids=[first_id], signer=self.other_vk)
+        with self.assertRaisesRegex(AssertionError, "Only the migration source can import listings"):
+            new_otc.migrate_in(listings=[], escrow_units={}, signer=self.maker_vk)
+
+        maker_a_before = self._get_balance_contracting_or_zero(self.token_a, self.maker_vk)
+        self.otc_contract.migrate_out(listing_ids=[first_id], signer=self.maker_vk)
+        self.assertEqual(self.otc_contract.otc_listing[first_id]["status"], "MIGRATED")
+        self.assertEqual(new_otc.otc_listing[first_id]["status"], "OPEN")
+        self.assertEqual(new_otc.otc_listing[first_id]["maker"], self.maker_vk)
+        self.assertEqual(new_otc.otc_listing[first_id]["date_listed"], TEST_DATETIME)
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_a, self.maker_vk), maker_a_before)
+        self.assertEqual(new_otc.view_contract_balance(token=self.token_a_name), Decimal("100.5"))
+
+        self.otc_contract.migrate_out(listing_ids=[second_id, reverse_id], signer=self.otc_owner_vk)
+        self.assertEqual(self.otc_contract.view_contract_balance(token=self.token_a_name), Decimal("0.0"))
+        self.assertEqual(self.otc_contract.view_contract_balance(token=self.token_b_name), Decimal("0.0"))
+        self.assertIsNone(self.otc_contract.book_head[self.token_a_name, self.token_b_name])
+        self.assertEqual(new_otc.book_head[self.token_a_name, self.token_b_name], second_id) # Cheaper of the two
+        self.assertEqual(new_otc.book_next[second_id], first_id)
+        self.assertEqual(new_otc.book_head[self.token_b_name, self.token_a_name], reverse_id)
+        with self.assertRaisesRegex(AssertionError, "Offer not available"):
+            self.otc_contract.migrate_out(listing_ids=[second_id], signer=self.otc_owner_vk)
+
+        self._approve_transfer(self.token_b, self.taker_vk, "con_otc_next", Decimal("100.0"))
+        new_otc.take_offer(listing_id=second_id, signer=self.taker_vk, environment=self.environment)
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_a, self.taker_vk), Decimal("100.0"))
+        self.assertEqual(new_otc.view_earned_fees(token=self.token_a_name), Decimal("0.5"))
+
+
+    def test_39_token_transfer_many_debits_once_and_credits_every_recipient(self):
+        maker_before = self._get_balance_contracting_or_zero(self.token_a, self.maker_vk)
+        self.token_a.transfer_many(recipients={self.taker_vk: Decimal("1.5"), self.other_vk: Decimal("2.5")}, signer=self.maker_vk)
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_a, self.maker_vk), maker_before - Decimal("4.0"))
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_a, self.taker_vk), Decimal("1.5"))
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_a, self.other_vk), Decimal("2.5"))
+
+        self._approve_transfer(self.token_a, self.maker_vk, self.otc_owner_vk, Decimal("5.0"))
+        self.token_a.transfer_from_many(
+            recipients={self.taker_vk: Decimal("1.0"), self.other_vk: Decimal("3.0")},
+            main_account=self.maker_vk, signer=self.otc_owner_vk,
+        )
+        self.assertEqual(self.token_a.balances[self.maker_vk, self.otc_owner_vk], Decimal("1.0"))
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_a, self.other_vk), Decimal("5.5"))
+
+        with self.assertRaisesRegex(AssertionError, "Transfer amount exceeds allowance"):
+            self.token_a.transfer_from_many(
+                recipients={self.taker_vk: Decimal("0.6"), self.other_vk: Decimal("0.6")},
+                main_account=self.maker_vk, signer=self.otc_owner_vk,
+            )
+        with self.assertRaisesRegex(AssertionError, "Cannot transfer negative!"):
+            self.token_a.transfer_many(recipients={self.taker_vk: Decimal("1.0"), self.other_vk: Decimal("-1.0")}, signer=self.maker_vk)
+        with self.assertRaisesRegex(AssertionError, "No recipients!"):
+            self.token_a.transfer_many(recipients={}, signer=self.maker_vk)
+        with self.assertRaisesRegex(AssertionError, "Transfer amount exceeds balance!"):
+            self.token_a.transfer_many(recipients={self.other_vk: Decimal("5.5")}, signer=self.taker_vk)
+
+
+    def test_40_registry_routes_take_best_sweeps_for_the_signer(self):
+        registry = self._deploy_contract_from_file("con_otc_registry.py", "con_otc_registry", self.otc_owner_vk)
+        self.otc_contract.set_router(router_contract="con_otc_registry", signer=self.otc_owner_vk)
+        registry.register_shard(token_a=self.token_a_name, token_b=self.token_b_name, shard=self.otc_contract_name, signer=self.otc_owner_vk)
+        cheap_id = self._list(self.maker_vk, self.token_a_name, Decimal("10.0"), self.token_b_name, Decimal("4.0"), TEST_DATETIME)
+        dear_id = self._list(self.maker_vk, self.token_a_name, Decimal("10.0"), self.token_b_name, Decimal("5.0"), TEST_DATETIME_PLUS_1SEC)
+
+        # The maker's own listings are skipped even though the shard's direct caller is the registry
+        with self.assertRaisesRegex(AssertionError, "No listing within limit price and budget"):
+            registry.take_best(
+                signer=self.maker_vk, offer_token=self.token_a_name, take_token=self.token_b_name,
+                max_take_amount=Decimal("20.0"), limit_price=Decimal("1.0"),
+            )
+
+        budget = Decimal("4.02") # 4 plus the 0.5% taker fee
+        self._approve_transfer(self.token_b, self.taker_vk, self.otc_contract_name, budget)
+        taker_a_before = self._get_balance_contracting_or_zero(self.token_a, self.taker_vk)
+        result = registry.take_best(
+            signer=self.taker_vk, offer_token=self.token_a_name, take_token=self.token_b_name,
+            max_take_amount=budget, limit_price=Decimal("1.0"),
+        )
+
+        self.assertEqual(result["ids"], [cheap_id])
+        self.assertEqual(self.otc_contract.otc_listing[cheap_id]["taker"], self.taker_vk)
+        self.assertEqual(self.otc_contract.otc_listing[dear_id]["status"], "OPEN")
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_a, self.taker_vk), taker_a_before + Decimal("10.0"))
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_a, "con_otc_registry"), Decimal("0"))
+
+    def test_41_deep_book_is_listable_with_a_hint_found_in_bounded_steps(self):
+        environment = {**self.environment, "now": TEST_DATETIME}
+        self._approve_transfer(self.token_a, self.maker_vk, self.otc_contract_name, Decimal("100.0"))
+        # Each listing goes after the previous one, so building a book deeper than MAX_BOOK_WALK stays cheap
+        last_id = ""
+        for _ in range(501):
+            last_id = self.otc_contract.list_offer(
+                signer=self.maker_vk, environment=environment,
+                offer_token=self.token_a_name, offer_amount=Decimal("0.1"),
+                take_token=self.token_b_name, take_amount=Decimal("0.1"), position_hint=last_id,
+            )
+        listing = dict(offer_token=self.token_a_name, offer_amount=Decimal("0.1"), take_token=self.token_b_name, take_amount=Decimal("0.1"))
+
+        with self.assertRaisesRegex(AssertionError, "Order book too deep to place listing"):
+            self.otc_contract.list_offer(signer=self.maker_vk, environment=environment, **listing)
+
+        first = self.otc_contract.find_position_hint(**listing)
+        self.assertFalse(first["done"])
+        second = self.otc_contract.find_position_hint(cursor=first["hint"], **listing)
+        self.assertEqual(second, {"hint": last_id, "done": True})
+
+        new_id = self.otc_contract.list_offer(
+            signer=self.maker_vk, environment=environment, position_hint=second["hint"], **listing
+        )
+        self.assertEqual(self.otc_contract.book_next[last_id], new_id)
+        self.assertEqual(self.otc_contract.book_prev[new_id], last_id)
+
+    def test_42_auto_cross_skips_a_large_best_listing_and_never_rests_crossed(self):
+        # Taker rests 500 B asking 500 A (the best price for the maker) and 10 B asking 20 A
+        large_id = self._list(self.taker_vk, self.token_b_name, Decimal("500.0"), self.token_a_name, Decimal("500.0"), TEST_DATETIME)
+        small_id = self._list(self.taker_vk, self.token_b_name, Decimal("10.0"), self.token_a_name, Decimal("20.0"), TEST_DATETIME)
+        maker_b_before = self._get_balance_contracting_or_zero(self.token_b, self.maker_vk)
+
+        # Maker offers 20 A for 8 B: both listings cross, the large one does not fit and is skipped
+        result = self._list(
+            self.maker_vk, self.token_a_name, Decimal("20.0"), self.token_b_name, Decimal("8.0"),
+            TEST_DATETIME_PLUS_1SEC, auto_cross=True
+        )
+        self.assertIsNone(result)
+        self.assertEqual(self.otc_contract.otc_listing[small_id]["status"], "EXECUTED")
+        self.assertEqual(self.otc_contract.otc_listing[large_id]["status"], "OPEN")
+        self.assertEqual(self.otc_contract.book_head[self.token_b_name, self.token_a_name], large_id)
+        self.assertEqual(self._get_balance_contracting_or_zero(self.token_b, self.maker_vk), maker_b_before + Decimal("10.0"))
+
+        # A remainder that would rest across the large listing is refused rather than crossing the book
+        with self.assertRaisesRegex(AssertionError, "Remainder would cross a listing too large to fill"):
+            self._list(
+                self.maker_vk, self.token_a_name, Decimal("40.0"), self.token_b_name, Decimal("16.0"),
+                TEST_DATETIME_PLUS_1SEC, auto_cross=True
+            )
+        self.assertIsNone(self.otc_contract.book_head[self.token_a_name, self.token_b_name])
+
+    def test_43_migrate_in_batches_keeps_a_deep_book_placeable(self):
+        new_otc = self._deploy_contract_from_file("con_otc_v3.py", "con_otc_next", self.otc_owner_vk)
+        self.otc_contract.set_migration_target(target_contract="con_otc_next", signer=self.otc_owner_vk)
+        new_otc.set_migration_source(source_contract=self.otc_contract_name, signer=self.otc_owner_vk)
+        with self.assertRaisesRegex(AssertionError, "Migrate between 1 and MAX_MIGRATION_BATCH"):
+            new_otc.migrate_in(listings=[], escrow_units={}, signer=self.otc_contract_name)
+
+        # More equal-priced listings than MAX_BOOK_WALK, so a batch that walked from the head would revert
+        environment = {**self.environment, "now": TEST_DATETIME}
+        self._approve_transfer(self.token_a, self.maker_vk, self.otc_contract_name, Decimal("100.0"))
+        listing_ids = [""]
+        for _ in range(560):
+            listing_ids.append(self.otc_contract.list_offer(
+                signer=self.maker_vk, environment=environment,
+                offer_token=self.token_a_name, offer_amount=Decimal("0.1"),
+                take_token=self.token_b_name, take_amount=Decimal("0.1"), position_hint=listing_ids[-1],
+            ))
+        listing_ids = listing_ids[1:]
+
+        for start in range(0, len(listing_ids), 50):
+            self.otc_contract.migrate_out(listing_ids=listing_ids[start:start + 50], signer=self.otc_owner_vk)
+
+        self.assertIsNone(self.otc_contract.book_head[self.token_a_name, self.token_b_name])
+        self.assertEqual(new_otc.book_head[self.token_a_name, self.token_b_name], listing_ids[0])
+        for previous_id, listing_id in zip(listing_ids, listing_ids[1:]):
+            self.assertEqual(new_otc.book_next[previous_id], listing_id)
+        self.assertEqual(new_otc.view_contract_balance(token=self.token_a_name), Decimal("0.1005") * 560)
+
+class TestOtcTools(unittest.TestCase):
+    def start_market(self):
+        # Deployed only by the tests that trade on it; tools that run their own client skip the cost
+        self.storage_home = tempfile.mkdtemp(prefix="otc_test_")
+        self.addCleanup(shutil.rmtree, self.storage_home, ignore_errors=True)
+        self.client = new_client(self.storage_home)
+        self.addCleanup(self.client.flush)
+        self.market = deploy_market(self.client)
+        self.market.fund(["maker_wallet", "taker_wallet"], 1_000)
+        self.market.approve_all(["maker_wallet", "taker_wallet"], 1_000)
+
+    def test_01_fuzz_campaign_matches_reference_model(self):
+        config = FuzzConfig(steps=150, actors=4, tokens=3)
+        for result in run_campaigns(range(2), config):
+            self.assertTrue(result.ok, f"seed {result.seed} step {result.steps}: {result.divergence}")
+            self.assertEqual(result.steps, config.steps)
+            self.assertGreater(result.operations["take_offer"], 0)
+
+    def test_02_differential_run_of_identical_versions_is_clean(self):
+        actors = ["diff_actor_0", "diff_actor_1", "diff_actor_2"]
+        token_names = ["con_diff_token_0", "con_diff_token_1"]
+        trace = generate_trace(seed=3, steps=60, actors=actors, token_names=token_names, owner=OWNER)
+        report = run_differential(trace, "con_otc_v3.py", "con_otc_v3.py", actors, token_names)
+        self.assertTrue(report.identical, report.format())
+        self.assertEqual(report.calls, len(trace))
+        self.assertEqual(sum(calls for _, _, calls in report.stamps.values()), len(trace))
+
+    def test_03_load_run_reports_throughput_stamps_and_state_growth(self):
+        report = run_load(LoadConfig(makers=5, takers=5, tokens=2, pairs=2, rate=2.0, duration=60, sample_every=20))
+        self.assertGreater(report.calls, 0)
+        self.assertIn("list_offer", report.stamps)
+        self.assertEqual(report.samples[-1].at, 60)
+        self.assertGreaterEqual(len(report.samples), 3)
+        self.assertGreater(report.samples[-1].state_keys, report.samples[0].state_keys)
+
+    def test_04_state_profiler_attributes_accesses_and_foreign_calls(self):
+        self.start_market()
+        listing_id = self.market.otc.list_offer(
+            signer="maker_wallet", environment=self.market.tick(),
+            offer_token="con_token_a", offer_amount=Decimal("100.0"), take_token="con_token_b", take_amount=Decimal("50.0"),
+        )
+
+        with StateProfiler(self.client) as profiler:
+            self.market.otc.take_offer(signer="taker_wallet", environment=self.market.tick(), listing_id=listing_id)
+
+        [call] = profiler.calls
+        self.assertEqual(call.name, "con_otc.take_offer")
+        variables = {access.variable for access in call.accesses}
+        self.assertIn("con_otc.reentrancyGuardActive", variables)
+        self.assertIn("con_otc.earned_fees", variables)
+        self.assertIn(("con_otc.take_offer",), {access.stack for access in call.accesses})
+        self.assertIn("con_token_b.transfer_from", {callee for _, callee in call.foreign_calls})
+        self.assertIn("con_otc.take_offer;con_token_b.transfer_from", profiler.folded())
+        self.assertIn("con_otc.take_offer: 1 call(s)", profiler.table())
+
+    @unittest.skipUnless(importlib.util.find_spec("numpy"), "numpy is not installed")
+    def test_05_columnar_export_dictionary_encodes_and_keeps_units(self):
+        self.start_market()
+        for take_amount in ("50.0", "75.5"):
+            self.market.otc.list_offer(
+                signer="maker_wallet", environment=self.market.tick(),
+                offer_token="con_token_a", offer_amount=Decimal("100.0"),
+                take_token="con_token_b", take_amount=Decimal(take_amount),
+            )
+        with tempfile.TemporaryDirectory() as directory:
+            dump_path = os.path.join(directory, "state.jsonl")
+            dump_state(self.client, ["con_otc."], dump_path)
+            self.client.flush()
+            counts = export(dump_path, "con_otc", os.path.join(directory, "otc"), fmt="npz")
+            tables, dictionaries = load_npz(os.path.join(directory, "otc.npz"))
+
+        self.assertEqual(counts, {"listings": 2})
+        listings = tables["listings"]
+        self.assertEqual(sorted(listings["take_amount"].tolist()), [50 * 10 ** 8, 7550 * 10 ** 7])
+        self.assertEqual(listings["offer_amount"].dtype.itemsize, 8)
+        self.assertEqual({dictionaries["tokens"][code] for code in listings["offer_token"]}, {"con_token_a"})
+        self.assertEqual(listings["taker"].tolist(), [-1, -1])
+
+    @unittest.skipUnless(importlib.util.find_spec("numpy"), "numpy is not installed")
+    def test_06_reconciliation_balances_escrow_and_flags_drift(self):
+        self.start_market()
+        listing_ids = [
+            self.market.otc.list_offer(
+                signer="maker_wallet", environment=self.market.tick(),
+                offer_token="con_token_a", offer_amount=Decimal(offer_amount),
+                take_token="con_token_b", take_amount=Decimal("50.0"),
+            )
+            for offer_amount in ("100.0", "33.33333333", "10.0")
+        ]
+        self.market.otc.take_offer(signer="taker_wallet", environment=self.market.tick(), listing_id=listing_ids[0])
+        self.market.otc.cancel_offer(signer="maker_wallet", environment=self.market.tick(), listing_id=listing_ids[2])
+
+        with tempfile.TemporaryDirectory() as directory:
+            dump_path = os.path.join(directory, "state.jsonl")
+            dump_state(self.client, ["con_otc.", "con_token_a.balances:con_otc", "con_token_b.balances:con_otc"], dump_path)
+            self.client.flush()
+            rows = {row.token: row for row in reconcile(dump_path, "con_otc")}
+            state = dict(iter_state(dump_path))
+
+        self.assertTrue(all(row.difference == 0 for row in rows.values()), format_report(rows.values()))
+        self.assertEqual(rows["con_token_a"].listing_escrow, 3333333333 + 3333333333 * 50 // 10_000)
+        self.assertGreater(rows["con_token_b"].earned_fees, 0)
+
+        state["con_token_a.balances:con_otc"] += PyDecimal("0.00000001")
+        drifted = {row.token: row for row in reconcile(state, "con_otc")}
+        self.assertEqual(drifted["con_token_a"].difference, 1)
+
+    def test_07_ohlcv_aggregates_take_offer_fills_per_pair(self):
+        aggregator = OhlcvAggregator(resolutions=(60, 3600), retention=2)
+        start = datetime(2024, 6, 20, 10, 0, 0)
+
+        def offer(listing_id, offer_amount, take_amount):
+            return {"event": "Offer", "data_indexed": {"maker": "maker_wallet", "offer_token": "con_token_a", "take_token": "con_token_b"},
+                    "data": {"id": listing_id, "offer_amount": offer_amount, "take_amount": take_amount}}
+
+        def take(listing_id, offer_amount, take_amount):
+            return {"event": "TakeOffer", "data_indexed": {"id": listing_id, "taker": "taker_wallet"},
+                    "data": {"offer_amount": offer_amount, "take_amount": take_amount}}
+
+        fills = [("l1", "100", "50", 0), ("l2", "10", "6", 30), ("l3", "20", "8", 90), ("l4", "10", "7", 200)]
+        for listing_id, offer_amount, take_amount, seconds in fills:
+            aggregator.on_event(offer(listing_id, offer_amount, take_amount), start)
+            aggregator.on_event(take(listing_id, offer_amount, take_amount), start + timedelta(seconds=seconds))
+        aggregator.on_event(take("unknown", "1", "1"), start)
+
+        hourly = aggregator.candles("con_token_a", "con_token_b", 3600)
+        self.assertEqual(len(hourly), 1)
+        self.assertEqual((hourly[0].open, hourly[0].high, hourly[0].low, hourly[0].close),
+                         (PyDecimal("0.5"), PyDecimal("0.7"), PyDecimal("0.4"), PyDecimal("0.7")))
+        self.assertEqual(hourly[0].base_volume, PyDecimal("140"))
+        minutes = aggregator.candles("con_token_a", "con_token_b", 60)
+        self.assertEqual([candle.trades for candle in minutes], [1, 1])  # Retention keeps the newest two buckets
+        self.assertEqual(aggregator.rolling_volume("con_token_a", "con_token_b"), (PyDecimal("140"), PyDecimal("71")))
+        self.assertEqual(aggregator.rolling_volume("con_token_a", "con_token_b", start + timedelta(days=2)), (0, 0))
+        self.assertEqual(aggregator.unresolved, 1)
+        self.assertEqual(aggregator.open_listings, {})
+
+    def test_08_migration_moves_book_in_batches_and_checks_totals(self):
+        self.start_market()
+        for take_amount in ("50.0", "40.0", "45.0", "40.0", "60.0"):
+            self.market.otc.list_offer(
+                signer="maker_wallet", environment=self.market.tick(),
+                offer_token="con_token_a", offer_amount=Decimal("10.0"), take_token="con_token_b", take_amount=Decimal(take_amount),
+            )
+        self.market.otc.list_offer(
+            signer="taker_wallet", environment=self.market.tick(),
+            offer_token="con_token_b", offer_amount=Decimal("10.0"), take_token="con_token_a", take_amount=Decimal("10.0"),
+        )
+        self.client.submit(read_source("con_otc_v3.py"), name="con_otc_next", signer=OWNER)
+        self.market.otc.set_migration_target(target_contract="con_otc_next", signer=OWNER)
+        self.client.get_contract("con_otc_next").set_migration_source(source_contract="con_otc", signer=OWNER)
+        book_before = [listing_id for listing_id, _ in open_listings(self.client, "con_otc")]
+
+        report = migrate(self.client, "con_otc", "con_otc_next", batch_size=4)
+        book_after = [listing_id for listing_id, _ in open_listings(self.client, "con_otc_next")]
+
+        self.assertTrue(report.ok, report.format())
+        self.assertEqual((report.listings, report.batches), (6, 2))
+        self.assertEqual(report.moved, {"con_token_a": 5 * 1_005_000_000, "con_token_b": 1_005_000_000})
+        self.assertEqual(book_after, book_before)
+
+    def test_09_estimator_dry_runs_candidates_without_touching_the_snapshot(self):
+        self.start_market()
+        listing_id = self.market.otc.list_offer(
+            signer="maker_wallet", environment=self.market.tick(),
+            offer_token="con_token_a", offer_amount=Decimal("100.0"), take_token="con_token_b", take_amount=Decimal("50.0"),
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            snapshot = os.path.join(directory, "state.jsonl")
+            dump_state(self.client, ["con_otc.", "con_token_a.", "con_token_b."], snapshot)
+            self.client.flush()
+            base = prepare(snapshot, os.path.join(directory, "base"))
+
+            take = Call(OTC, "take_offer", "taker_wallet", {"listing_id": listing_id})
+            single, twice, missing = estimate_many(base, [
+                [take],
+                [take, take],
+                [Call(OTC, "cancel_offer", "maker_wallet", {"listing_id": "no_such_listing"})],
+            ], workers=2)
+            untouched = new_client(base, flush=False).raw_driver.get(f"con_otc.otc_listing:{listing_id}")
+
+        [estimate] = single
+        self.assertTrue(estimate.ok, estimate.error)
+        self.assertGreater(estimate.stamps, 0)
+        self.assertEqual(estimate.changes["con_token_a.balances:taker_wallet"], (None, "100"))
+        self.assertEqual(estimate.changes[f"con_otc.otc_listing:{listing_id}"][1]["status"], "EXECUTED")
+        self.assertEqual([estimate.ok for estimate in twice], [True, False])
+        self.assertIn("Offer not available", twice[1].error)
+        self.assertIn("Offer ID does not exist", missing[0].error)
+        self.assertEqual(untouched["status"], "OPEN")
+
+    def test_10_transfer_bench_batched_transfers_cost_fewer_stamps(self):
+        rows = run_bench(recipient_counts=(1, 8))
+        self.assertEqual([(row.function, row.recipients) for row in rows],
+                         [("transfer", 1), ("transfer_from", 1), ("transfer", 8), ("transfer_from", 8)])
+        for row in rows[2:]:
+            self.assertLess(row.batched_stamps, row.looped_stamps)
+
+    def test_11_read_api_pages_offers_with_etags_and_event_invalidation(self):
+        self.start_market()
+        events = ClientEvents(self.market)
+        service = ReadService(ListingStore())
+        events.subscribe(service.on_event)
+        listing_ids = [
+            events.call("list_offer", "maker_wallet", offer_token="con_token_a", offer_amount=Decimal(offer_amount),
+                        take_token="con_token_b", take_amount=Decimal("50.0"))
+            for offer_amount in ("100.0", "200.0", "50.0")
+        ]
+        book = [offer["id"] for offer in self.market.otc.get_open_offers(offer_token="con_token_a", take_token="con_token_b")["offers"]]
+
+        async def get(port, path, etag=None):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            extra = f"If-None-Match: {etag}\r\n" if etag else ""
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n{extra}\r\n".encode())
+            await writer.drain()
+            head, _, body = (await reader.read()).partition(b"\r\n\r\n")
+            writer.close()
+            lines = head.decode().split("\r\n")
+            headers = dict(line.split(": ", 1) for line in lines[1:])
+            return int(lines[0].split(" ")[1]), headers.get("ETag"), json.loads(body) if body else None
+
+        async def scenario():
+            server = await service.serve("127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            pair = "/offers?offer_token=con_token_a&take_token=con_token_b&limit=2"
+            responses = [await get(port, pair)]
+            responses.append(await get(port, f"{pair}&cursor={responses[0][2]['cursor']}"))
+            responses.append(await get(port, pair, etag=responses[0][1]))
+            events.call("take_offer", "taker_wallet", listing_id=listing_ids[1])
+            responses.append(await get(port, pair, etag=responses[0][1]))
+            responses.append(await get(port, "/offers?maker=maker_wallet&status=EXECUTED"))
+            responses.append(await get(port, "/offers?status=BOGUS"))
+            server.close()
+            await server.wait_closed()
+            return responses
+
+        first, second, unchanged, changed, executed, bad = asyncio.run(scenario())
+
+        self.assertEqual([offer["id"] for offer in first[2]["offers"] + second[2]["offers"]], book)
+        self.assertEqual(book, [listing_ids[1], listing_ids[0], listing_ids[2]])
+        self.assertEqual(first[2]["offers"][0]["offer_amount"], "200")
+        self.assertIsNone(second[2]["cursor"])
+        self.assertEqual(unchanged[:2], (304, first[1]))
+        self.assertEqual(changed[0], 200)
+        self.assertEqual([offer["id"] for offer in changed[2]["offers"]], [listing_ids[0], listing_ids[2]])
+        self.assertEqual([(offer["id"], offer["taker"]) for offer in executed[2]["offers"]], [(listing_ids[1], "taker_wallet")])
+        self.assertEqual(bad[0], 400)
+        self.assertEqual(service.cache.hits, 1)
+
+    def test_12_book_feed_sends_snapshot_then_sequenced_deltas_and_resyncs_slow_subscribers(self):
+        self.start_market()
+        events = ClientEvents(self.market)
+        feed = BookFeed(ListingStore(), queue_size=3)
+        events.subscribe(feed.on_event)
+
+        def list_offer(offer_amount, offer_token="con_token_a", take_token="con_token_b"):
+            return events.call("list_offer", "maker_wallet", offer_token=offer_token, offer_amount=Decimal(offer_amount),
+                               take_token=take_token, take_amount=Decimal("50.0"))
+
+        async def scenario():
+            first_id = list_offer("100.0")
+            live = feed.subscribe("con_token_a", "con_token_b")
+            slow = feed.subscribe("con_token_a", "con_token_b")
+            second_id = list_offer("200.0")
+            events.call("take_offer", "taker_wallet", listing_id=first_id)
+            list_offer("10.0", "con_token_b", "con_token_a")  # Other pair, no delta here
+            live_messages = [json.loads(await live.next()) for _ in range(3)]
+            for offer_amount in ("300.0", "400.0", "500.0"):
+                list_offer(offer_amount)
+            slow_messages = [json.loads(await slow.next()) for _ in range(3)]
+            live.close()
+            return first_id, second_id, live_messages, slow_messages, live, slow
+
+        first_id, second_id, live_messages, slow_messages, live, slow = asyncio.run(scenario())
+
+        snapshot, added, filled = live_messages
+        self.assertEqual((snapshot["type"], snapshot["seq"], [offer["id"] for offer in snapshot["offers"]]), ("snapshot", 1, [first_id]))
+        self.assertEqual((added["type"], added["seq"], added["id"], added["offer_amount"]), ("add", 2, second_id, "200"))
+        self.assertEqual(filled, {"type": "fill", "seq": 3, "id": first_id, "taker": "taker_wallet"})
+        self.assertEqual(slow.resyncs, 1)
+        self.assertEqual([(message["type"], message["seq"]) for message in slow_messages], [("snapshot", 4), ("add", 5), ("add", 6)])
+        self.assertEqual(len(slow_messages[0]["offers"]), 2)
+        self.assertEqual(live.resyncs, 0)
+        self.assertEqual(feed.subscribers[("con_token_a", "con_token_b")], {slow})
+
+    def test_13_snapshot_writer_publishes_hashed_pair_books_and_index(self):
+        self.start_market()
+        events = ClientEvents(self.market)
+        clock = [0.0]
+
+        def read_book(out, entry):
+            with open(os.path.join(out, entry["path"]), "rb") as handle:
+                body = gzip.decompress(handle.read())
+            self.assertEqual(hashlib.sha256(body).hexdigest()[:16], entry["hash"])
+            return json.loads(body)
+
+        with tempfile.TemporaryDirectory() as out:
+            writer = SnapshotWriter(ListingStore(), out, every_events=2, every_seconds=5, clock=lambda: clock[0])
+            events.subscribe(writer.on_event)
+            writer.publish()
+            listing_ids = [
+                events.call("list_offer", "maker_wallet", offer_token="con_token_a", offer_amount=Decimal(offer_amount),
+                            take_token="con_token_b", take_amount=Decimal("50.0"))
+                for offer_amount in ("100.0", "200.0")
+            ]
+            with open(os.path.join(out, "index.json")) as handle:
+                index = json.load(handle)
+            pair_book = read_book(out, index["pairs"]["con_token_a/con_token_b"])
+            contract_book = self.market.otc.get_open_offers(offer_token="con_token_a", take_token="con_token_b")["offers"]
+
+            events.call("take_offer", "taker_wallet", listing_id=listing_ids[1])
+            self.assertFalse(writer.maybe_publish())
+            clock[0] = 5.0
+            self.assertTrue(writer.maybe_publish())
+            with open(os.path.join(out, "index.json")) as handle:
+                after_take = json.load(handle)
+            files = sorted(os.listdir(os.path.join(out, "v")))
+        with tempfile.TemporaryDirectory() as plain_out:
+            plain = SnapshotWriter(writer.store, plain_out, compress=False).publish()
+            with open(os.path.join(plain_out, plain["global"]["path"])) as handle:
+                plain_book = json.load(handle)
+
+        self.assertEqual(writer.publishes, 3)
+        self.assertTrue(plain["global"]["path"].endswith(".json"))
+        self.assertEqual([offer["id"] for offer in plain_book], [listing_ids[0]])
+        self.assertEqual([offer["id"] for offer in pair_book], [offer["id"] for offer in contract_book])
+        self.assertEqual(pair_book[0]["offer_amount"], "200")
+        self.assertEqual(pair_book[0]["status"], "OPEN")
+        self.assertEqual(index["global"]["count"], 2)
+        self.assertEqual(after_take["pairs"]["con_token_a/con_token_b"]["count"], 1)
+        # The book the previous index pointed at stays for clients still fetching it
+        self.assertIn(index["pairs"]["con_token_a/con_token_b"]["path"][2:], files)
+        self.assertIn(after_take["pairs"]["con_token_a/con_token_b"]["path"][2:], files)
+
+    def test_14_recorded_trace_replays_and_compares_against_a_baseline(self):
+        self.start_market()
+        recorder = TraceRecorder(otc_name="con_otc")
+        otc = recorder.wrap(self.market.otc)
+        listing_ids = [
+            otc.list_offer(signer="maker_wallet", environment=self.market.tick(5), offer_token="con_token_a",
+                           offer_amount=Decimal(offer_amount), take_token="con_token_b", take_amount=Decimal("50.0"))
+            for offer_amount in ("100.0", "200.0")
+        ]
+        otc.take_offer(signer="taker_wallet", environment=self.market.tick(), listing_id=listing_ids[0])
+        with self.assertRaises(AssertionError):
+            otc.take_offer(signer="taker_wallet", environment=self.market.tick(), listing_id=listing_ids[0])
+        otc.cancel_offer(signer="maker_wallet", environment=self.market.tick(), listing_id=listing_ids[1])
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "session.jsonl.gz")
+            recorder.dump(path)
+            trace = load_trace(path)
+        first = replay_trace(trace)
+        second = replay_trace(trace)
+        baseline = first.baseline()
+        cheaper = json.loads(json.dumps(baseline))
+        cheaper["functions"]["take_offer"]["stamps"] -= 1
+
+        self.assertEqual([call.kwargs.get("listing_id") for call in trace], [None, None, {"$result": 0}, {"$result": 0}, {"$result": 1}])
+        self.assertEqual([call.advance for call in trace], [1, 5, 1, 1, 1])
+        self.assertEqual([call.expect["status"] for call in trace], [0, 0, 0, 1, 0])
+        self.assertEqual(first.divergences, [])
+        self.assertEqual(first.failures["take_offer"], 1)
+        self.assertEqual(first.stamps, second.stamps)
+        self.assertGreater(first.stamps["list_offer"], 0)
+        self.assertEqual(compare_baseline(second, baseline, time_tolerance=1_000), [])
+        self.assertEqual(compare_baseline(second, cheaper, time_tolerance=1_000),
+                         [("take_offer", "stamps", baseline["functions"]["take_offer"]["stamps"] - 1, second.stamps["take_offer"])])
+
+    def test_15_ohlcv_rejects_fills_without_a_block_time(self):
+        aggregator = OhlcvAggregator(resolutions=(60,))
+        aggregator.on_event({"event": "Offer", "data_indexed": {"maker": "maker_wallet", "offer_token": "con_token_a", "take_token": "con_token_b"},
+                             "data": {"id": "l1", "offer_amount": "100", "take_amount": "50"}})
+        take = {"event": "TakeOffer", "data_indexed": {"id": "l1", "taker": "taker_wallet"},
+                "data": {"offer_amount": "100", "take_amount": "50"}}
+        with self.assertRaisesRegex(ValueError, "TakeOffer event has no timestamp"):
+            aggregator.on_event(take)
+
+        aggregator.on_event({**take, "timestamp": datetime(2024, 6, 20, 10, 0, 0)})
+        self.assertEqual(aggregator.candles("con_token_a", "con_token_b", 60)[0].trades, 1)
+
+    def test_16_feed_websocket_streams_frames_and_survives_an_abrupt_disconnect(self):
+        feed = BookFeed(ListingStore())
+        offer = {"event": "Offer", "data_indexed": {"maker": "maker_wallet", "offer_token": "con_token_a", "take_token": "con_token_b"},
+                 "data": {"id": "l1", "offer_amount": "100", "take_amount": "50", "price": "5".zfill(40), "fee": 50,
+                          "date_listed": "2024-06-20 10:00:00"}}
+        key = base64.b64encode(b"0123456789abcdef").decode()
+
+        async def read_frame(reader):
+            first, second = await reader.readexactly(2)
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", await reader.readexactly(2))[0]
+            return first & 0x0F, await reader.readexactly(length)
+
+        async def scenario():
+            unhandled = []
+            asyncio.get_running_loop().set_exception_handler(lambda loop, context: unhandled.append(context))
+            server = await feed.serve(port=0)
+            reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+            writer.write((f"GET /ws?offer_token=con_token_a&take_token=con_token_b HTTP/1.1\r\nHost: localhost\r\n"
+                          f"Upgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n\r\n").encode())
+            head = (await reader.readuntil(b"\r\n\r\n")).decode()
+            snapshot = await read_frame(reader)
+            feed.on_event(offer)
+            added = await read_frame(reader)
+            mask = b"\x01\x02\x03\x04"
+            writer.write(b"\x89\x84" + mask + bytes(byte ^ mask[index] for index, byte in enumerate(b"ping")))
+            pong = await read_frame(reader)
+
+            writer.transport.abort()  # No close frame, the server's reader hits end of stream mid-frame
+            while feed.subscribers[("con_token_a", "con_token_b")]:
+                await asyncio.sleep(0.01)
+            server.close()
+            await server.wait_closed()
+            gc.collect()  # Unretrieved task exceptions are reported when the task is collected
+            return head, snapshot, added, pong, unhandled
+
+        head, snapshot, added, pong, unhandled = asyncio.run(scenario())
+
+        accept = base64.b64encode(hashlib.sha1(key.encode() + b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11").digest()).decode()
+        self.assertTrue(head.startswith("HTTP/1.1 101 Switching Protocols"))
+        self.assertIn(f"Sec-WebSocket-Accept: {accept}", head)
+        self.assertEqual(snapshot[0], 0x1)
+        self.assertEqual(json.loads(snapshot[1]), {"type": "snapshot", "seq": 0, "pair": ["con_token_a", "con_token_b"], "offers": []})
+        self.assertEqual(json.loads(added[1])["type"], "add")
+        self.assertEqual(json.loads(added[1])["id"], "l1")
+        self.assertEqual(pong, (0xA, b"ping"))
+        self.assertEqual(unhandled, [])
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -1,5 +1,22 @@
 import { getGraphqlEndpoint } from "../config";
 
+// The OTC contract stores listing amounts as integer units of 10^-8 tokens
+const AMOUNT_DECIMALS = 8;
+
+export function fromUnits(units) {
+  if (units === null || typeof units === 'undefined') return units;
+  const digits = BigInt(String(units)).toString().padStart(AMOUNT_DECIMALS + 1, '0');
+  const whole = digits.slice(0, -AMOUNT_DECIMALS);
+  const fraction = digits.slice(-AMOUNT_DECIMALS).replace(/0+$/, '');
+  return fraction ? `${whole}.${fraction}` : whole;
+}
+
+// True when the contract can hold `amount` exactly; its to_units rejects anything finer than 10^-8
+export function fitsUnits(amount) {
+  const value = Number(amount);
+  return Number.isFinite(value) && Number(value.toFixed(AMOUNT_DECIMALS)) === value;
+}
+
 export async function fetchOpenOffers(query) {
   const url = getGraphqlEndpoint();
 
@@ -21,7 +38,11 @@ export async function fetchOpenOffers(query) {
         const { key, value } = node;
         return {
             id: key.split(':')[1],
-            ...value
+            ...value,
+            offer_amount: fromUnits(value.offer_amount),
+            take_amount: fromUnits(value.take_amount),
+            maker_fee: fromUnits(value.maker_fee),
+            taker_fee: fromUnits(value.taker_fee),
         }
     });
     return openOffers;
@@ -257,6 +257,22 @@ const XianWalletUtils = {
         return balance;
     },
 
+    simulateRequest: async function(contract, method, kwargs, sender = '') {
+        // Read-only run of a contract function on the node; nothing is signed or stored
+        const payload = JSON.stringify({ sender, contract, function: method, kwargs });
+        const hex = Array.from(new TextEncoder().encode(payload), byte => byte.toString(16).padStart(2, '0')).join('');
+        const response = await fetch(`${this.rpcUrl}/abci_query?path=%22/simulate_tx/${hex}%22`);
+        if (!response.ok) {
+            throw new Error('Network response was not ok');
+        }
+        const data = await response.json();
+        const simulated = JSON.parse(window.atob(data.result.response.value));
+        if (simulated.status !== 0) {
+            throw new Error(`Simulation failed: ${simulated.result}`);
+        }
+        return simulated.result; // The function's return value as a Python repr string
+    },
+
     getTxResultsAsyncBackoff: async function(txHash, retries = 5, delay = 1000) {
         try {
             return await this.getTxResults(txHash);